@@ -14,7 +14,9 @@ import os
 __all__ = ["cache", "classes", "dataloc", "driver", "netcdfbasics",
            "operators", "period", "standard_operators", "plot_operators",
            "cmacro", "chtml", "functions", "plot",
-           "projects", "derived_variables", "ESMValTool_diags"]
+           "projects", "derived_variables", "ESMValTool_diags", "scheduler", "xarray_operators",
+           "time_chunks", "space_tiles", "crs_locks",
+           "executors", "crs_parser", "resolution_cache"]
 
 
 def tim(string=None):
@@ -60,6 +62,7 @@ if not already_inited and not onrtd:
     from . import cache
     from . import standard_operators
     from . import plot_operators
+    from . import xarray_operators
     from . import cmacro
     from . import operators
 
@@ -91,6 +94,7 @@ if not already_inited and not onrtd:
     tim("execs_cscript")
     standard_operators.load_standard_operators()
     plot_operators.load_plot_operators()
+    xarray_operators.load_xarray_operators()
     tim("load_ops")
     from . import projects
     exec("from climaf.projects  import %s" %
@@ -29,6 +29,8 @@ Main functions are :
 
  - ``cscript``  : define a new CliMAF operator (this also defines a new Python function)
 
+ - ``coperator``  : define a new in-process CliMAF operator, working on xarray DataArrays
+
  - ``cMA``      : get the Masked Array value of a CliMAF object (compute it)
 
  - ``cxr``      : get the Xarray value of a CliMAF object (compute it)
@@ -97,10 +99,10 @@ from climaf.classes import cdef, cdataset, ds, cproject, cpage, \
 from climaf.cmacro import macro
 from climaf.driver import ceval, cfile, cMA, cvalue, cimport, cexport, calias, efile, cxr
 from climaf.dataloc import dataloc
-from climaf.operators import cscript, fixed_fields
+from climaf.operators import cscript, coperator, fixed_fields
 from climaf.operators_derive import derive
 from climaf.cache import craz, csync, cdump, cdrop, clist, cls, crm, cdu, \
-    cwc, cprotect, raz_cvalues, ccost
+    cwc, cprotect, raz_cvalues, ccost, set_quota, evict
 from climaf.plot.plot_params import plot_params, hovm_params
 from climaf.plot.varlongname import varlongname
 #
@@ -15,19 +15,34 @@ import six
 import os.path
 import re
 import time
+import stat
 import pickle
 import uuid
 import hashlib
 import json
+import shutil
+import subprocess
+import concurrent.futures
+import struct
+import threading
+import zlib
 from operator import itemgetter
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
 
 import env
 from env.environment import *
 from env.clogging import clogger
-from env.utils import get_subprocess_output
 from climaf.utils import Climaf_Cache_Error, Climaf_Error
-from climaf.classes import compare_trees, cobject, cdataset, guess_projects, allow_error_on_ds, ds, cens
+from climaf.classes import compare_trees, cobject, cdataset, guess_projects, allow_error_on_ds, ds, cens, \
+    without_data_check
 from climaf.cmacro import crewrite
+from climaf.crs_parser import crs_object, crs_shape
+from climaf.cache_index import sqlite_index, crs_operator, skeleton_index
+from climaf.space_tiles import domain_includes, common_domain
+from climaf.file_metadata import forget_metadata, prune_metadata
 from climaf import __path__ as cpath
 
 # Can be False, "by_crs" or anything else. 'by_crs' means key=CRS; else means key=hash
@@ -39,14 +54,66 @@ fileNameLength = 60
 safe = False
 #: The length of subdir names when segmenting cache filenames
 directoryNameLength = 5
+#: The backend for the cache index : either 'pickle' (the index is fully loaded at startup and
+#  dumped at exit, in file cacheIndexFileName), or 'sqlite' (entries are inserted and deleted on
+#  the fly in file cacheIndexFileName+'.sqlite', see :py:mod:`~climaf.cache_index`)
+index_backend = os.getenv("CLIMAF_CACHE_INDEX_BACKEND", "pickle")
 #: The index associating filenames to CRS expressions
 crs2filename = dict()
 #: The dictionary associating CRS expressions to their evaluation
 crs2eval = dict()
+#: Should searches for including or begin objects use the skeleton index (rather than scanning the whole index)
+use_skeleton_index = True
+#: Should searches for matching objects first screen candidates on their CRS syntax tree, before
+#  building their CliMAF objects (see :py:func:`~climaf.crs_parser.crs_shape`)
+use_shape_screening = True
+#: The secondary index of cached objects, by period-free CRS and period
+#  (see :py:class:`~climaf.cache_index.skeleton_index`)
+crs_skeletons = skeleton_index()
+#: Is the skeleton index up to date with the whole cache index (beyond the CRS registered since then)
+skeletons_are_complete = False
+#: The list of CRS registered since last update of the skeleton index
+crs_to_skeletonize = list()
+#: The generation of the SQLite cache index up to which its entries are in the skeleton index
+skeletons_generation = 0
 #: The list of crs which file has been dropped since last synchronisation between in-memory index and file index
 #  (or at least since the beginning of the session)
 dropped_crs = list()
 
+#: Should files be stamped in-process when possible (NetCDF files with netCDF4, PNG files by
+#  writing tEXt chunks), rather than by external tools (ncatted, convert...)
+inprocess_stamping = True
+
+#: Number of processes used for reading CRS expressions in cache files when rebuilding the cache index
+rebuild_workers = min(8, os.cpu_count() or 1)
+#: The value returned by :py:func:`getCRS` for a file which metadata cannot be read (rather than
+#  an empty string, for a file which has no CRS expression)
+crs_read_failure = "failed"
+
+#: Size quota for the cache, in bytes (None means no quota). See :py:func:`set_quota`
+quota = None
+#: When enforcing the quota, objects are evicted until cache size is below this fraction of the quota
+quota_low_water = 0.9
+#: An estimate of the total size of cache files, in bytes (None means : not yet computed)
+cache_size = None
+#: The last time each CRS was used during this session (as returned by time.time())
+crs_last_access = dict()
+#: Number of running evaluations using each cache file (such files are not evicted)
+files_in_use = dict()
+eviction_lock = threading.RLock()
+
+#: Directory where regridding weights are cached by scripts regrid.sh and regridll.sh (through
+#  environment variable CLIMAF_REGRID_WEIGHTS). None means : sub-directory 'regrid_weights' of
+#  the current cache; an empty string disables the caching of weights. Weights files have
+#  suffix '.weights', so that they are not taken for cached objects
+regrid_weights_dir = os.getenv("CLIMAF_REGRID_WEIGHTS")
+
+#: Should :py:func:`complement` append the end object to the file of the begin object (along
+#  its record dimension, using 'ncrcat --rec_apn'), rather than writing a new NetCDF file
+#  from both. This avoids reading and re-writing the begin object data when extending a time
+#  series. Protected files and files used by a running evaluation are never modified
+append_in_place = True
+
 #: A dict containing cache index entries (as listed in index file), which
 # were up to now not interpretable, given the set of defined projects
 crs_not_yet_evaluable = dict()
@@ -63,10 +130,32 @@ def setNewUniqueCache(path, raz=True):
     env.environment.cacheIndexFileName = path + \
         "/index"  # The place to write the index
     env.environment.currentCache = path
+    if isinstance(crs2filename, sqlite_index):
+        reopen_sqlite_index()
+    reset_skeletons()
+    update_cache_size(None)
+    set_regrid_weights_dir()
     if raz:
         craz(hideError=True)
 
 
+def set_regrid_weights_dir(path=None):
+    """
+    Set the directory where regridding weights are cached, and export it to scripts
+    as CLIMAF_REGRID_WEIGHTS (see `regrid_weights_dir`). Weights files are keyed by
+    the source grid, the target grid, the method and the variable; they are shared by
+    all processes using the same directory
+    """
+    global regrid_weights_dir
+    if path is not None:
+        regrid_weights_dir = path
+    if regrid_weights_dir is None:
+        weights_dir = os.path.join(os.path.expanduser(env.environment.currentCache), "regrid_weights")
+    else:
+        weights_dir = os.path.expanduser(regrid_weights_dir)
+    os.environ["CLIMAF_REGRID_WEIGHTS"] = weights_dir
+
+
 def generateUniqueFileName(expression, format="nc", option="new", create_dirs=True):
     """
     Generate a filename path from string EXPRESSION and FILEFORMAT,
@@ -168,6 +257,84 @@ def searchFile(path):
             return candidate
 
 
+def climaf_stamp():
+    return "CLImate Model Assessment Framework version %s (http://climaf.rtfd.org)" % climaf_version
+
+
+def stamp_netcdf(filename, crs):
+    """
+    Writes global attributes 'CRS_def' and 'CliMAF' in NetCDF file FILENAME, using
+    netCDF4 in append mode. Returns False if this is not possible
+    """
+    # Mode 'a' would create a missing file
+    if netCDF4 is None or not os.path.exists(filename):
+        return False
+    try:
+        with netCDF4.Dataset(filename, "a") as dataset:
+            dataset.setncattr("CRS_def", crs)
+            dataset.setncattr("CliMAF", climaf_stamp())
+        return True
+    except Exception as e:
+        clogger.debug("Cannot stamp %s with netCDF4 : %s" % (filename, str(e)))
+        return False
+
+
+png_signature = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + \
+        struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def stamp_png(filename, crs):
+    """
+    Writes tEXt chunks 'CRS_def' and 'CliMAF' in PNG file FILENAME (replacing
+    existing ones), as does 'convert -set'. Returns False if this is not possible
+    """
+    try:
+        texts = [(b"CRS_def", crs.encode("latin-1")), (b"CliMAF", climaf_stamp().encode("latin-1"))]
+        with open(filename, "rb") as f:
+            content = f.read()
+    except (IOError, OSError, UnicodeEncodeError) as e:
+        clogger.debug("Cannot stamp %s in-process : %s" % (filename, str(e)))
+        return False
+    if not content.startswith(png_signature):
+        return False
+    keywords = [keyword for keyword, _ in texts]
+    chunks = [png_signature]
+    pos = len(png_signature)
+    while pos + 8 <= len(content):
+        length, chunk_type = struct.unpack(">I4s", content[pos:pos + 8])
+        end = pos + 12 + length
+        if end > len(content):
+            return False
+        if not (chunk_type == b"tEXt" and content[pos + 8:end - 4].split(b"\0")[0] in keywords):
+            chunks.append(content[pos:end])
+        if chunk_type == b"IHDR":
+            chunks.extend([_png_chunk(b"tEXt", keyword + b"\0" + text) for keyword, text in texts])
+        pos = end
+    tmpfile = filename + ".stamp"
+    with open(tmpfile, "wb") as f:
+        f.write(b"".join(chunks))
+    os.replace(tmpfile, filename)
+    return True
+
+
+def stamp_in_process(filename, crs):
+    """
+    Stamps FILENAME with CRS without launching an external tool, if FILENAME type allows for
+    it (see `inprocess_stamping`). Returns True if done
+    """
+    if not inprocess_stamping:
+        return False
+    if re.findall(".nc$", filename):
+        return stamp_netcdf(filename, crs)
+    elif re.findall(".png$", filename):
+        return stamp_png(filename, crs)
+    return False
+
+
 def register(filename, crs, costs, outfilename=None):
     """
     Adds in FILE a metadata named 'CRS_def' and with value CRS, and a
@@ -184,22 +351,35 @@ def register(filename, crs, costs, outfilename=None):
         if outfilename is None:
             clogger.info("%s registered as %s" % (crs, filename))
             crs2filename[crs] = (filename, costs)
+            crs_to_skeletonize.append(crs)
             if crs in dropped_crs:
                 dropped_crs.remove(crs)
+            account_for_new_file(crs, filename)
             return True
         else:
-            cmd = 'mv -f %s %s ' % (filename, outfilename)
-            if os.system(cmd) == 0:
+            try:
+                try:
+                    os.replace(filename, outfilename)
+                except OSError:
+                    # e.g. when moving across file systems
+                    shutil.move(filename, outfilename)
+                moved = True
+            except (IOError, OSError) as e:
+                clogger.error("Cannot move %s as %s : %s" % (filename, outfilename, str(e)))
+                moved = False
+            if moved:
                 clogger.info("moved %s as %s " % (filename, outfilename))
                 clogger.info("%s registered as %s" % (crs, outfilename))
                 crs2filename[crs] = (outfilename, costs)
+                crs_to_skeletonize.append(crs)
                 if crs in dropped_crs:
                     dropped_crs.remove(crs)
+                account_for_new_file(crs, outfilename)
                 return True
             else:
                 # clogger.critical("cannot move by" % cmd)
                 raise Climaf_Cache_Error(
-                    "cannot move (possibly after stamping) by %s" % cmd)
+                    "cannot move %s as %s (possibly after stamping)" % (filename, outfilename))
 
     global dropped_crs
     #
@@ -218,6 +398,9 @@ def register(filename, crs, costs, outfilename=None):
             return do_move(crs, filename, outfilename)
         else:
             # while time.time() < os.path.getmtime(filename) + 0.2 : time.sleep(0.2)
+            if stamp_in_process(filename, crs):
+                clogger.debug("%s stamped in-process" % filename)
+                return do_move(crs, filename, outfilename)
             if re.findall(".nc$", filename) and ncatted_software is not None:
                 command = "%s -h -a CRS_def,global,o,c,\"%s\" -a CliMAF,global,o,c,\"CLImate Model Assessment " \
                           "Framework version %s (http://climaf.rtfd.org)\" %s" % (ncatted_software, crs, climaf_version,
@@ -265,29 +448,131 @@ def register(filename, crs, costs, outfilename=None):
                         return True
 
 
-def getCRS(filename):
-    """ Returns the CRS expression found in FILENAME's meta-data"""
-    if re.findall(".nc$", filename):
-        form = 'ncdump -h %s | grep -E "CRS_def *=" | ' + \
-               'sed -r -e "s/.*:CRS_def *= *\\\"(.*)\\\" *;$/\\1/" '
-    elif re.findall(".png$", filename):
-        form = 'identify -verbose %s | grep -E " *CRS_def: " | sed -r -e "s/.*CRS_def: *//"'
-    elif re.findall(".pdf$", filename):
-        form = 'pdfinfo %s | grep "Keywords" | awk -F ":" \'{print $2}\' | sed "s/^ *//g"'
-    elif re.findall(".eps$", filename):
-        form = 'exiv2 -p x %s | grep "CRS_def" | awk \'{for (i=4;i<=NF;i++) {print $i " "} }\' '
-    else:
-        clogger.error("unknown filetype for %s" % filename)
-        return None
-    command = form % filename
+def read_png_texts(filename):
+    """
+    Returns a dict of the text metadata (tEXt, zTXt and iTXt chunks) in PNG file FILENAME,
+    reading chunks up to the image data. Raises ValueError if FILENAME is not a PNG file
+    """
+    rep = dict()
+    with open(filename, "rb") as f:
+        if f.read(len(png_signature)) != png_signature:
+            raise ValueError("%s is not a PNG file" % filename)
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack(">I4s", header)
+            if chunk_type in [b"IDAT", b"IEND"]:
+                break
+            data = f.read(length)
+            f.seek(4, 1)
+            if chunk_type == b"tEXt":
+                keyword, text = data.split(b"\0", 1)
+                rep[keyword.decode("latin-1")] = text.decode("latin-1")
+            elif chunk_type == b"zTXt":
+                keyword, text = data.split(b"\0", 1)
+                rep[keyword.decode("latin-1")] = zlib.decompress(text[1:]).decode("latin-1")
+            elif chunk_type == b"iTXt":
+                keyword, text = data.split(b"\0", 1)
+                compressed = text[0:1] == b"\1"
+                text = text[2:].split(b"\0", 2)[-1]
+                if compressed:
+                    text = zlib.decompress(text)
+                rep[keyword.decode("latin-1")] = text.decode("utf-8")
+    return rep
+
+
+def read_crs(filename):
+    """
+    Returns the CRS expression found in FILENAME's meta-data, reading it in-process
+    (NetCDF header, PNG text chunks, PDF Keywords, EPS XMP packet). Returns an empty
+    string if the file could be read but has no CRS_def metadata, and None if this is
+    not possible in-process (unknown format, no netCDF4 module, or read error)
+    """
     try:
-        rep = get_subprocess_output(command, to_replace=[("\n", "")])
-        if (rep == "") and ('Empty.png' not in filename):
-            clogger.error("file %s is not well formed (no CRS)" % filename)
         if re.findall(".nc$", filename):
-            rep = rep.replace(r"\'", r"'")
-    except:
-        rep = "failed"
+            if netCDF4 is None:
+                return None
+            with netCDF4.Dataset(filename) as dataset:
+                if "CRS_def" in dataset.ncattrs():
+                    return str(dataset.getncattr("CRS_def"))
+            return ""
+        elif re.findall(".png$", filename):
+            return read_png_texts(filename).get("CRS_def", "")
+        elif re.findall(".pdf$", filename) or re.findall(".eps$", filename):
+            with open(filename, "rb") as f:
+                content = f.read().decode("latin-1")
+            if re.findall(".pdf$", filename):
+                # Info dictionary entry, as written by pdftk; the last one is the up to date one
+                found = re.findall(r"/Keywords\s*\(((?:[^()\\]|\\.)*)\)", content)
+                if found:
+                    return re.sub(r"\\(.)", r"\1", found[-1])
+            else:
+                found = re.findall(r"CRS_def(?:=\"([^\"]*)\"|>([^<]*)</)", content)
+                if found:
+                    return "".join(found[-1]).replace("&apos;", "'").replace("&quot;", '"')\
+                        .replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+            return ""
+    except Exception as e:
+        clogger.debug("Cannot read CRS in %s in-process : %s" % (filename, str(e)))
+    return None
+
+
+def crs_in_tool_output(filename, output):
+    """
+    Returns the CRS expression found in OUTPUT, the output of the metadata dump
+    tool for FILENAME (see :py:func:`getCRS`), or an empty string
+    """
+    for line in output.splitlines():
+        if re.findall(".nc$", filename):
+            found = re.findall(r':CRS_def *= *"(.*)" *;$', line)
+            if found:
+                return found[0].replace(r"\'", r"'")
+        elif re.findall(".png$", filename):
+            found = re.findall(r"^ *CRS_def: *(.*)$", line)
+            if found:
+                return found[0]
+        elif re.findall(".pdf$", filename):
+            if line.startswith("Keywords"):
+                return line.partition(":")[2].lstrip(" ")
+        elif "CRS_def" in line:
+            return " ".join(line.split()[3:])
+    return ""
+
+
+def getCRS(filename):
+    """
+    Returns the CRS expression found in FILENAME's meta-data, or an empty string if it
+    has no such metadata, or `crs_read_failure` if its metadata cannot be read (in
+    which case the file should not be considered as malformed)
+    """
+    rep = read_crs(filename)
+    if rep is None:
+        if re.findall(".nc$", filename):
+            form = "ncdump -h %s"
+        elif re.findall(".png$", filename):
+            form = "identify -verbose %s"
+        elif re.findall(".pdf$", filename):
+            form = "pdfinfo %s"
+        elif re.findall(".eps$", filename):
+            form = "exiv2 -p x %s"
+        else:
+            clogger.error("unknown filetype for %s" % filename)
+            return None
+        command = form % filename
+        try:
+            process = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     universal_newlines=True)
+        except (OSError, ValueError) as e:
+            clogger.error("Cannot read metadata of %s using %s : %s" % (filename, command, str(e)))
+            return crs_read_failure
+        if process.returncode != 0:
+            # The file may be unreadable for the moment (e.g. file system issue) or the tool unavailable
+            clogger.error("Cannot read metadata of %s using %s : %s" % (filename, command, process.stderr))
+            return crs_read_failure
+        rep = crs_in_tool_output(filename, process.stdout)
+    if (rep == "") and ('Empty.png' not in filename):
+        clogger.error("file %s is not well formed (no CRS)" % filename)
     clogger.debug("CRS expression read in %s is %s" % (filename, rep))
     return rep
 
@@ -300,12 +585,106 @@ def rename(filename, crs):
         costs = 0.
         for c in [f for f in crs2filename if crs2filename[f][0] in [filename, alternate_filename(filename)]]:
             _, costs = crs2filename.pop(c)
+            update_cache_size(-os.path.getsize(filename))
         os.rename(filename, newfile)
         register(newfile, crs, costs)
         return newfile
 
 
-def hasMatchingObject(cobject, ds_func):
+def crs_to_object(crs):
+    """
+    Returns the CliMAF object represented by CRS (memoized in crs2eval), or None
+    if it cannot be evaluated
+    """
+    co = crs2eval.get(crs, None)
+    if co is None:
+        try:
+            # Do not change env.environment.data_check, which other threads may use
+            with without_data_check():
+                co = crs_object(crs)
+        except Exception:
+            return None  # usually case of a CRS which project is not currently defined
+        if co:
+            crs2eval[crs] = co
+    return co
+
+
+def reset_skeletons():
+    """
+    Forget the content of the skeleton index; it will be rebuilt on next search
+    """
+    global skeletons_are_complete
+    crs_skeletons.clear()
+    skeletons_are_complete = False
+
+
+def update_skeletons():
+    """
+    Records in the skeleton index those entries of the cache index which are not yet
+    there. A full scan of the cache index occurs only for the first search after
+    an index reset; afterwards, only newly registered CRS are processed, together
+    with, for the SQLite backend, the entries inserted by other sessions since
+    last update
+    """
+    global skeletons_are_complete, skeletons_generation
+    incremental = isinstance(crs2filename, sqlite_index)
+    if not skeletons_are_complete:
+        if incremental:
+            skeletons_generation = crs2filename.generation()
+        crs_list = list(crs2filename)
+        skeletons_are_complete = True
+    elif incremental:
+        crs_list, skeletons_generation = crs2filename.crs_since(skeletons_generation)
+    else:
+        crs_list = []
+    while crs_to_skeletonize:
+        crs_list.append(crs_to_skeletonize.pop())
+    for crs in crs_list:
+        if crs not in crs_skeletons:
+            co = crs_to_object(crs)
+            if co:
+                crs_skeletons.add(crs, co)
+
+
+def skeleton_candidates(cobject, option):
+    """
+    Returns the list of CRS of cached objects which may include COBJECT (if OPTION is
+    'including'), begin COBJECT (if OPTION is 'begin') or be COBJECT on another domain
+    (if OPTION is 'including_domain'), according to the skeleton index
+    """
+    update_skeletons()
+    rep = list()
+    for crs in crs_skeletons.candidates(cobject, option):
+        if crs in crs2filename:
+            rep.append(crs)
+        else:
+            # Object has been dropped since
+            crs_skeletons.discard(crs)
+    return rep
+
+
+def operator_flags(operator):
+    """
+    Returns the flags of OPERATOR, a script or an in-process operator, or None
+    """
+    if operator in cscripts:
+        return cscripts[operator].flags
+    if operator in operators:
+        return operators[operator].flags
+    return None
+
+
+def op_squeezes_time(operator):
+    flags = operator_flags(operator)
+    return flags is None or not flags.commuteWithTimeConcatenation
+
+
+def op_squeezes_space(operator):
+    flags = operator_flags(operator)
+    return flags is None or not flags.commuteWithSpaceConcatenation
+
+
+def hasMatchingObject(cobject, ds_func, candidates=None, filter_on_operator=op_squeezes_time):
     """
     If the cache holds a file which represents an object with the
     same nodes as COBJECT and which leaves/datasets, when paired with
@@ -314,34 +693,36 @@ def hasMatchingObject(cobject, ds_func):
     this value (for the first one in dict crs2filename)
 
     Can be applied for finding same object with included or including
-    time-period
+    time-period (or domain, using FILTER_ON_OPERATOR=op_squeezes_space)
+
+    If CANDIDATES is not None, it is the list of the CRS of the cached objects to
+    consider; otherwise, all objects with same top-level operator are considered.
+    Candidates which syntax tree does not have the same shape as COBJECT's one (see
+    `use_shape_screening`) are discarded without building their object
     """
 
     # First read index from file if it is yet empty - No : done at startup
     # if len(crs2filename.keys()) == 0 : cload()
-    def op_squeezes_time(operator):
-        return not cscripts[operator].flags.commuteWithTimeConcatenation
-
     #
-    global crs2eval
     key_to_rm = list()
-    for crs in crs2filename:
-        # First, basic, screening
-        if crs.split("(")[0] != cobject.crs.split("(")[0]:
-            continue
-        co = crs2eval.get(crs, None)
-        if co is None:
-            try:
-                save = env.environment.data_check
-                env.environment.data_check = False
-                co = eval(crs, sys.modules['__main__'].__dict__)
-                env.environment.data_check = save
-            except:
-                continue  # usually case of a CRS which project is not currently defined
+    if candidates is None:
+        # First, basic, screening on the top-level operator
+        operator = crs_operator(cobject.crs)
+        if isinstance(crs2filename, sqlite_index):
+            candidates = crs2filename.crs_with_operator(operator)
+        else:
+            # Iterate on a copy, as the index may be updated by concurrent evaluations
+            candidates = [crs for crs in list(crs2filename) if crs_operator(crs) == operator]
+    shape = crs_shape(cobject.crs) if use_shape_screening else None
+    for crs in candidates:
+        if shape is not None:
+            candidate_shape = crs_shape(crs)
+            if candidate_shape is not None and candidate_shape != shape:
+                continue
+        co = crs_to_object(crs)
         if co:
-            crs2eval[crs] = co
             # clogger.debug("Compare trees for %s and %s" % (crs, cobject.crs))
-            altperiod = compare_trees(co, cobject, ds_func, op_squeezes_time)
+            altperiod = compare_trees(co, cobject, ds_func, filter_on_operator)
             if altperiod:
                 f, costs = crs2filename[crs]
                 if os.path.exists(f) or os.path.exists(alternate_filename(f)):
@@ -351,7 +732,7 @@ def hasMatchingObject(cobject, ds_func):
                         "Removing %s from cache index, because file is missing", crs)
                     key_to_rm.append(crs)
     for el in key_to_rm:
-        crs2filename.pop(el)
+        crs2filename.pop(el, None)
     return None, None
 
 
@@ -361,18 +742,47 @@ def hasIncludingObject(cobject):
             return includer.period.includes(included.period)
 
     clogger.debug("search for including object for " + repr(cobject))
+    if use_skeleton_index:
+        return hasMatchingObject(cobject, ds_period_difference, skeleton_candidates(cobject, "including"))
     return hasMatchingObject(cobject, ds_period_difference)
 
 
+def hasIncludingDomainObject(cobject):
+    """
+    If the cache holds the same object as COBJECT, except for the domain of its datasets
+    which is larger (e.g. 'global'), and if all operators involved commute with space
+    concatenation, returns this object and the domain of COBJECT datasets (as a list
+    [latmin, latmax, lonmin, lonmax]); otherwise returns None, None
+    """
+    def ds_domain_included(includer, included):
+        if not isinstance(included.domain, list) or includer.domain == included.domain:
+            return None
+        if dict([(k, repr(v)) for k, v in includer.kvp.items() if k != 'domain']) != \
+                dict([(k, repr(v)) for k, v in included.kvp.items() if k != 'domain']):
+            return None
+        if domain_includes(includer.domain, included.domain):
+            return included.domain
+
+    if not isinstance(common_domain(cobject), list):
+        return None, None
+    clogger.debug("search for including domain object for " + repr(cobject))
+    if use_skeleton_index:
+        return hasMatchingObject(cobject, ds_domain_included, skeleton_candidates(cobject, "including_domain"),
+                                 filter_on_operator=op_squeezes_space)
+    return hasMatchingObject(cobject, ds_domain_included, filter_on_operator=op_squeezes_space)
+
+
 def hasBeginObject(cobject):
     def ds_period_begins(begin, longer):
         if longer.buildcrs(period="") == begin.buildcrs(period=""):
             return longer.period.start_with(begin.period)
 
+    if use_skeleton_index:
+        return hasMatchingObject(cobject, ds_period_begins, skeleton_candidates(cobject, "begin"))
     return hasMatchingObject(cobject, ds_period_begins)
 
 
-def hasExactObject(cobject):
+def hasExactObject(cobject, warn=True):
     i = 0
     found = False
     formats_to_test = known_formats + graphic_formats
@@ -390,12 +800,14 @@ def hasExactObject(cobject):
                 i += 1
     if found and f is not None:
         crs = cobject.crs
+        crs_last_access[crs] = time.time()
         # if isinstance(cobject, cdataset):
         #    crs = "select(" + crs + ")"
         if crs not in crs2filename:
-            clogger.warning("Next object exists in cache but was not "
-                            "registered in index. Assuming its compute cost is zero. "
-                            "Use cdrop if this is inadequate. Object %s" % crs)
+            if warn:
+                clogger.warning("Next object exists in cache but was not "
+                                "registered in index. Assuming its compute cost is zero. "
+                                "Use cdrop if this is inadequate. Object %s" % crs)
             crs2filename[crs] = (f, compute_cost())
         return crs2filename[crs]
         # return f
@@ -403,7 +815,7 @@ def hasExactObject(cobject):
         if cobject.crs in crs2filename:
             clogger.debug(
                 "Dropping cobject.crs from cache index, because file is missing")
-            crs2filename.pop(cobject.crs)
+            crs2filename.pop(cobject.crs, None)
         return None, compute_cost()
 
 
@@ -412,6 +824,9 @@ def complement(crsb, crse, crs):
     with file object of CRSE (E for 'end') for creating file object of
     CRS. Assumes that everything is OK with args compatibility and
     file contents
+
+    If possible (see `append_in_place`), the file of CRSB is extended in
+    place and becomes the file for CRS
     """
     fileb, costsb = crs2filename[crsb]
     if not os.path.exists(fileb):
@@ -423,6 +838,8 @@ def complement(crsb, crse, crs):
     costs = compute_cost()
     costs.add(costsb)
     costs.add(costse)
+    if can_append_in_place(fileb):
+        return append(crsb, fileb, crse, filee, crs, filet, costs)
     tim1 = time.time()
     command = "ncrcat -O %s %s %s" % (fileb, filee, filet)
     duration = time.time() - tim1
@@ -438,6 +855,102 @@ def complement(crsb, crse, crs):
         return filet, costs
 
 
+def can_append_in_place(filename):
+    """
+    True if records can be appended in place to NetCDF file FILENAME : `append_in_place`
+    is set, the file is writable and not used by a running evaluation, and has an
+    unlimited dimension
+    """
+    if not append_in_place or netCDF4 is None or not filename.endswith(".nc") or \
+            is_protected(filename) or filename in files_in_use:
+        return False
+    try:
+        with netCDF4.Dataset(filename) as dataset:
+            return any([dim.isunlimited() for dim in dataset.dimensions.values()])
+    except Exception:
+        return False
+
+
+def records_count(filename):
+    """
+    Returns the length of the unlimited dimension of NetCDF file FILENAME, or None
+    """
+    try:
+        with netCDF4.Dataset(filename) as dataset:
+            for dim in dataset.dimensions.values():
+                if dim.isunlimited():
+                    return len(dim)
+    except Exception:
+        pass
+    return None
+
+
+def append(crsb, fileb, crse, filee, crs, filet, costs):
+    # Moves FILEB (for CRSB) to a temporary name, appends the records of FILEE (for CRSE)
+    # to it, and registers it as FILET for CRS. The cost does not depend on the size of
+    # FILEB. If the append fails before the records of FILEB are changed, FILEB is moved
+    # back and CRSB stays valid
+    root, fmt = os.path.splitext(filet)
+    tmpfile = "%s_%s%s" % (root, uuid.uuid4().hex, fmt)
+    records = records_count(fileb)
+    size = os.path.getsize(fileb)
+    tim1 = time.time()
+    try:
+        os.replace(fileb, tmpfile)
+    except OSError as e:
+        clogger.error("Cannot move %s as %s : %s" % (fileb, tmpfile, str(e)))
+        return None, costs
+    command = "ncrcat --rec_apn %s %s" % (filee, tmpfile)
+    appended = os.system(command) == 0
+    if not appended:
+        clogger.error("Issue when appending %s to %s (using command:%s)" % (crse, crsb, command))
+        if records is not None and records_count(tmpfile) == records:
+            os.replace(tmpfile, fileb)
+            return None, costs
+        clogger.error("File of %s was altered, and is dropped" % crsb)
+        os.remove(tmpfile)
+    else:
+        costs.increment(time.time() - tim1)
+    # The file of CRSB has moved : forget it
+    forget_metadata(fileb)
+    update_cache_size(-size)
+    cdrop(crsb)
+    try:
+        os.rmdir(os.path.dirname(fileb))
+    except OSError:
+        pass
+    if not appended:
+        return None, costs
+    register(tmpfile, crs, costs, outfilename=filet)
+    cdrop(crse)
+    return filet, costs
+
+
+def concatenate(crss, crs):
+    """ Concatenates along time the file objects of the list of CRS CRSS
+    (which periods are consecutive) for creating file object of CRS.
+    Unlike :py:func:`complement`, the concatenated objects are kept in cache
+    """
+    files = list()
+    costs = compute_cost()
+    for crsi in crss:
+        filei, costsi = crs2filename[crsi]
+        if not os.path.exists(filei):
+            filei = alternate_filename(filei)
+        files.append(filei)
+        costs.add(costsi)
+    filet = generateUniqueFileName(crs)
+    command = "ncrcat -O %s %s" % (" ".join(files), filet)
+    tim1 = time.time()
+    if os.system(command) != 0:
+        clogger.error("Issue when concatenating %s in %s (using command:%s)" % (
+            " ".join(crss), crs, command))
+        return None, costs
+    costs.increment(time.time() - tim1)
+    register(filet, crs, costs)
+    return filet, costs
+
+
 def cdrop(obj, rm=True, force=False):
     """
     Deletes the cached file for a CliMAF object, if it exists
@@ -492,7 +1005,10 @@ def cdrop(obj, rm=True, force=False):
                     clogger.info("Object %s is protected, file is %s" % (crs,fil))
                     return
                 path_file = os.path.dirname(fil)
+                size = os.path.getsize(fil)
                 os.remove(fil)
+                forget_metadata(fil)
+                update_cache_size(-size)
                 crs2filename.pop(crs)
                 dropped_crs.append(crs)
                 try:
@@ -543,6 +1059,191 @@ def cprotect(obj, stop=False):
         clogger.info("%s is not (yet) cached; use cfile() to cache it" % crs)
 
 
+def parse_size(size):
+    """
+    Returns the number of bytes represented by SIZE, which can be a number, or a
+    string such as '500G', '20M', '1.5T' or '300k'
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    units = {"": 1, "c": 1, "k": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    match = re.match(r"^ *([0-9.]+) *([ckMGT]?)[Bo]? *$", str(size))
+    if match is None:
+        raise Climaf_Cache_Error("Cannot interpret %s as a size (e.g. '500G', '20M')" % size)
+    return int(float(match.group(1)) * units[match.group(2)])
+
+
+def set_quota(size=None):
+    """
+    Set a size quota for the CliMAF cache. Each time a result is registered in the
+    cache, objects are evicted if the cache size exceeds the quota, until the cache
+    size is below a fraction of the quota (see `quota_low_water`). See
+    :py:func:`~climaf.cache.evict` for the choice of evicted objects
+
+    Args:
+     size (str or int) : the quota, e.g. '500G', '20M', '1T', or a number of bytes;
+      None means no quota
+
+    Example ::
+
+    >>> set_quota('500G')
+
+    """
+    global quota
+    if size is None:
+        quota = None
+    else:
+        quota = parse_size(size)
+        enforce_quota()
+
+
+def update_cache_size(delta):
+    """
+    Update the estimate of cache size with DELTA bytes; DELTA=None forces a
+    recomputation on next quota check
+    """
+    global cache_size
+    with eviction_lock:
+        if delta is None:
+            cache_size = None
+        elif cache_size is not None:
+            cache_size = max(0, cache_size + delta)
+
+
+def account_for_new_file(crs, filename):
+    """
+    Account for a new cache FILENAME (representing CRS) w.r.t. the cache quota
+    """
+    crs_last_access[crs] = time.time()
+    if quota is not None:
+        if os.path.exists(filename):
+            update_cache_size(os.path.getsize(filename))
+        # The new file is about to be returned to the caller : it is not evicted
+        enforce_quota(keep=[crs])
+
+
+def use_files(filenames):
+    """
+    Declare that cache files FILENAMES are used by a running evaluation, and must not
+    be evicted. FILENAMES is a list of strings, each one possibly including
+    space-separated filenames, or of lists of such strings
+    """
+    with eviction_lock:
+        for filename in _flatten_filenames(filenames):
+            files_in_use[filename] = files_in_use.get(filename, 0) + 1
+
+
+def release_files(filenames):
+    """
+    Declare that cache files FILENAMES are no more used by an evaluation (see use_files)
+    """
+    with eviction_lock:
+        for filename in _flatten_filenames(filenames):
+            count = files_in_use.get(filename, 0) - 1
+            if count > 0:
+                files_in_use[filename] = count
+            else:
+                files_in_use.pop(filename, None)
+
+
+def _flatten_filenames(filenames):
+    rep = list()
+    for elt in filenames:
+        if isinstance(elt, (list, tuple)):
+            rep.extend(_flatten_filenames(elt))
+        elif isinstance(elt, six.string_types):
+            rep.extend(elt.split())
+    return rep
+
+
+def is_protected(filename):
+    """
+    True if cache file FILENAME is protected (see :py:func:`cprotect`). Tests the
+    permission bits, rather than access rights, which do not apply to root
+    """
+    return not (os.stat(filename).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def eviction_score(crs, filename, costs, now=None):
+    """
+    The score of a cached object for eviction : the higher, the sooner evicted. It is
+    the product of the file size and of the time since last use, divided by the compute
+    cost (plus one second). Large, old and cheap to recompute objects thus go first
+    """
+    if now is None:
+        now = time.time()
+    st = os.stat(filename)
+    last_access = crs_last_access.get(crs, max(st.st_atime, st.st_mtime))
+    age = max(1., now - last_access)
+    tc = getattr(costs, "tc", 0.) or 0.
+    return st.st_size * age / (tc + 1.)
+
+
+def evict(target=None, keep=()):
+    """
+    Evict objects from the CliMAF cache until its size is below TARGET bytes (which
+    defaults to `quota_low_water` times the quota set by :py:func:`set_quota`).
+
+    Objects are evicted in the order of their score (see :py:func:`eviction_score`).
+    Protected objects (see :py:func:`cprotect`), files used by a running evaluation
+    and objects which CRS is in list KEEP are not evicted. Evicted objects are removed
+    from the cache index
+
+    Returns the list of the CRS of evicted objects
+    """
+    global cache_size
+    if target is None:
+        if quota is None:
+            return []
+        target = int(quota * quota_low_water)
+    else:
+        target = parse_size(target)
+    evicted = list()
+    with eviction_lock:
+        now = time.time()
+        total = 0
+        scored = list()
+        for crs, (filename, costs) in list(crs2filename.items()):
+            if not os.path.exists(filename):
+                filename = alternate_filename(filename)
+                if not os.path.exists(filename):
+                    continue
+            size = os.path.getsize(filename)
+            total += size
+            if crs in keep or filename in files_in_use or is_protected(filename):
+                continue
+            scored.append((eviction_score(crs, filename, costs, now), size, crs))
+        scored.sort(reverse=True)
+        for _, size, crs in scored:
+            if total <= target:
+                break
+            if cdrop(crs, force=False):
+                clogger.info("Evicted from cache : %s" % crs)
+                evicted.append(crs)
+                crs_last_access.pop(crs, None)
+                total -= size
+        cache_size = total
+    if total > target:
+        clogger.warning("Cache size (%d bytes) is still above target (%d bytes) after eviction, "
+                        "because of protected or in-use objects" % (total, target))
+    return evicted
+
+
+def enforce_quota(keep=()):
+    """
+    Evict objects if the cache size exceeds the quota (see :py:func:`set_quota`),
+    except those which CRS is in list KEEP
+    """
+    global cache_size
+    if quota is None:
+        return
+    with eviction_lock:
+        if cache_size is None:
+            cache_size = sum([os.path.getsize(f) for f, _ in list(crs2filename.values()) if os.path.exists(f)])
+        if cache_size > quota:
+            evict(keep=keep)
+
+
 def csync(update=False):
     """
     Merges current in-memory cache index and current on-file cache index
@@ -562,11 +1263,12 @@ def csync(update=False):
     global dropped_crs
     global crs2filename
 
-    # Merge index on file and index in memory
-    file_index = cload(True)
-    for crs in dropped_crs:
-        file_index.pop(crs, None)
-    crs2filename.update(file_index)
+    # Merge index on file and index in memory (a SQLite index is always up to date on file)
+    if not isinstance(crs2filename, sqlite_index):
+        file_index = cload(True)
+        for crs in dropped_crs:
+            file_index.pop(crs, None)
+        crs2filename.update(file_index)
 
     # check if cache index is up to date; if not enforce consistency
     if update:
@@ -591,41 +1293,85 @@ def csync(update=False):
                 # else :
                 # Should also remove empty files, as soon as
                 # file creation will be atomic enough
+    reset_skeletons()
+    prune_metadata(force=False)
     # Save index to disk
-    fn = os.path.expanduser(env.environment.cacheIndexFileName)
-    with open(fn, "wb") as cacheIndexFile:
-        pickle.dump(crs2filename, cacheIndexFile)
+    if not isinstance(crs2filename, sqlite_index):
+        fn = os.path.expanduser(env.environment.cacheIndexFileName)
+        with open(fn, "wb") as cacheIndexFile:
+            pickle.dump(crs2filename, cacheIndexFile)
     dropped_crs = list()
 
 
+def read_pickle_index():
+    """
+    Returns the content of the pickle file index, as a dict like crs2filename
+    """
+    cacheFilen = os.path.expanduser(env.environment.cacheIndexFileName)
+    if not os.path.exists(cacheFilen):
+        clogger.debug("no index file yet")
+        return {}
+    with open(cacheFilen, "rb") as cacheIndexFile:
+        rep = pickle.load(cacheIndexFile)
+    for c in rep:
+        f = rep[c]
+        if type(f) is tuple:
+            f, costs = f
+        else:
+            costs = compute_cost()
+        if len(f.split("/")[-2]) == directoryNameLength:
+            f = alternate_filename(f)
+        rep[c] = (f, costs)
+    return rep
+
+
+def open_sqlite_index():
+    """
+    Returns the SQLite cache index for current cache. When creating it, migrate
+    the content of the pickle file index, if any (this occurs only once)
+    """
+    index = sqlite_index(env.environment.cacheIndexFileName + ".sqlite", compute_cost)
+    if index.is_new:
+        pickled = read_pickle_index()
+        if len(pickled) > 0:
+            clogger.info("Migrating %d entries from pickle index %s to %s" %
+                         (len(pickled), env.environment.cacheIndexFileName, index.filename))
+            index.update(pickled)
+    return index
+
+
+def reopen_sqlite_index():
+    """
+    Close the SQLite cache index and re-open it, e.g. when the cache location has changed,
+    or when the index file has been erased
+    """
+    global crs2filename
+    if isinstance(crs2filename, sqlite_index):
+        crs2filename.close()
+    crs2filename = open_sqlite_index()
+
+
 def cload(alt=None):
     global crs2filename
     global crs_not_yet_evaluable
     rep = dict()
 
+    if index_backend in ["sqlite", ]:
+        # Entries are read on request : just open the index
+        if not isinstance(crs2filename, sqlite_index):
+            crs2filename = open_sqlite_index()
+        if alt:
+            return crs2filename.copy()
+        return
     if len(crs2filename) != 0 and not alt:
         raise Climaf_Cache_Error(
             "attempt to reset cache index - would lead to inconsistency !")
-    cacheFilen = os.path.expanduser(env.environment.cacheIndexFileName)
-    if not os.path.exists(cacheFilen):
-        clogger.debug("no index file yet")
-        return {}
-    with open(cacheFilen, "rb") as cacheIndexFile:
-        rep = pickle.load(cacheIndexFile)
-        for c in rep:
-            f = rep[c]
-            if type(f) is tuple:
-                f, costs = f
-            else:
-                costs = compute_cost()
-            if len(f.split("/")[-2]) == directoryNameLength:
-                f = alternate_filename(f)
-            rep[c] = (f, costs)
-        #
-        if alt:
-            return rep
-        else:
-            crs2filename = rep
+    rep = read_pickle_index()
+    if alt:
+        return rep
+    else:
+        crs2filename = rep
+        reset_skeletons()
     #
     must_check_index_entries = False
     if must_check_index_entries:
@@ -636,9 +1382,10 @@ def cload(alt=None):
         allow_error_on_ds()
         for crs in list(crs2filename.keys()):
             try:
-                # print "evaluating crs="+crs
-                eval(crs, sys.modules['__main__'].__dict__)
-            except:
+                valid = crs_object(crs) is not None
+            except Exception:
+                valid = False
+            if not valid:
                 print("Inconsistent cache object is skipped : %s" % crs)
                 # clogger.debug("Inconsistent cache object is skipped : %s"%crs)
                 p = guess_projects(crs)
@@ -666,11 +1413,13 @@ def cload_for_project(project):
     d = crs_not_yet_evaluable[project]
     for crs in d.copy():
         try:
-            # print "evaluating crs="+crs
-            eval(crs, sys.modules['__main__'].__dict__)
+            valid = crs_object(crs) is not None
+        except Exception:
+            valid = False
+        if valid:
             crs2filename[crs] = d[crs]
             d.pop(crs)
-        except:
+        else:
             clogger.error(
                 "CRS expression %s is not valid for project %s" % (crs, project))
 
@@ -691,7 +1440,14 @@ def craz(force=False, hideError=False):
         if force:
             os.system("chmod -R +w  " + cc)
             os.system("rm -fR " + cc + "/*")
-            crs2filename = dict()
+            forget_metadata(directory=cc)
+            if isinstance(crs2filename, sqlite_index):
+                # The index file has been erased
+                reopen_sqlite_index()
+            else:
+                crs2filename = dict()
+            reset_skeletons()
+            update_cache_size(None)
         else:
             list_of_crs = list(crs2filename)
             for crs in list_of_crs:
@@ -1071,9 +1827,24 @@ def cwc(**kwargs):
     return clist(**kwargs)
 
 
-def rebuild():
+def file_and_crs(filename):
+    """
+    Returns a pair (FILENAME, the CRS expression found in FILENAME's meta-data)
     """
-    Rebuild the in-memory content of CliMAF cache index
+    return filename, getCRS(filename)
+
+
+def rebuild(workers=None, resume=True):
+    """
+    Rebuild the in-memory content of CliMAF cache index, by reading the CRS expression
+    of each cache file. Cache files without a CRS expression are removed; files which
+    metadata cannot be read are kept, but not indexed
+
+    CRS are read by a pool of WORKERS processes (which defaults to `rebuild_workers`),
+    and results are entered in the index as they come. They are also recorded in a
+    journal file (cacheIndexFileName + '.rebuild') which is removed at the end; if
+    RESUME is True, an interrupted rebuild is resumed using this journal, i.e. files
+    already processed are not read again
 
     """
     global crs2filename
@@ -1082,15 +1853,70 @@ def rebuild():
         clogger.warning(
             "Cannot rebuild cache index, because we are not in 'stamping' mode")
         return None
+    if workers is None:
+        workers = rebuild_workers
+    workers = max(1, int(workers))
+    journal_filename = os.path.expanduser(env.environment.cacheIndexFileName) + ".rebuild"
     files_in_cache = list_cache()
     crs2filename.clear()
-    for files in files_in_cache:
-        filecrs = getCRS(files)
-        if filecrs:
-            crs2filename[filecrs] = (files, compute_cost())
+    reset_skeletons()
+    update_cache_size(None)
+    done = set()
+    if resume and os.path.exists(journal_filename):
+        journaled = dict()
+        with open(journal_filename) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A truncated last line, if rebuild was interrupted while writing it
+                    continue
+                done.add(entry["file"])
+                if entry["crs"] and os.path.exists(entry["file"]):
+                    journaled[entry["crs"]] = (entry["file"], compute_cost())
+        crs2filename.update(journaled)
+        clogger.info("Resuming cache index rebuild, %d files already processed" % len(done))
+        journal_mode = "a"
+    else:
+        journal_mode = "w"
+    files_in_cache = [f for f in files_in_cache if f not in done]
+    clogger.info("Reading CRS in %d cache files using %d processes" % (len(files_in_cache), workers))
+
+    batch = dict()
+
+    def flush(journal):
+        crs2filename.update(batch)
+        batch.clear()
+        journal.flush()
+
+    with open(journal_filename, journal_mode) as journal:
+        if workers > 1 and len(files_in_cache) > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(file_and_crs, files_in_cache, chunksize=64)
         else:
-            os.system('rm -f ' + files)
-            clogger.warning("File %s is removed" % files)
+            executor = None
+            results = (file_and_crs(f) for f in files_in_cache)
+        try:
+            for filename, filecrs in results:
+                if filecrs == crs_read_failure:
+                    # Metadata could not be read : keep the file, but do not index it
+                    clogger.warning("Cannot read CRS in %s" % filename)
+                    filecrs = None
+                elif filecrs:
+                    batch[filecrs] = (filename, compute_cost())
+                else:
+                    filecrs = None
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                    clogger.warning("File %s is removed" % filename)
+                journal.write(json.dumps({"file": filename, "crs": filecrs}) + "\n")
+                if len(batch) >= 1000:
+                    flush(journal)
+            flush(journal)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    os.remove(journal_filename)
     return crs2filename
 
 
@@ -1190,6 +2016,8 @@ class compute_cost(object):
     - tc : a cost for all compute operations involved in object's genesis
     - lc : another cost, for the last( top-level) operation
     """
+    # Slots rather than a __dict__, for saving on memory with large cache indexes
+    __slots__ = ("lc", "tc")
 
     def __init__(self, cost=0., total_cost=None):
         """
@@ -1207,6 +2035,18 @@ class compute_cost(object):
     def __repr__(self):
         return "total cost : %.1f s, last operation : %.1f s" % (self.tc, self.lc)
 
+    # Pickled state is a dict, as before compute_cost had slots : cache indexes
+    # thus remain readable by former and current versions
+    def __getstate__(self):
+        return dict(lc=self.lc, tc=self.tc)
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            self.lc, self.tc = state
+        else:
+            self.lc = state["lc"]
+            self.tc = state["tc"]
+
     def add(self, other):
         """Just sum up total costs with another cost object. Also sum up last
         operation costs, but this is questionnable, as you could
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Index structures for CliMAF cache
+
+ - :py:class:`sqlite_index` is an on-disk backend for CliMAF cache index. The index
+   associates CRS expressions to a pair (filename, compute cost), as does the in-memory
+   dict ``climaf.cache.crs2filename`` used with the default ('pickle') backend. It provides
+   the same dict-like interface, but each insertion or deletion is a row-level operation
+   in a SQLite database (in WAL mode), which allows concurrent CliMAF sessions to share
+   a cache, and avoids loading the whole index at startup. Each insertion, by any
+   session, increments a generation counter stored in the database, which allows
+   to get the entries inserted since a given generation (see :py:meth:`sqlite_index.crs_since`).
+
+ - :py:class:`skeleton_index` is a secondary, in-memory, index of cached objects, keyed by
+   their period-free CRS (the 'skeleton'), and which stores their periods in sorted lists;
+   it allows to quickly find cached objects which include or begin a requested object.
+   It also groups cached objects by the shape of their CRS syntax tree, which ignores
+   periods and domains (see :py:func:`~climaf.crs_parser.crs_shape`), for finding those
+   on a domain which includes the requested one
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import datetime
+import bisect
+import hashlib
+import sqlite3
+import threading
+import six
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+from env.clogging import clogger
+from climaf.classes import cdataset, ctree, scriptChild
+from climaf.crs_parser import crs_shape
+
+_schema = """
+CREATE TABLE IF NOT EXISTS entries (
+    hash TEXT PRIMARY KEY,
+    crs TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    lc REAL,
+    tc REAL,
+    format TEXT,
+    size INTEGER,
+    mtime REAL,
+    operator TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_operator ON entries(operator);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER
+);
+INSERT OR IGNORE INTO counters VALUES ('generation', 0);
+CREATE TABLE IF NOT EXISTS generations (
+    hash TEXT PRIMARY KEY,
+    generation INTEGER
+);
+CREATE INDEX IF NOT EXISTS generations_generation ON generations(generation);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'generation';
+    INSERT OR REPLACE INTO generations SELECT NEW.hash, value FROM counters WHERE name = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    DELETE FROM generations WHERE hash = OLD.hash;
+END;
+"""
+
+
+def crs_hash(crs):
+    """ The key used for a CRS expression in the index table """
+    return hashlib.sha224(crs.encode("utf-8")).hexdigest()
+
+
+def crs_operator(crs):
+    """ The top-level operator of a CRS expression (e.g. 'ds' for a dataset) """
+    return crs.split("(")[0]
+
+
+class sqlite_index(MutableMapping):
+    """
+    A dict-like cache index, which keys are CRS expressions and values are
+    pairs (filename, cost), stored in SQLite database FILENAME.
+
+    COST_CLASS is the class used for building cost objects from their
+    attributes 'lc' and 'tc' (i.e. :py:class:`~climaf.cache.compute_cost`)
+    """
+
+    def __init__(self, filename, cost_class):
+        self.filename = os.path.expanduser(filename)
+        self.cost_class = cost_class
+        self.is_new = not os.path.exists(self.filename)
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        # A single connection, shared by threads and protected by a lock; autocommit mode
+        # makes each insert or delete a transaction of its own
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(self.filename, timeout=60., isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_schema)
+        clogger.debug("Cache index opened as %s" % self.filename)
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _execute(self, request, args=()):
+        with self.lock:
+            return self.connection.execute(request, args).fetchall()
+
+    def _row(self, crs, value):
+        filename, cost = value
+        lc = getattr(cost, "lc", 0.)
+        tc = getattr(cost, "tc", 0.)
+        try:
+            stat = os.stat(filename)
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size, mtime = None, None
+        fmt = os.path.splitext(filename)[1][1:]
+        return crs_hash(crs), crs, filename, lc, tc, fmt, size, mtime, crs_operator(crs)
+
+    def _value(self, filename, lc, tc):
+        return filename, self.cost_class(lc or 0., tc or 0.)
+
+    def __getitem__(self, crs):
+        rows = self._execute("SELECT filename, lc, tc FROM entries WHERE hash=?", (crs_hash(crs),))
+        if len(rows) == 0:
+            raise KeyError(crs)
+        return self._value(*rows[0])
+
+    def __setitem__(self, crs, value):
+        self._execute("INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?,?,?)", self._row(crs, value))
+
+    def __delitem__(self, crs):
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM entries WHERE hash=?", (crs_hash(crs),))
+            if cursor.rowcount == 0:
+                raise KeyError(crs)
+
+    _marker = object()
+
+    def pop(self, crs, default=_marker):
+        """
+        Removes CRS and returns its value (or DEFAULT, if provided and CRS is not indexed), in a
+        single transaction, so that concurrent sessions cannot both get the value
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.connection.execute("SELECT filename, lc, tc FROM entries WHERE hash=?",
+                                               (crs_hash(crs),)).fetchall()
+                deleted = 0
+                if len(rows) > 0:
+                    deleted = self.connection.execute("DELETE FROM entries WHERE hash=?", (crs_hash(crs),)).rowcount
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        if deleted == 0:
+            if default is self._marker:
+                raise KeyError(crs)
+            return default
+        return self._value(*rows[0])
+
+    def popitem(self):
+        """
+        Removes an arbitrary entry and returns the pair (CRS, value), in a single transaction
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.connection.execute("SELECT hash, crs, filename, lc, tc FROM entries LIMIT 1").fetchall()
+                deleted = 0
+                if len(rows) > 0:
+                    deleted = self.connection.execute("DELETE FROM entries WHERE hash=?", (rows[0][0],)).rowcount
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        if deleted == 0:
+            raise KeyError("popitem(): cache index is empty")
+        return rows[0][1], self._value(*rows[0][2:])
+
+    def __contains__(self, crs):
+        return len(self._execute("SELECT 1 FROM entries WHERE hash=?", (crs_hash(crs),))) > 0
+
+    def __iter__(self):
+        return iter([row[0] for row in self._execute("SELECT crs FROM entries")])
+
+    def __len__(self):
+        return self._execute("SELECT COUNT(*) FROM entries")[0][0]
+
+    def __repr__(self):
+        return "sqlite_index(%s, %d entries)" % (self.filename, len(self))
+
+    def items(self):
+        return [(crs, self._value(filename, lc, tc))
+                for crs, filename, lc, tc in self._execute("SELECT crs, filename, lc, tc FROM entries")]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def copy(self):
+        return dict(self.items())
+
+    def clear(self):
+        self._execute("DELETE FROM entries")
+
+    def update(self, other=(), **kwargs):
+        """ Bulk insertion, in a single transaction """
+        if isinstance(other, dict) or isinstance(other, MutableMapping):
+            other = list(other.items())
+        rows = [self._row(crs, value) for crs, value in list(other) + list(kwargs.items())]
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany("INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?,?,?)", rows)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def crs_with_operator(self, operator):
+        """ Returns the list of indexed CRS expressions which top-level operator is OPERATOR """
+        return [row[0] for row in self._execute("SELECT crs FROM entries WHERE operator=?", (operator,))]
+
+    def generation(self):
+        """ Returns the current generation of the index, i.e. the number of insertions so far """
+        return self._execute("SELECT value FROM counters WHERE name='generation'")[0][0]
+
+    def crs_since(self, generation):
+        """
+        Returns the pair (list of the CRS expressions inserted, by any session, after GENERATION
+        and still indexed, current generation)
+        """
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                rows = self.connection.execute("SELECT entries.crs FROM generations JOIN entries "
+                                               "ON entries.hash = generations.hash "
+                                               "WHERE generations.generation > ?", (generation,)).fetchall()
+                current = self.connection.execute("SELECT value FROM counters WHERE name='generation'").fetchall()
+            finally:
+                self.connection.execute("COMMIT")
+        return [row[0] for row in rows], current[0][0]
+
+
+def object_period(cobj):
+    """
+    Returns the period shared by all datasets of CliMAF object COBJ, or None if
+    they have distinct periods, or a 'fx' period, or if COBJ is not a tree
+    """
+    if isinstance(cobj, cdataset):
+        period = getattr(cobj, "period", None)
+        if period is None or isinstance(period, six.string_types) or period.fx:
+            return None
+        return period
+    elif isinstance(cobj, scriptChild):
+        return object_period(cobj.father)
+    elif isinstance(cobj, ctree):
+        periods = [object_period(op) for op in cobj.operands if op]
+        if len(periods) == 0 or any([p is None for p in periods]):
+            return None
+        first = periods[0]
+        if all([(p.start, p.end) == (first.start, first.end) for p in periods]):
+            return first
+    return None
+
+
+def object_skeleton(cobj):
+    """
+    Returns the CRS of CliMAF object COBJ with a void period for all its datasets, or
+    None if COBJ is not a tree
+    """
+    if isinstance(cobj, (cdataset, ctree, scriptChild)):
+        try:
+            return cobj.buildcrs(period="")
+        except Exception:
+            return None
+
+
+class skeleton_index(object):
+    """
+    A secondary index of cached objects : for each skeleton (see :py:func:`object_skeleton`),
+    a list of tuples (start, end, crs), sorted on period start and end, for objects which
+    datasets share a same period, and a list of the CRS of other objects; and for each
+    shape (see :py:func:`~climaf.crs_parser.crs_shape`), the list of the CRS of objects
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.intervals = dict()
+        self.others = dict()
+        self.shapes = dict()
+        self.indexed = dict()
+
+    def __contains__(self, crs):
+        return crs in self.indexed
+
+    def __len__(self):
+        return len(self.indexed)
+
+    def add(self, crs, cobj):
+        """ Records CRS, which represents object COBJ """
+        with self.lock:
+            if crs in self.indexed:
+                return
+            skeleton = object_skeleton(cobj)
+            period = object_period(cobj)
+            if period is not None:
+                entry = (period.start, period.end, crs)
+                bisect.insort(self.intervals.setdefault(skeleton, list()), entry)
+            else:
+                entry = crs
+                self.others.setdefault(skeleton, list()).append(crs)
+            shape = crs_shape(crs)
+            self.shapes.setdefault(shape, list()).append(crs)
+            self.indexed[crs] = (skeleton, entry, shape)
+
+    def discard(self, crs):
+        """ Forget CRS, if it is indexed """
+        with self.lock:
+            if crs not in self.indexed:
+                return
+            skeleton, entry, shape = self.indexed.pop(crs)
+            if isinstance(entry, tuple):
+                entries = self.intervals[skeleton]
+                entries.pop(bisect.bisect_left(entries, entry))
+            else:
+                self.others[skeleton].remove(entry)
+            self.shapes[shape].remove(crs)
+
+    def clear(self):
+        with self.lock:
+            self.intervals.clear()
+            self.others.clear()
+            self.shapes.clear()
+            self.indexed.clear()
+
+    def candidates(self, cobj, option="including"):
+        """
+        Returns the list of indexed CRS which may represent an object including COBJ (if
+        OPTION is 'including'), an object beginning COBJ (if OPTION is 'begin'), or the same
+        object as COBJ on another domain (if OPTION is 'including_domain'). The list is a
+        superset, which should be checked by comparing trees
+        """
+        if option in ["including_domain", ]:
+            shape = crs_shape(cobj.crs)
+            with self.lock:
+                if shape is None:
+                    return list(self.indexed)
+                return list(self.shapes.get(shape, list()))
+        skeleton = object_skeleton(cobj)
+        period = object_period(cobj)
+        with self.lock:
+            rep = list(self.others.get(skeleton, list()))
+            entries = self.intervals.get(skeleton, list())
+            if period is None:
+                rep.extend([crs for _, _, crs in entries])
+            elif option in ["including", ]:
+                # Entries which start before requested period, and end after
+                last = bisect.bisect_right(entries, (period.start, datetime.datetime.max))
+                rep.extend([crs for _, end, crs in entries[0:last] if end >= period.end])
+            elif option in ["begin", ]:
+                # Entries which start with requested period, and end before its end
+                first = bisect.bisect_left(entries, (period.start, ))
+                last = bisect.bisect_right(entries, (period.start, period.end, chr(0x10ffff)))
+                rep.extend([crs for _, _, crs in entries[first:last]])
+            else:
+                raise ValueError("Unknown option %s" % option)
+        return rep
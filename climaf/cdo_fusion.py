@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fusion of chains of CDO operators
+
+Scripts which command is a single CDO call, as e.g. ``cdo ${!operator} ${in} ${out}`` or
+``cdo sub ${in_1} ${in_2} ${out}`` (i.e. operators ``ccdo_fast``, ``ccdo2``, ``minus``,
+``select_level``, ``rescale``...), can be chained by CDO itself : when a tree such as
+``ccdo_fast(ccdo_fast(select_level(ds, level=850), operator='timmean'), operator='fldmean')``
+is evaluated with fusion activated, only one command is launched::
+
+    cdo fldmean -timmean -sellevel,850 <dataset file> <output file>
+
+and the intermediate results are not written. A fused operand is an operand which is not
+already cached and which is not to be materialized, according to the policy set by
+``materialize`` and ``materialized_operators``
+
+Scripts calling ``mcdo.py`` (such as ``ccdo``, ``space_average`` or ``time_average``) are not
+fused, as they do more than a CDO call (selection of variable, period, domain...); their
+results are inputs of the chains
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import re
+import json
+from string import Template
+
+from env.environment import *
+from env.clogging import clogger
+from climaf.classes import ctree, varOf
+
+#: Should chains of CDO operators be fused
+cdo_fusion = False
+#: Policy for materializing (and caching) intermediate results of a chain : 'none' means
+#  that intermediate results are never materialized, 'shared' means that those which are
+#  used more than once in the evaluated tree are materialized
+materialize = "shared"
+#: Operators which results are always materialized, even inside a chain of CDO operators
+materialized_operators = []
+
+_cdo_command = re.compile(r"^\s*cdo\s+(?P<operator>[^\s-]\S*)\s+(?P<inputs>(\$\{in(_\d+)?\}\s+)+)\$\{out\}\s*$")
+_input = re.compile(r"\$\{(in(_\d+)?)\}")
+
+
+def parse_cdo_command(command):
+    """
+    If COMMAND is a single CDO call with single-file inputs and one output, returns a pair
+    (operator template, list of the input labels in command order), e.g. for
+    'cdo sub ${in_1} ${in_2} ${out}' : ('sub', ['in_1', 'in_2']). Returns None otherwise
+    """
+    match = _cdo_command.match(command)
+    if match is None:
+        return None
+    return match.group("operator"), [label for label, _ in _input.findall(match.group("inputs"))]
+
+
+def is_fusable(cobj):
+    """
+    True if COBJ is a call to a script which is a single CDO call on operands which are
+    all CliMAF objects
+    """
+    if not isinstance(cobj, ctree) or cobj.operator not in cscripts:
+        return False
+    script = cscripts[cobj.operator]
+    if parse_cdo_command(script.command) is None or script.outputFormat not in ["nc", ]:
+        return False
+    if any([output not in [None, ""] for output in script.outputs]):
+        return False
+    return all([bool(op) for op in cobj.operands]) and operator_string(cobj) is not None
+
+
+def operator_string(cobj):
+    """
+    Returns the CDO operator for script call COBJ, once its parameters are substituted, as
+    e.g. 'sellevel,850'; or None if it cannot be fully substituted
+    """
+    command = cscripts[cobj.operator].command
+    operator, _ = parse_cdo_command(command)
+    subdict = dict()
+    if len(cobj.operands) > 0:
+        subdict["var"] = subdict["Var"] = varOf(cobj.operands[0])
+    for p, value in cobj.parameters.items():
+        if r"{!%s}" % p in command:
+            subdict[p] = value
+        else:
+            subdict[p] = json.dumps(value)
+    operator = Template(operator.replace("{!", "{")).safe_substitute(subdict)
+    if "${" in operator or re.search(r"\s", operator):
+        return None
+    return operator
+
+
+def input_operands(cobj):
+    """
+    Returns the operands of script call COBJ, in the order of their use in the CDO command
+    """
+    script = cscripts[cobj.operator]
+    _, labels = parse_cdo_command(script.command)
+    rank = dict([(label, index) for index, (label, _, _) in script.inputs.items()])
+    return [cobj.operands[max(rank[label] - 1, 0)] for label in labels]
+
+
+def shared_objects(cobj):
+    """
+    Returns the set of the CRS of sub-trees which occur more than once in tree COBJ
+    """
+    counts = dict()
+
+    def count(obj):
+        if isinstance(obj, ctree):
+            counts[obj.crs] = counts.get(obj.crs, 0) + 1
+            if counts[obj.crs] == 1:
+                for op in obj.operands:
+                    count(op)
+    count(cobj)
+    return set([crs for crs in counts if counts[crs] > 1])
+
+
+def must_be_materialized(cobj, shared):
+    """
+    True if intermediate result COBJ must be materialized rather than fused, according
+    to the policy (SHARED is the set of CRS of shared sub-trees, see :py:func:`shared_objects`)
+    """
+    if cobj.operator in materialized_operators:
+        return True
+    if materialize in ["shared", ] and cobj.crs in shared:
+        return True
+    return False
+
+
+def chain(cobj, evaluate, is_cached, shared):
+    """
+    Returns the CDO chain expression computing COBJ (as e.g. '-timmean -sellevel,850 file.nc'),
+    or None if COBJ is not to be fused.
+
+    EVALUATE(op, call) is a function returning the filename for an object OP which is
+    not fused, and which is an operand of CALL; IS_CACHED tells if an object is already
+    cached. Leaves must be single files, as a CDO operator in a chain gets one file per input
+    """
+    if not is_fusable(cobj) or is_cached(cobj) or must_be_materialized(cobj, shared):
+        return None
+    inputs = list()
+    for op in input_operands(cobj):
+        expression = chain(op, evaluate, is_cached, shared)
+        if expression is None:
+            expression = evaluate(op, cobj)
+            if expression is None or " " in expression.strip():
+                clogger.debug("Cannot fuse %s, as input %s is not a single file" % (cobj.crs, op.crs))
+                return None
+        inputs.append(expression)
+    return " ".join(["-" + operator_string(cobj)] + inputs)
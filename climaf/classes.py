@@ -11,9 +11,12 @@
 from __future__ import print_function, division, unicode_literals, absolute_import
 
 import re
+import sys
 import string
 import copy
 import os.path
+import threading
+from contextlib import contextmanager
 from collections import defaultdict
 from functools import reduce, partial
 import six
@@ -26,7 +29,9 @@ from datetime import timedelta
 
 from env.environment import *
 from climaf.utils import Climaf_Classes_Error, remove_keys_with_same_values
+from climaf.crs_parser import forget_parsed_crs
 from climaf.dataloc import isLocal, getlocs, selectFiles, dataloc
+from climaf.resolution_cache import cached_selectFiles
 from climaf.period import init_period, cperiod, merge_periods, intersect_periods_list, \
     lastyears, firstyears, group_periods, freq_to_minutes, build_date_regexp_pattern, \
     period_from_filenames
@@ -38,6 +43,24 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 # Should function ds() try to resolve for period=*
 auto_resolve = False
 
+# Per-thread override of env.environment.data_check (see without_data_check)
+data_check_override = threading.local()
+
+
+@contextmanager
+def without_data_check():
+    """
+    A context in which the datasets built by the current thread are not checked
+    w.r.t. datafiles, whatever env.environment.data_check (which is left unchanged,
+    for other threads)
+    """
+    saved = getattr(data_check_override, "value", None)
+    data_check_override.value = False
+    try:
+        yield
+    finally:
+        data_check_override.value = saved
+
 
 def derive_cproject(name, parent_name, new_project_facets=list()):
     """
@@ -158,6 +181,8 @@ class cproject(object):
             raise Climaf_Classes_Error(
                 "Character ',' is forbidden as a project separator")
         cprojects[name] = self
+        # Datasets CRS already parsed may now be interpreted differently
+        forget_parsed_crs()
         self.crs = ""
         # Build the pattern for the datasets CRS for this cproject
         for f in self.facets:
@@ -479,6 +504,9 @@ def processDatasetArgs(**kwargs):
             val = kwargs[facet]
         else:
             val = cdef(facet, project=project)
+        if type(val) is str:
+            # Many datasets share the same facet values
+            val = sys.intern(val)
         attval[facet] = val
         if val:
             if isinstance(val, list):
@@ -591,7 +619,8 @@ class cdataset(cobject):
           no data file for the dataset; this is intended for cases
           where datafiles are not (no more) accessible while the user
           expect to get processed data from the cache. Default value is
-          env.environment.data_check. An error is raised if check
+          env.environment.data_check (or False in the context of
+          :py:func:`without_data_check`). An error is raised if check
           fails.
 
         - check_type : defines the extent of period check; default value
@@ -667,7 +696,10 @@ class cdataset(cobject):
         self.local_copies_of_remote_files = None
         self.register()
         #
-        check = kwargs.get("check",env.environment.data_check)
+        check = getattr(data_check_override, "value", None)
+        if check is None:
+            check = env.environment.data_check
+        check = kwargs.get("check", check)
         if self.period == '*' or self.period is cperiod('fx') or self.period.fx:
             check = False
         if check is not False:
@@ -977,7 +1009,8 @@ class cdataset(cobject):
             else:
                 return cases
 
-    def explore(self, option='check_and_store', group_periods_on=None, operation='intersection', first=None):
+    def explore(self, option='check_and_store', group_periods_on=None, operation='intersection', first=None,
+                force=False):
         """
         Versatile datafile exploration for a dataset which possibly has wildcards (* and ? ) in
         attributes.
@@ -1099,6 +1132,9 @@ class cdataset(cobject):
                'CNRM-CM6-1' : [1850-2349] },
             'model': ['CNRM-ESM2-1', 'CNRM-CM6-1'], ...}
 
+        The results of data files searches are cached for the session (see
+        :py:mod:`~climaf.resolution_cache`); use ``force=True`` for searching again
+
         """
         use_frequency = cprojects[self.project].use_frequency
         if use_frequency:
@@ -1117,9 +1153,8 @@ class cdataset(cobject):
                 dic["filenameVar"] = filenameVar
         clogger.debug("Looking with dic=%s" % repr(dic))
         # if option != 'check_and_store' :
-        wildcards = dict()
-        files = selectFiles(return_wildcards=wildcards, merge_periods_on=group_periods_on,
-                            use_frequency=use_frequency, **dic)
+        files, wildcards = cached_selectFiles(dic, merge_periods_on=group_periods_on, use_frequency=use_frequency,
+                                              force=force)
         # -- Use the requested variable instead of the aliased
         if self.alias:
             dic["variable"] = req_var
@@ -1237,10 +1272,10 @@ class cdataset(cobject):
             if ensure_dataset:
                 clogger.debug(
                     "baseFile calls explore method with default option")
-                self.explore()
+                self.explore(force=force)
             else:
                 clogger.debug("baseFiles calls explore with option 'choices'")
-                cases = self.explore(option='choices')
+                cases = self.explore(option='choices', force=force)
                 clogger.debug("baseFiles : explore result is %s" % cases)
                 list_keys = [k for k in cases if type(
                     cases[k]) is list and k != 'period']
@@ -1511,9 +1546,20 @@ class cens(cobject, dict):
         else:
             self.order = keylist
         #
-        self.crs = self.buildcrs()
+        self.crs = None
         self.register()
 
+    @property
+    def crs(self):
+        # The CRS is built on first use after any change of members
+        if self._crs is None:
+            self._crs = self.buildcrs()
+        return self._crs
+
+    @crs.setter
+    def crs(self, value):
+        self._crs = value
+
     def __eq__(self, other):
         res = super(cens, self).__eq__(other)
         if res:
@@ -1532,6 +1578,7 @@ class cens(cobject, dict):
                 "Order list does not match dict keys list : %s   and %s" %
                 (repr(ordered_list), repr(ordered_keylist)))
         self.order = order
+        self.crs = None
 
     def __setitem__(self, k, v):
         if not isinstance(k, six.string_types):
@@ -1539,12 +1586,15 @@ class cens(cobject, dict):
         if not isinstance(v, cobject):
             raise Climaf_Classes_Error(
                 "Ensemble members must be CliMAF objects")
+        # The order lists more labels than members only while an ensemble is being
+        # rebuilt (e.g. by copy.deepcopy); otherwise, members are known by the dict
+        known = dict.__contains__(self, k) or (len(self.order) > dict.__len__(self) and k in self.order)
         dict.__setitem__(self, k, v)
-        if k not in self.order:
+        if not known:
             self.order.append(k)
             if self.sortfunc:
                 self.order = self.sortfunc(list(self))
-        self.crs = self.buildcrs()
+        self.crs = None
         self.register()
 
     def items(self):
@@ -1559,6 +1609,7 @@ class cens(cobject, dict):
     def pop(self, key, default=None):
         if key in self:
             self.order.remove(key)
+            self.crs = None
             return dict.pop(self, key, default)
         else:
             return default
@@ -1566,6 +1617,7 @@ class cens(cobject, dict):
     def clear(self):
         dict.clear(self)
         self.order = []
+        self.crs = None
 
     def update(self, it):
         dict.update(self, it)
@@ -1577,6 +1629,7 @@ class cens(cobject, dict):
                 self.order.append(el)
         if self.sortfunc:
             self.order = self.sortfunc(list(self))
+        self.crs = None
 
     def buildcrs(self, crsrewrite=None, period=None):
         if crsrewrite is None and period is None:
@@ -1771,6 +1824,15 @@ def fds(filename, simulation=None, variable=None, period=None, model=None):
     return d
 
 
+def ctree_parameters(parameters):
+    """ Returns PARAMETERS of a script call, with periods as strings """
+    p = parameters.get("period", None)
+    if isinstance(p, cperiod):
+        parameters = dict(parameters)
+        parameters["period"] = repr(p)
+    return parameters
+
+
 class ctree(cobject):
     def __init__(self, climaf_operator, script, *operands, **parameters):
         """ Builds the tree of a composed object, including a dict for outputs.
@@ -1781,16 +1843,12 @@ class ctree(cobject):
                 "Cannot apply an operator to no operand")
         self.operator = climaf_operator
         self.script = script
-        import copy
         if script is None:
             self.flags = False
         else:
             self.flags = copy.copy(script.flags)
         self.operands = operands
-        if "period" in parameters:
-            p = parameters["period"]
-            if isinstance(p, cperiod):
-                parameters["period"] = repr(p)
+        parameters = ctree_parameters(parameters)
         if "variable" in parameters:
             self.variable = parameters["variable"]
         else:
@@ -1801,9 +1859,20 @@ class ctree(cobject):
                 raise Climaf_Classes_Error(
                     "operand " + repr(o) + " is not a CliMAF object")
         self.crs = self.buildcrs()
+        self.operands_crs = tuple(o.crs if o else None for o in operands)
         self.outputs = dict()
         self.register()
 
+    @property
+    def crs(self):
+        return self._crs
+
+    @crs.setter
+    def crs(self, value):
+        # The CRS for other periods are memoised, as long as the CRS does not change
+        self._crs = value
+        self._period_crs = dict()
+
     def buildcrs(self, crsrewrite=None, period=None):
         """ Builds the CRS expression representing applying OPERATOR on
         OPERANDS with PARAMETERS.
@@ -1814,6 +1883,16 @@ class ctree(cobject):
         is no parameters, then return dataset's crs. This is the way to avoid
         repetitive data selection, when a data selection has been explictly cached
         """
+        if period is not None and crsrewrite is None and "_crs" in self.__dict__:
+            key = str(period)
+            rep = self._period_crs.get(key, None)
+            if rep is None:
+                rep = self._buildcrs(crsrewrite, period)
+                self._period_crs[key] = rep
+            return rep
+        return self._buildcrs(crsrewrite, period)
+
+    def _buildcrs(self, crsrewrite=None, period=None):
         first_op = self.operands[0]
         if self.operator in ['select', ] and len(self.operands) == 1 and isinstance(first_op, cdataset) and \
                 len(list(self.parameters)) == 0 and first_op.alias is None:
@@ -1851,7 +1930,9 @@ class ctree(cobject):
             period = init_period(period)
         for op in self.operands:
             op.setperiod(period)
-        self.crs = self.buildcrs(period=period)
+        # Operands CRS are up to date : no need to rebuild them
+        self.crs = self.buildcrs()
+        self.operands_crs = tuple(o.crs if o else None for o in self.operands)
         self.register()
 
 
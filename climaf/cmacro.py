@@ -20,6 +20,7 @@ import six
 from env.clogging import clogger, dedent
 from env.environment import *
 from climaf.classes import cobject, cdataset, ctree, scriptChild, cpage, allow_error_on_ds, cens, cdummy
+from climaf.crs_parser import crs_object
 
 
 def macro(name, cobj, lobjects=[]):
@@ -76,12 +77,11 @@ def macro(name, cobj, lobjects=[]):
     """
     if isinstance(cobj, six.string_types):
         s = cobj
-        # Next line used for interpreting macros's CRS
-        exec("from climaf.cmacro import cdummy; ARG=cdummy()",
-             sys.modules['__main__'].__dict__)
         try:
-            cobj = eval(cobj, sys.modules['__main__'].__dict__)
-        except:
+            cobj = crs_object(cobj)
+        except Exception:
+            cobj = None
+        if cobj is None:
             # usually case of a CRS which project is not currently defined
             clogger.error(
                 "Cannot interpret %s with the projects currently define" % s)
@@ -148,16 +148,11 @@ def crewrite(crs, alsoAtTop=True):
     same for first subtree, and recursively in depth, and then go
     to second subtreesecond
     """
-    # Next line used for interpreting macros's CRS
-    exec("ARG=climaf.cmacro.cdummy()", sys.modules['__main__'].__dict__)
-    #
-    allow_error_on_ds()
     try:
-        co = eval(crs, sys.modules['__main__'].__dict__)
-    except:
+        co = crs_object(crs, allow_unresolved=True)
+    except Exception:
         clogger.debug("Issue when rewriting %s" % crs)
         return crs
-    allow_error_on_ds(False)
     rep = None
     if isinstance(co, ctree) or isinstance(co, scriptChild) or isinstance(co, cpage):
         if alsoAtTop:
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cross-process locks on the computation of CliMAF objects
+
+When several CliMAF processes (or threads) share a cache, they may have to compute
+the same object at the same time. If `use_crs_locks` is True, before launching a
+script, the driver takes a lock on the object CRS (see :py:class:`crs_lock`), which
+is a file having the cache filename of the object with suffix '.lock'. A process
+which finds the lock already taken waits until it is released, and then uses the
+object computed by the lock holder, if any (except for deep evaluations, which
+compute it again).
+
+As these locks cost a lock file and a heartbeat thread, they are not used by default:
+set `use_crs_locks` to True (or environment variable CLIMAF_CRS_LOCKS to 'yes') when
+several processes share the cache.
+
+Lock holders refresh the modification time of their lock files every
+`heartbeat_period` seconds. A lock which has not been refreshed since
+`stale_lock_delay` seconds, or which holder process is known to be dead (on the
+same host), is considered as stale (e.g. left by a killed job), and is broken.
+
+If `use_crs_locks` is False, the computation of a given object is still serialised
+among the threads of the process (see :py:class:`thread_lock`), since concurrent
+evaluations of the same object would write the same temporary files.
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+
+from env.environment import *
+from env.clogging import clogger
+from climaf.cache import generateUniqueFileName
+
+#: Should the computation of script calls be protected by cross-process locks
+use_crs_locks = os.environ.get("CLIMAF_CRS_LOCKS", "no") in ["yes", ]
+#: Period at which holders refresh their lock files (in seconds)
+heartbeat_period = 20.
+#: Delay after which a lock file which has not been refreshed is considered as stale (in seconds)
+stale_lock_delay = 120.
+#: Period at which a waiting process checks the lock file (in seconds)
+polling_period = 0.5
+
+_host = socket.gethostname()
+_held = set()
+_held_lock = threading.Lock()
+_heartbeat = None
+
+
+def lock_filename(crs):
+    """
+    Returns the name of the lock file for CRS
+    """
+    return generateUniqueFileName(crs, format="lock")
+
+
+def needs_lock(scriptCall):
+    """
+    True if the computation of SCRIPTCALL should be protected by a lock, i.e. if it
+    delivers an output which is cached
+    """
+    script = cscripts.get(scriptCall.operator, None)
+    return script is not None and script.outputFormat not in none_formats and \
+        scriptCall.parameters.get('format', None) != "show"
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(heartbeat_period)
+        with _held_lock:
+            filenames = list(_held)
+        for filename in filenames:
+            try:
+                os.utime(filename, None)
+            except OSError:
+                pass
+
+
+def _start_heartbeat():
+    global _heartbeat
+    with _held_lock:
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_heartbeat_loop, name="climaf_crs_locks")
+            _heartbeat.daemon = True
+            _heartbeat.start()
+
+
+def _read(filename):
+    # Returns the content of lock file FILENAME (a string), or None if it does not exist
+    try:
+        with open(filename) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _holder_is_dead(content):
+    try:
+        holder = json.loads(content)
+    except ValueError:
+        return False
+    if holder.get("host", None) != _host or not isinstance(holder.get("pid", None), int):
+        return False
+    try:
+        os.kill(holder["pid"], 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def is_stale(filename, content=None):
+    """
+    True if lock file FILENAME (which content is CONTENT, if provided) is stale
+    """
+    try:
+        age = time.time() - os.path.getmtime(filename)
+    except OSError:
+        return False
+    if age > stale_lock_delay:
+        return True
+    if content is None:
+        content = _read(filename)
+    return content is not None and _holder_is_dead(content)
+
+
+def _break(filename, content):
+    # Removes stale lock file FILENAME, provided it still has CONTENT
+    aside = "%s.%s" % (filename, uuid.uuid4().hex)
+    try:
+        os.rename(filename, aside)
+    except OSError:
+        return
+    if _read(aside) != content:
+        # The lock was taken again meanwhile : put it back
+        try:
+            os.link(aside, filename)
+        except OSError:
+            pass
+    else:
+        clogger.warning("Breaking stale lock %s" % filename)
+    try:
+        os.remove(aside)
+    except OSError:
+        pass
+
+
+class crs_lock(object):
+    """
+    A cross-process lock on the computation of the object which CRS is provided
+    """
+
+    def __init__(self, crs):
+        self.crs = crs
+        self.filename = lock_filename(crs)
+        self.held = False
+
+    def _try_acquire(self):
+        content = json.dumps(dict(host=_host, pid=os.getpid(), owner=robust_pid,
+                                  thread=threading.current_thread().name, crs=self.crs))
+        try:
+            fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        return True
+
+    def acquire(self):
+        """
+        Takes the lock, waiting while it is held by another process or thread (unless
+        the lock is stale)
+
+        Returns True if the lock had to be waited for, which means that the object
+        may have been computed meanwhile
+        """
+        waited = False
+        while not self._try_acquire():
+            if not waited:
+                clogger.info("Waiting for another evaluation of %s (lock %s)" % (self.crs, self.filename))
+                waited = True
+            content = _read(self.filename)
+            if content is not None and is_stale(self.filename, content):
+                _break(self.filename, content)
+            else:
+                time.sleep(polling_period)
+        self.held = True
+        with _held_lock:
+            _held.add(self.filename)
+        _start_heartbeat()
+        return waited
+
+    def release(self):
+        """
+        Releases the lock, if held
+        """
+        if not self.held:
+            return
+        with _held_lock:
+            _held.discard(self.filename)
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+        self.held = False
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class thread_lock(object):
+    """
+    A lock on the computation of the object which CRS is provided, among the threads
+    of the process only. It has the same interface as :py:class:`crs_lock`
+    """
+
+    _locks = dict()
+    _locks_lock = threading.Lock()
+
+    def __init__(self, crs):
+        self.crs = crs
+        self.held = False
+
+    def acquire(self):
+        """
+        Takes the lock, waiting while it is held by another thread. Returns True if the
+        lock had to be waited for
+        """
+        with self._locks_lock:
+            entry = self._locks.setdefault(self.crs, [threading.Lock(), 0])
+            entry[1] += 1
+        waited = not entry[0].acquire(False)
+        if waited:
+            clogger.info("Waiting for another evaluation of %s" % self.crs)
+            entry[0].acquire()
+        self.held = True
+        return waited
+
+    def release(self):
+        """
+        Releases the lock, if held
+        """
+        if not self.held:
+            return
+        with self._locks_lock:
+            entry = self._locks[self.crs]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(self.crs)
+        self.held = False
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def object_lock(crs):
+    """
+    Returns the lock to take for computing the object which CRS is provided : a
+    :py:class:`crs_lock` if `use_crs_locks` is True, and a :py:class:`thread_lock` otherwise
+    """
+    if use_crs_locks:
+        return crs_lock(crs)
+    return thread_lock(crs)
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A parser for CRS expressions (the CliMAF Reference Syntax)
+
+CRS expressions are parsed by :py:func:`parse_crs` into a light and immutable
+syntax tree, without evaluating any Python code, without building CliMAF objects,
+and without accessing the file system. Results are memoised per CRS string. The tree
+can then be turned into a CliMAF object by :py:func:`build_object` (or
+:py:func:`crs_object`, for a CRS expression), which replaces evaluating the CRS
+expression in the namespace of ``__main__``.
+
+The grammar of CRS expressions is ::
+
+    expression := primary ( '.' NAME )*
+    primary    := 'ARG'
+                | 'ds' '(' STRING ')'
+                | NAME '(' [ argument ( ',' argument )* ] ')'
+                | literal
+    argument   := NAME '=' expression | expression
+    literal    := STRING | NUMBER | 'True' | 'False' | 'None'
+                | '[' [ expression ( ',' expression )* ] ']'
+                | '(' [ expression ( ',' expression )* ] ')'
+                | '{' [ expression ':' expression ( ',' expression ':' expression )* ] '}'
+
+Nodes of the tree are :
+
+ - :py:class:`crs_dataset` for ``ds('...')``, with the facets of the dataset, according to
+   the (single) declared project which CRS syntax matches the string
+ - :py:class:`crs_call` for the application of an operator (script, in-process operator,
+   macro, or one of ``cens``, ``cpage``, ``cpage_pdf``) to operands, with keyword parameters
+ - :py:class:`crs_child` for a secondary output of a script (``father.varname``)
+ - :py:class:`crs_arg` for the dummy argument of macros (``ARG``)
+ - :py:class:`crs_list` and :py:class:`crs_dict` for lists and dicts
+ - Python values (strings, numbers, booleans, None, tuples) for other literals
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import re
+import ast
+from collections import namedtuple
+
+from env.environment import *
+from env.clogging import clogger
+from climaf.utils import Climaf_Error
+
+#: The memo of parsed CRS expressions (see :py:func:`parse_crs`)
+parsed_crs = dict()
+#: The memo of the nodes for datasets strings (see :py:func:`dataset_node`)
+dataset_nodes = dict()
+#: The memo of the shapes of CRS expressions (see :py:func:`crs_shape`)
+crs_shapes = dict()
+#: Operators of CRS expressions which are neither scripts, in-process operators nor macros
+special_operators = ["cens", "cpage", "cpage_pdf"]
+
+
+class crs_dataset(namedtuple("crs_dataset", ["crs", "project", "facets"])):
+    """
+    A dataset : CRS is the string argument of ``ds()``, FACETS the tuple of pairs
+    (facet, value) for PROJECT; PROJECT is None if no single declared project matches CRS
+    """
+    __slots__ = ()
+
+    @property
+    def kvp(self):
+        return dict(self.facets)
+
+
+class crs_call(namedtuple("crs_call", ["operator", "operands", "parameters"])):
+    """
+    The application of OPERATOR to a tuple of OPERANDS, with PARAMETERS a tuple of
+    pairs (name, value) sorted on names
+    """
+    __slots__ = ()
+
+
+class crs_child(namedtuple("crs_child", ["father", "varname"])):
+    """ The secondary output VARNAME of script call FATHER """
+    __slots__ = ()
+
+
+class crs_arg(namedtuple("crs_arg", [])):
+    """ The dummy argument of macros """
+    __slots__ = ()
+
+
+class crs_list(namedtuple("crs_list", ["items"])):
+    """ A list """
+    __slots__ = ()
+
+
+class crs_dict(namedtuple("crs_dict", ["items"])):
+    """ A dict, as a tuple of pairs (key, value) """
+    __slots__ = ()
+
+
+# Tokens are strings, numbers, names and punctuation; any other non-blank character
+# is a token of its own, which the parser rejects
+_tokens = re.compile(r"""'[^'\\]*(?:\\.[^'\\]*)*'|"[^"\\]*(?:\\.[^"\\]*)*"|-?\d[\d.]*(?:[eE][-+]?\d+)?|"""
+                     r"""[A-Za-z_]\w*|\S""")
+
+_constants = {"True": True, "False": False, "None": None}
+_punctuation = set("()[]{},:=.")
+
+
+def tokenize(crs):
+    """
+    Returns the list of the tokens of CRS (strings)
+    """
+    return _tokens.findall(crs)
+
+
+def _literal(token):
+    # Returns the value of a string or number token
+    if token[0] in "'\"" and "\\" not in token:
+        return token[1:-1]
+    return ast.literal_eval(token)
+
+
+class _parser(object):
+
+    def __init__(self, crs):
+        self.crs = crs
+        self.tokens = tokenize(crs)
+        self.tokens.extend(["", ""])
+        self.pos = 0
+        self.resolved = True
+
+    def error(self, message):
+        raise Climaf_Error("Cannot parse CRS expression %s : %s (at token %d)" % (self.crs, message, self.pos))
+
+    def next(self):
+        token = self.tokens[self.pos]
+        if token == "":
+            self.error("unexpected end")
+        self.pos += 1
+        return token
+
+    def expect(self, punct):
+        token = self.next()
+        if token != punct:
+            self.error("expected '%s', got '%s'" % (punct, token))
+
+    def accept(self, punct):
+        if self.tokens[self.pos] == punct:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        rep = self.expression()
+        if self.pos != len(self.tokens) - 2:
+            self.error("trailing tokens")
+        return rep
+
+    def expression(self):
+        rep = self.primary()
+        while self.accept("."):
+            name = self.next()
+            if not (name[0].isalpha() or name[0] == "_"):
+                self.error("expected a variable name")
+            rep = crs_child(rep, name)
+        return rep
+
+    def sequence(self, closing, item):
+        rep = list()
+        while not self.accept(closing):
+            rep.append(item())
+            if not self.accept(","):
+                self.expect(closing)
+                break
+        return rep
+
+    def primary(self):
+        token = self.next()
+        first = token[0]
+        if first in "'\"" or first.isdigit() or first == "-":
+            return _literal(token)
+        if first.isalpha() or first == "_":
+            if token in _constants:
+                return _constants[token]
+            if token == "ARG":
+                return crs_arg()
+            self.expect("(")
+            if token == "ds":
+                string = self.next()
+                if string[0] not in "'\"":
+                    self.error("expected a dataset string")
+                self.expect(")")
+                rep = dataset_node(_literal(string))
+                self.resolved = self.resolved and rep.project is not None
+                return rep
+            operands = list()
+            parameters = dict()
+            for argument in self.sequence(")", self.argument):
+                if isinstance(argument, _keyword):
+                    parameters[argument.name] = argument.value
+                elif parameters:
+                    self.error("positional argument after keyword argument")
+                else:
+                    operands.append(argument)
+            return crs_call(token, tuple(operands), tuple(sorted(parameters.items())))
+        if token == "[":
+            return crs_list(tuple(self.sequence("]", self.expression)))
+        if token == "(":
+            return tuple(self.sequence(")", self.expression))
+        if token == "{":
+            return crs_dict(tuple(self.sequence("}", self.pair)))
+        self.error("unexpected '%s'" % token)
+
+    def argument(self):
+        if self.tokens[self.pos + 1] == "=" and self.tokens[self.pos] not in _punctuation:
+            name = self.next()
+            self.pos += 1
+            return _keyword(name, self.expression())
+        return self.expression()
+
+    def pair(self):
+        key = self.expression()
+        self.expect(":")
+        return key, self.expression()
+
+
+_keyword = namedtuple("_keyword", ["name", "value"])
+
+
+def dataset_node(crs):
+    """
+    Returns the :py:class:`crs_dataset` node for dataset string CRS, resolving its
+    facets as :py:func:`~climaf.classes.ds` does
+    """
+    rep = dataset_nodes.get(crs, None)
+    if rep is not None:
+        return rep
+    matches = list()
+    for project in cprojects:
+        if project is None:
+            continue
+        cproj = cprojects[project]
+        if not crs.startswith(cproj.project + cproj.separator):
+            continue
+        fields = crs.split(cproj.separator)
+        if len(fields) == len(cproj.facets):
+            matches.append(crs_dataset(crs, project, tuple(zip(cproj.facets, fields))))
+    if len(matches) == 1:
+        rep = dataset_nodes[crs] = matches[0]
+        return rep
+    return crs_dataset(crs, None, ())
+
+
+def is_resolved(node):
+    """
+    True if all datasets in NODE belong to a declared project
+    """
+    if isinstance(node, crs_dataset):
+        return node.project is not None
+    if isinstance(node, crs_call):
+        return all(is_resolved(o) for o in node.operands) and all(is_resolved(v) for _, v in node.parameters)
+    if isinstance(node, crs_child):
+        return is_resolved(node.father)
+    if isinstance(node, crs_dict):
+        return all(is_resolved(k) and is_resolved(v) for k, v in node.items)
+    if isinstance(node, crs_list):
+        return all(is_resolved(o) for o in node.items)
+    if type(node) is tuple:
+        return all(is_resolved(o) for o in node)
+    return True
+
+
+def node_operators(node):
+    """
+    Returns the set of the operators applied in NODE
+    """
+    rep = set()
+    if isinstance(node, crs_call):
+        rep.add(node.operator)
+        for o in node.operands:
+            rep.update(node_operators(o))
+        for _, v in node.parameters:
+            rep.update(node_operators(v))
+    elif isinstance(node, crs_child):
+        rep.update(node_operators(node.father))
+    elif isinstance(node, crs_dict):
+        for k, v in node.items:
+            rep.update(node_operators(k))
+            rep.update(node_operators(v))
+    elif isinstance(node, crs_list):
+        for o in node.items:
+            rep.update(node_operators(o))
+    elif type(node) is tuple:
+        for o in node:
+            rep.update(node_operators(o))
+    return rep
+
+
+def node_shape(node, ignored_facets=("period", "domain")):
+    """
+    Returns a hashable summary of NODE, which is the same for syntax trees which differ
+    only by the IGNORED_FACETS of their datasets; or None if NODE cannot be summarised
+    this way (dataset which is not resolved, dummy argument, call to a macro or to an
+    operator which is not a script nor an in-process operator)
+    """
+    if isinstance(node, crs_dataset):
+        if node.project is None:
+            return None
+        return "ds", node.project, tuple([(k, v) for k, v in node.facets if k not in ignored_facets])
+    if isinstance(node, crs_call):
+        if node.operator not in cscripts and node.operator not in operators:
+            return None
+        operands = tuple([node_shape(o, ignored_facets) for o in node.operands])
+        if any([o is None for o in operands]):
+            return None
+        return node.operator, operands, node.parameters
+    if isinstance(node, crs_child):
+        father = node_shape(node.father, ignored_facets)
+        return None if father is None else ("child", node.varname, father)
+    if isinstance(node, (crs_arg, crs_list, crs_dict)):
+        return None
+    return node
+
+
+def crs_shape(crs):
+    """
+    Returns the shape of CRS expression CRS (see :py:func:`node_shape`), or None. Two
+    objects which shapes are not None and differ cannot match for
+    :py:func:`~climaf.cache.hasMatchingObject`. Results are memoised
+    """
+    rep = crs_shapes.get(crs, False)
+    if rep is False:
+        try:
+            node = parse_crs(crs)
+        except Climaf_Error:
+            return None
+        rep = node_shape(node)
+        if is_resolved(node):
+            crs_shapes[crs] = rep
+    return rep
+
+
+def parse_crs(crs):
+    """
+    Returns the syntax tree of CRS expression CRS (see module doc). Raises a
+    Climaf_Error if CRS is not syntactically valid
+
+    Results are memoised, except when some dataset does not (yet) belong to a
+    declared project
+
+    >>> parse_crs("ccdo(ARG).out")
+    crs_child(father=crs_call(operator='ccdo', operands=(crs_arg(),), parameters=()), varname='out')
+    """
+    rep = parsed_crs.get(crs, None)
+    if rep is None:
+        parser = _parser(crs)
+        rep = parser.parse()
+        if parser.resolved:
+            parsed_crs[crs] = rep
+    return rep
+
+
+def forget_parsed_crs():
+    """
+    Clear the memo of parsed CRS expressions (e.g. when a project is declared)
+    """
+    parsed_crs.clear()
+    dataset_nodes.clear()
+    crs_shapes.clear()
+
+
+def build_object(node, allow_unresolved=False):
+    """
+    Returns the CliMAF object (or value) represented by syntax tree NODE. Raises a
+    Climaf_Error if some operator is not known, or if some dataset does not belong to
+    a declared project, unless ALLOW_UNRESOLVED is True : such datasets are then
+    represented by None (as :py:func:`~climaf.classes.ds` does when errors are allowed)
+    """
+    from climaf.classes import cdataset, cdummy, cens, cpage, cpage_pdf
+    from climaf.driver import capply_script, capply_operator
+    from climaf.cmacro import cmacros, instantiate
+    if isinstance(node, crs_dataset):
+        if node.project is None:
+            if allow_unresolved:
+                return None
+            raise Climaf_Error("Dataset %s is not valid for a single project in %s" % (node.crs, repr(list(cprojects))))
+        return cdataset(**node.kvp)
+    if isinstance(node, crs_arg):
+        return cdummy()
+    if isinstance(node, crs_child):
+        return getattr(build_object(node.father, allow_unresolved), node.varname)
+    if isinstance(node, crs_list):
+        return [build_object(item, allow_unresolved) for item in node.items]
+    if isinstance(node, crs_dict):
+        return dict((build_object(k, allow_unresolved), build_object(v, allow_unresolved)) for k, v in node.items)
+    if type(node) is tuple:
+        return tuple(build_object(item, allow_unresolved) for item in node)
+    if not isinstance(node, crs_call):
+        return node
+    operands = [build_object(o, allow_unresolved) for o in node.operands]
+    parameters = dict((k, build_object(v, allow_unresolved)) for k, v in node.parameters)
+    operator = node.operator
+    if operator in ["cens", ]:
+        return cens(*operands, **parameters)
+    if operator in ["cpage", "cpage_pdf"]:
+        # The CRS of pages misspells this parameter
+        if "backgroud" in parameters:
+            parameters["background"] = parameters.pop("backgroud")
+        return {"cpage": cpage, "cpage_pdf": cpage_pdf}[operator](*operands, **parameters)
+    if operator in cscripts:
+        return capply_script(operator, *operands, **parameters)
+    if operator in operators:
+        return capply_operator(operator, *operands, **parameters)
+    if operator in cmacros:
+        if parameters:
+            raise Climaf_Error("Macros cannot be called with keyword args (%s)" % operator)
+        return instantiate(cmacros[operator], operands)
+    raise Climaf_Error("%s is not a known operator nor script" % operator)
+
+
+def crs_object(crs, allow_unresolved=False):
+    """
+    Returns the CliMAF object represented by CRS expression CRS (see :py:func:`build_object`),
+    or None if some operator is not known, or if some dataset does not belong to a
+    declared project (unless ALLOW_UNRESOLVED is True)
+    """
+    from climaf.cmacro import cmacros
+    node = parse_crs(crs)
+    if not allow_unresolved and not is_resolved(node):
+        clogger.debug("CRS expression %s is not valid with projects %s" % (crs, repr(list(cprojects))))
+        return None
+    unknown = [o for o in node_operators(node) if o not in cscripts and o not in operators and
+               o not in cmacros and o not in special_operators]
+    if unknown:
+        clogger.debug("CRS expression %s uses unknown operators %s" % (crs, repr(unknown)))
+        return None
+    return build_object(node, allow_unresolved)
@@ -16,6 +16,7 @@ import shutil
 import copy
 from string import Template
 import tempfile
+from contextlib import nullcontext
 from datetime import datetime
 from functools import reduce
 from six import string_types
@@ -24,6 +25,7 @@ import json
 import warnings
 from xarray import open_dataset as xr_open_dataset
 import subprocess
+import threading
 
 from climaf.dataloc import remote_to_local_filename
 from climaf.utils import Climaf_Driver_Error, Climaf_Error
@@ -34,13 +36,21 @@ from climaf.operators_scripts import scriptFlags
 from climaf.operators_derive import is_derived_variable, derived_variable, derive
 from climaf import classes
 from climaf.cache import compute_cost, hasExactObject, cdrop, hasIncludingObject, hasBeginObject, complement, \
-    generateUniqueFileName, register, rename, has_cvalue, store_cvalue
+    hasIncludingDomainObject, concatenate, generateUniqueFileName, register, rename, has_cvalue, store_cvalue, \
+    use_files, release_files
 from climaf.cmacro import instantiate
 from env.clogging import clogger, indent as cindent, dedent as cdedent
 from climaf.netcdfbasics import varOfFile, varsOfFile
 from climaf.period import cperiod, init_period, merge_periods
 from climaf.classes import allow_errors_on_ds_call, cens, varOf, ctree, scriptChild, cdataset, cpage, cpage_pdf, \
     domainOf, cobject, modelOf, simulationOf, projectOf, realmOf, gridOf
+from climaf import scheduler
+from climaf import cdo_fusion
+from climaf import xarray_operators
+from climaf import time_chunks
+from climaf import space_tiles
+from climaf import crs_locks
+from climaf import executors
 from climaf.ESMValTool_diags import call_evt_script
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -52,6 +62,14 @@ dig_hard_into_cache = True
 #: How should the file be open, which hosts scripts outputs. Can use 'w' and 'a'
 scripts_output_write_mode = 'w'
 
+#: Number of ensemble members which are evaluated concurrently (1 means a sequential evaluation)
+ensemble_workers = 1
+
+# Script calls may run concurrently (see scheduler.run_dag) : writing in logdir/last.out, and
+# linking fixed fields in the current directory, are serialized
+scripts_output_lock = threading.Lock()
+fixed_fields_lock = threading.Lock()
+
 
 def capply(climaf_operator, *operands, **parameters):
     """
@@ -203,8 +221,18 @@ def capply_operator(climaf_operator, *operands, **parameters):
     Create object for application of an internal OPERATOR to OPERANDS with keywords PARAMETERS.
 
     """
-    clogger.error("Not yet developped - TBD")
-    return None
+    operator = operators[climaf_operator]
+    first = operands[0]
+    if isinstance(first, cens) and operator.flags.commuteWithEnsemble:
+        reps = []
+        order = first.order
+        for label in order:
+            params = parameters.copy()
+            params["member_label"] = label
+            reps.append(maketree(climaf_operator, operator, first[label], *operands[1:], **params))
+        return cens(dict(list(zip(order, reps))), order)
+    else:
+        return maketree(climaf_operator, operator, *operands, **parameters)
 
 
 def ceval_for_cdataset(cobject, userflags=None, format="MaskedArray", deep=None, derived_list=list(),
@@ -388,6 +416,18 @@ def ceval_for_ctree(cobject, userflags=None, format="MaskedArray", deep=None, de
                 clogger.debug("Because out format %s is not (yet, TBD) supported by ceval_select, cannot use "
                               "including object found for : " % format + repr(cobject))
             #
+        clogger.debug(
+            "Searching cache for including domain object for : " + repr(cobject))
+        ########################################################################
+        it, domain = hasIncludingDomainObject(cobject)
+        if it:
+            clogger.info("Object on an including domain found in cache : %s" % it.crs)
+            rep, costs = ceval_select_domain(it, cobject, domain, userflags, deep, derived_list, recurse_list)
+            cdedent()
+            if format == 'file':
+                return rep, costs
+            else:
+                return cread(rep, varOf(cobject)), costs
         clogger.debug(
             "Searching cache for begin  object for : " + repr(cobject))
         ########################################################################
@@ -400,8 +440,9 @@ def ceval_for_ctree(cobject, userflags=None, format="MaskedArray", deep=None, de
                          (cobject.crs, it.crs))
             clogger.debug("comp_period=" + repr(comp_period))
             begcrs = it.crs
-            # Build complement object for end, and eval it
-            comp = copy.deepcopy(it)
+            # Build complement object for end from the requested one (which datasets
+            # may know their files), and eval it
+            comp = copy.deepcopy(cobject)
             comp.setperiod(comp_period)
             evalcomp, _ = ceval(comp, userflags, format,
                                 deep, derived_list, recurse_list)
@@ -412,9 +453,32 @@ def ceval_for_ctree(cobject, userflags=None, format="MaskedArray", deep=None, de
                 return rep, costs
             else:
                 return ceval(cobject), costs
-        #
     clogger.info("nothing relevant found in cache for %s" % cobject.crs)
     #
+    # Objects which are not cached are evaluated by time chunks or latitude bands, if required
+    if time_chunks.chunk_years:
+        chunks = time_chunks.time_chunks(cobject)
+        if chunks:
+            clogger.info("Evaluating %s by %d time chunks" % (cobject.crs, len(chunks)))
+            rep, costs = ceval_time_chunks(cobject, chunks, deep)
+            cdedent()
+            if format == 'file':
+                return rep, costs
+            else:
+                return cread(rep, varOf(cobject)), costs
+    if space_tiles.band_height:
+        tiles = space_tiles.space_tiles(cobject)
+        if tiles:
+            clogger.info("Evaluating %s by %d latitude bands" % (cobject.crs, len(tiles)))
+            rep, costs = ceval_space_tiles(cobject, tiles, deep)
+            # Bands which cannot be assembled are left in cache, and the whole domain is evaluated
+            if rep is not None:
+                cdedent()
+                if format == 'file':
+                    return rep, costs
+                else:
+                    return cread(rep, varOf(cobject)), costs
+    #
     #  Only deep=True can propagate downward !
     if deep:
         down_deep = True
@@ -436,26 +500,168 @@ def ceval_for_ctree(cobject, userflags=None, format="MaskedArray", deep=None, de
             return cread(filen, varOf(cobject)), costs
     elif cobject.operator in operators:
         clogger.debug("Operator %s found" % cobject.operator)
-        # TODO: Implement ceval_operator (and handle costs)
-        obj = ceval_operator(cobject, deep)
-        cdedent()
-        if format in ['file', ]:
-            # TODO: Implement cstore
-            rep = cstore(obj)
-            return rep, compute_cost()
-        else:
-            return obj, compute_cost()
+        opened = list()
+        try:
+            obj, costs = ceval_operator(cobject, down_deep, recurse_list=recurse_list, opened=opened)
+            cdedent()
+            if format in ['file', ] or operators[cobject.operator].materialize:
+                rep = cstore(cobject, obj, costs)
+                if format in ['file', ]:
+                    return rep, costs
+                # Read the stored value, rather than computing OBJ once again
+                return cread(rep, varOf(cobject)), costs
+            return obj.to_masked_array(copy=False), costs
+        finally:
+            xarray_operators.close_datasets(opened)
     else:
         raise Climaf_Driver_Error(
             "operator %s is not a script nor known operator" % str(cobject.operator))
 
 
-def ceval_operator(cobject, deep, *args, **kwargs):
-    raise NotImplementedError()
+def ceval_time_chunks(cobject, chunks, deep=None, workers=None):
+    """
+    Evaluates COBJECT by concatenating the evaluations of CHUNKS, its copies on
+    successive sub-periods (see :py:mod:`~climaf.time_chunks`). Chunks are evaluated
+    and cached on their own, using at most WORKERS concurrent workers (defaults to
+    ``time_chunks.chunk_workers``), so that chunks already in cache are not re-evaluated
 
+    Returns the filename for COBJECT, and its cost
+    """
+    if workers is None:
+        workers = time_chunks.chunk_workers
+    dag = dict([(chunk.crs, (chunk, set())) for chunk in chunks])
+    # Chunks files must not be evicted from cache before being concatenated
+    files = list()
+
+    def eval_chunk(chunk):
+        filename, _ = ceval(chunk, format='file', deep=deep, recurse_list=list())
+        if filename is None:
+            raise Climaf_Driver_Error("Cannot evaluate time chunk %s" % chunk.crs)
+        use_files([filename, ])
+        files.append(filename)
 
-def cstore(cobject, *args, **kwargs):
-    raise NotImplementedError()
+    try:
+        scheduler.run_dag(dag, eval_chunk, workers)
+        rep, costs = concatenate([chunk.crs for chunk in chunks], cobject.crs)
+    finally:
+        release_files(files)
+    if rep is None:
+        raise Climaf_Driver_Error("Cannot concatenate time chunks for %s" % cobject.crs)
+    return rep, costs
+
+
+def ceval_space_tiles(cobject, tiles, deep=None, workers=None):
+    """
+    Evaluates COBJECT by assembling the evaluations of TILES, its copies on successive
+    latitude bands (see :py:mod:`~climaf.space_tiles`). Tiles are evaluated and cached
+    on their own, using at most WORKERS concurrent workers (defaults to
+    ``space_tiles.tile_workers``)
+
+    Returns the filename for COBJECT (or None if the bands cannot be assembled), and its cost
+    """
+    if workers is None:
+        workers = space_tiles.tile_workers
+    dag = dict([(tile.crs, (tile, set())) for tile in tiles])
+    # Tiles files must not be evicted from cache before being assembled
+    files = dict()
+
+    def eval_tile(tile):
+        filename, tile_costs = ceval(tile, format='file', deep=deep, recurse_list=list())
+        if filename is None:
+            raise Climaf_Driver_Error("Cannot evaluate latitude band %s" % tile.crs)
+        use_files([filename, ])
+        files[tile.crs] = (filename, tile_costs)
+
+    costs = compute_cost()
+    filename = generateUniqueFileName(cobject.crs)
+    try:
+        scheduler.run_dag(dag, eval_tile, workers)
+        tim1 = time.time()
+        try:
+            space_tiles.assemble([files[tile.crs][0] for tile in tiles], filename)
+        except Climaf_Error as e:
+            clogger.warning("Cannot assemble latitude bands for %s : %s" % (cobject.crs, str(e)))
+            return None, costs
+        for _, tile_costs in files.values():
+            costs.add(tile_costs)
+        costs.increment(time.time() - tim1)
+    finally:
+        release_files([f for f, _ in files.values()])
+    register(filename, cobject.crs, costs)
+    return filename, costs
+
+
+def ceval_operator(cobject, deep, recurse_list=list(), opened=None):
+    """
+    Evaluates COBJECT, a call to an in-process operator (see :py:class:`~climaf.operators.coperator`),
+    as a lazily computed xarray DataArray. Returns it in pair with a cost object
+
+    Operands which are calls to in-process operators are chained in memory, except if they
+    are already cached or if their operator is to be materialized (see :py:mod:`~climaf.xarray_operators`)
+
+    The xarray Datasets opened for reading operands are appended to list OPENED, if provided;
+    the caller should close them (see :py:func:`~climaf.xarray_operators.close_datasets`) once
+    the result is computed
+    """
+    operator = operators[cobject.operator]
+    total_costs = compute_cost()
+    inputs = list()
+    for op in cobject.operands:
+        value, costs = operator_input(op, deep, recurse_list, opened)
+        total_costs.add(costs)
+        inputs.append(value)
+    parameters = dict([(p, v) for p, v in cobject.parameters.items()
+                       if p not in ["member_label", ] and not p.startswith("add_")])
+    tim1 = time.time()
+    try:
+        rep = operator.function(*inputs, **parameters)
+    except Climaf_Error:
+        raise
+    except Exception as e:
+        raise Climaf_Driver_Error("Something went wrong when computing %s : %s" % (cobject.crs, str(e)))
+    total_costs.increment(time.time() - tim1)
+    if cobject.variable:
+        rep = rep.rename(cobject.variable)
+    return rep, total_costs
+
+
+def operator_input(op, deep, recurse_list, opened=None):
+    """
+    Returns a lazily loaded xarray DataArray for operand OP of an in-process operator, in
+    pair with a cost object. Opened xarray Datasets are appended to list OPENED, if provided
+    """
+    if isinstance(op, ctree) and op.operator in operators and not operators[op.operator].materialize:
+        if deep:
+            cdrop(op)
+        filename, costs = hasExactObject(op)
+        if filename:
+            return xarray_operators.file_array(filename, varOf(op), opened), costs
+        return ceval_operator(op, deep, recurse_list=recurse_list, opened=opened)
+    if isinstance(op, cdataset):
+        rep = xarray_operators.dataset_array(op, opened)
+        if rep is not None:
+            return rep, compute_cost()
+    filename, costs = ceval(op, format='file', deep=deep, recurse_list=recurse_list)
+    if not filename or len(filename.split()) != 1:
+        raise Climaf_Driver_Error("In-process operators need a single file for operand %s" % op.crs)
+    return xarray_operators.file_array(filename, varOf(op), opened), costs
+
+
+def cstore(cobject, obj, costs):
+    """
+    Computes OBJ, the xarray DataArray value of COBJECT (with cost COSTS), and stores
+    it in the cache. Returns the cache filename
+    """
+    filename = generateUniqueFileName(cobject.crs, format="nc")
+    tmpfile, tmpfile_fmt = os.path.splitext(filename)
+    tmp_filename = "%s_%i%s" % (tmpfile, os.getpid(), tmpfile_fmt)
+    tim1 = time.time()
+    obj.to_dataset(name=varOf(cobject) or obj.name).to_netcdf(tmp_filename)
+    costs.increment(time.time() - tim1)
+    if register(tmp_filename, cobject.crs, costs, filename):
+        clogger.info("Stored result of in-process operator for %s" % cobject.crs)
+        return filename
+    raise Climaf_Driver_Error("Could not store result for %s" % cobject.crs)
 
 
 def ceval_for_scriptChild(cobject, userflags=None, format="MaskedArray", deep=None, derived_list=list(),
@@ -520,8 +726,9 @@ def ceval_for_scriptChild(cobject, userflags=None, format="MaskedArray", deep=No
                          (cobject.crs, it.crs))
             clogger.debug("comp_period=" + repr(comp_period))
             begcrs = it.crs
-            # Build complement object for end, and eval it
-            comp = copy.deepcopy(it)
+            # Build complement object for end from the requested one (which datasets
+            # may know their files), and eval it
+            comp = copy.deepcopy(cobject)
             comp.setperiod(comp_period)
             evalcomp, _ = ceval(comp, userflags, format,
                                 deep, derived_list, recurse_list)
@@ -675,10 +882,24 @@ def ceval_for_cens(cobject, userflags=None, format="MaskedArray", deep=None, der
             return cread(filename, varOf(cobject)), costs
     d = dict()
     costs = dict()
-    for member in cobject.order:
-        # print ("evaluating member %s"%member)
-        d[member], costs[member] = ceval(cobject[member],
-                                         copy.copy(userflags), format, deep, recurse_list=recurse_list)
+    if ensemble_workers <= 1:
+        for member in cobject.order:
+            # print ("evaluating member %s"%member)
+            d[member], costs[member] = ceval(cobject[member],
+                                             copy.copy(userflags), format, deep, recurse_list=recurse_list)
+    else:
+        # Members are independent : evaluate them concurrently, and report on all failed members at once
+        results, errors = scheduler.map_isolated(
+            lambda m: ceval(cobject[m], copy.copy(userflags), format, deep, recurse_list=recurse_list),
+            cobject.order, ensemble_workers)
+        if errors:
+            cdedent()
+            raise Climaf_Driver_Error("Evaluation failed for %d member(s) of ensemble %s : %s" %
+                                      (len(errors), cobject.crs,
+                                       "; ".join(["%s : %s" % (m, str(errors[m])) for m in cobject.order
+                                                  if m in errors])))
+        for member in cobject.order:
+            d[member], costs[member] = results[member]
 
     cdedent()
     if format in ["file", ]:
@@ -709,8 +930,11 @@ def ceval_for_string(cobject, userflags=None, format="MaskedArray", deep=None, d
         "Evaluation from CRS is not yet implemented ( %s )" % cobject)
 
 
-def evaluate_inputs(call, deep=False, recurse_list=[]):
+def evaluate_inputs(call, deep=False, recurse_list=[], in_use=None):
     # Evaluate input data for a script call , either a CliMAF-tye one or an ESMValTool one
+    # If IN_USE is a list, each input value is declared as used (see use_files) as soon as
+    # evaluated, so that it is not evicted by the evaluation of next operands, and is
+    # appended to IN_USE
     invalues = []
     sizes = []
     total_costs = compute_cost()
@@ -728,6 +952,9 @@ def evaluate_inputs(call, deep=False, recurse_list=[]):
             if inValue in [None, ""]:
                 raise Climaf_Driver_Error(
                     "When evaluating %s : value for %s is None" % (call.script, repr(op)))
+            if in_use is not None:
+                use_files([inValue, ])
+                in_use.append(inValue)
             if isinstance(inValue, list):
                 size = len(inValue)
             else:
@@ -741,6 +968,50 @@ def evaluate_inputs(call, deep=False, recurse_list=[]):
     return invalues, sizes, total_costs
 
 
+def evaluate_fused_inputs(call, deep=False, recurse_list=[], in_use=None):
+    """
+    Evaluate input data for CDO script call CALL, by fusing operands which are CDO script
+    calls too, and which are neither cached nor to be materialized, into a chain of CDO
+    operators (see :py:mod:`~climaf.cdo_fusion`). The input value for such an operand is
+    the CDO chain expression computing it.
+
+    If IN_USE is a list, evaluated files are declared as used as soon as evaluated (see
+    :py:func:`evaluate_inputs`)
+
+    Returns the list of input values, and the costs
+    """
+    total_costs = compute_cost()
+    shared = cdo_fusion.shared_objects(call)
+
+    def evaluate(op, parent):
+        if isinstance(op, cdataset) and not (op.isLocal() or op.isCached()):
+            inValue, costs = ceval(op, format='file', deep=deep)
+        else:
+            inValue, costs = ceval(op, format='file', deep=deep,
+                                   userflags=parent.flags, recurse_list=recurse_list)
+        total_costs.add(costs)
+        if in_use is not None and inValue not in [None, ""]:
+            use_files([inValue, ])
+            in_use.append(inValue)
+        return inValue
+
+    def is_cached(op):
+        return deep is None and hasExactObject(op)[0] is not None
+
+    invalues = list()
+    for op in call.operands:
+        inValue = cdo_fusion.chain(op, evaluate, is_cached, shared)
+        if inValue is not None:
+            clogger.info("Fusing %s in the evaluation of %s" % (op.crs, call.operator))
+        else:
+            inValue = evaluate(op, call)
+        if inValue in [None, ""]:
+            raise Climaf_Driver_Error(
+                "When evaluating %s : value for %s is None" % (call.script, repr(op)))
+        invalues.append(inValue)
+    return invalues, total_costs
+
+
 def ceval(cobject, userflags=None, format="MaskedArray",
           deep=None, derived_list=[], recurse_list=[]):
     """
@@ -794,6 +1065,38 @@ def ceval(cobject, userflags=None, format="MaskedArray",
             "argument " + repr(cobject) + " is not (yet) managed")
 
 
+def ceval_dag(cobject, deep=None, workers=None):
+    """
+    Evaluates, as cache files and using at most WORKERS concurrent workers, all
+    script calls involved in the evaluation of COBJECT, taking care that independent
+    sub-trees are evaluated concurrently, and that identical sub-trees are evaluated
+    only once. See :py:mod:`~climaf.scheduler`
+
+    Arg DEEP has the same meaning as for :py:func:`~climaf.driver.ceval` : with
+    deep=True, each script call is re-evaluated once; with deep=False, only the
+    top-level ones are re-evaluated
+
+    Returns the value of arg DEEP which should be used for a subsequent evaluation
+    of COBJECT (which then mainly benefits from the cache)
+    """
+    dag = scheduler.build_dag(cobject)
+    roots = scheduler.dag_roots(dag)
+    top_level_is_object = not isinstance(cobject, (cpage, cpage_pdf))
+
+    def node_deep(crs):
+        if deep or (deep is False and crs in roots and top_level_is_object):
+            return False
+        return None
+
+    scheduler.run_dag(dag, lambda node: ceval(node, format='file', deep=node_deep(node.crs)), workers)
+    if cobject.crs in dag or (isinstance(cobject, cens) and len(dag) > 0):
+        return None
+    elif deep is not None:
+        return False
+    else:
+        return None
+
+
 def ceval_script(scriptCall, deep, recurse_list=[]):
     """ Actually applies a CliMAF-declared script on a script_call object
 
@@ -803,13 +1106,53 @@ def ceval_script(scriptCall, deep, recurse_list=[]):
 
     Returns a CLiMAF cache data filename
     """
+    total_costs = compute_cost()
+    # Input files must not be evicted from cache while next operands are evaluated
+    # and while the script is running
+    in_use = list()
+    lock = None
+    try:
+        # Evaluate input data
+        if cdo_fusion.cdo_fusion and cdo_fusion.is_fusable(scriptCall):
+            invalues, partial_cost = evaluate_fused_inputs(scriptCall, deep, recurse_list, in_use)
+        else:
+            invalues, sizes, partial_cost = evaluate_inputs(
+                scriptCall, deep, recurse_list, in_use)
+        total_costs.add(partial_cost)
+        # Another process or thread may compute the same object : only one does it
+        if crs_locks.needs_lock(scriptCall):
+            lock = crs_locks.object_lock(scriptCall.crs)
+        if lock is not None and lock.acquire() and not deep:
+            # The lock holder may have computed the object meanwhile. Objects computed by
+            # other processes are not registered in this process index
+            filename, costs = hasExactObject(scriptCall, warn=False)
+            if filename:
+                clogger.info("Object %s was computed by another evaluation" % scriptCall.crs)
+                return filename, costs
+        return apply_script(scriptCall, invalues, total_costs)
+    finally:
+        if lock is not None:
+            lock.release()
+        release_files(in_use)
+
+
+def input_files(invalue):
+    """
+    Returns the list of filenames in input value INVALUE, which may be a CDO chain
+    expression (see :py:func:`evaluate_fused_inputs`)
+    """
+    return [word for word in invalue.split(" ") if word != "" and not word.startswith("-")]
+
+
+def apply_script(scriptCall, invalues, total_costs):
+    """
+    Build the command applying the script of SCRIPTCALL on input files INVALUES (as
+    provided by evaluate_inputs), launch it and register its outputs in cache
+
+    Returns a CLiMAF cache data filename, and its costs (which add to TOTAL_COSTS)
+    """
     script = cscripts[scriptCall.operator]
     template = Template(script.command.replace("{!", "{"))
-    total_costs = compute_cost()
-    # Evaluate input data
-    invalues, sizes, partial_cost = evaluate_inputs(
-        scriptCall, deep, recurse_list)
-    total_costs.add(partial_cost)
     # print("len(invalues)=%d"%len(invalues))
     #
     # Replace input data placeholders with filenames
@@ -821,7 +1164,7 @@ def ceval_script(scriptCall, deep, recurse_list=[]):
         # print("processing 0, op=%s"%`op`)
         infile = invalues[0]
         if (scriptCall.operator != 'remote_select') and \
-                not all(map(os.path.exists, infile.split(" "))):
+                not all(map(os.path.exists, input_files(infile))):
             raise Climaf_Driver_Error("Internal error : for script %s and 1st operand %s, "
                                       "some input file does not exist among %s:" % (scriptCall.operator, op, infile))
         subdict[label] = infile
@@ -872,7 +1215,7 @@ def ceval_script(scriptCall, deep, recurse_list=[]):
         # print("processing %s, i=%d"%(`op`,i))
         infile = invalues[i]
         if (scriptCall.operator != 'remote_select') and infile != '' and \
-                not all(map(os.path.exists, infile.split(" "))):
+                not all(map(os.path.exists, input_files(infile))):
             raise Climaf_Driver_Error(
                 "Internal error : some input file does not exist among %s:" % infile)
         i += 1
@@ -1005,47 +1348,9 @@ def ceval_script(scriptCall, deep, recurse_list=[]):
     clogger.debug("Script call template after removing empty args : " +
                   template)
     #    #
-    # Link the fixed fields needed by the script/operator
-    if script.fixedfields is not None:
-        # subdict_ff=dict()
-        subdict_ff = scriptCall.parameters.copy()
-        subdict_ff["model"] = modelOf(scriptCall.operands[0])
-        subdict_ff["simulation"] = simulationOf(scriptCall.operands[0])
-        subdict_ff["project"] = projectOf(scriptCall.operands[0])
-        subdict_ff["realm"] = realmOf(scriptCall.operands[0])
-        subdict_ff["grid"] = gridOf(scriptCall.operands[0])
-        # return paths: (linkname, targetname)
-        scr_fixed_fields = script.fixedfields
-        files_exist = dict()
-        for ll, lt in scr_fixed_fields:
-            # Replace input data placeholders with filenames for fixed fields
-            template_ff_target = Template(lt).substitute(subdict_ff)
-            # symlink if needed
-            files_exist[ll] = False
-            if os.path.islink(ll):
-                if os.path.realpath(ll) != template_ff_target:
-                    os.remove(ll)
-                    os.symlink(template_ff_target, ll)
-            elif os.path.isfile(ll):
-                files_exist[ll] = True
-            else:
-                os.symlink(template_ff_target, ll)
-    #
-    tim1 = time.time()
-    clogger.info("Launching command:" + template)
-    #
-    with open(logdir + '/last.out', scripts_output_write_mode) as logfile:
-        logfile.write(
-            "\n\nstdout and stderr of script call :\n\t " + template + "\n\n")
-        try:
-            subprocess.check_call(template, stdout=logfile,
-                                  stderr=subprocess.STDOUT, shell=True)
-        except subprocess.CalledProcessError:
-            raise Climaf_Driver_Error("Something went wrong when computing %s. See file ./last.out for details" %
-                                      scriptCall.crs)
-
-    #
-    duration = time.time() - tim1
+    # Fixed fields are linked in the current directory, which is shared by concurrent script calls
+    with fixed_fields_lock if script.fixedfields is not None else nullcontext():
+        script_output, duration = run_script_call(script, scriptCall, template)
     total_costs.increment(duration)
     # For remote files, we supply ds.local_copies_of_remote_files
     # for local filenames in order to can use ds.check()
@@ -1056,17 +1361,9 @@ def ceval_script(scriptCall, deep, recurse_list=[]):
         scriptCall.operands[0].local_copies_of_remote_files = ' '.join(
             local_filename)
     #
-    # Clean fixed fields symbolic links (linkname, targetname)
-    if script.fixedfields:
-        for ll, lt in script.fixedfields:
-            if not files_exist[ll]:
-                os.system("rm -f " + ll)
-
     # Handle outputs
     if script.outputFormat in ["txt", ]:
-        with open(logdir + "/last.out", 'r') as f:
-            for line in f.readlines():
-                sys.stdout.write(line)
+        sys.stdout.write(script_output)
     if script.outputFormat in none_formats or required_outputFormat == 'show':
         clogger.debug("No output to manage, because script.outputFormat=%s and required_outputFormat=%s" %
                       (script.outputFormat, required_outputFormat))
@@ -1088,6 +1385,75 @@ def ceval_script(scriptCall, deep, recurse_list=[]):
                                   ": %s. \n See %s/last.out" % (template, logdir))
 
 
+def run_script_call(script, scriptCall, template):
+    """
+    Links the fixed fields needed by SCRIPT for SCRIPTCALL, runs shell command TEMPLATE and
+    cleans the links. The command output is written in a file of its own, and then in
+    logdir/last.out (according to `scripts_output_write_mode`)
+
+    Returns the command output and its duration
+    """
+    #
+    # Link the fixed fields needed by the script/operator
+    if script.fixedfields is not None:
+        # subdict_ff=dict()
+        subdict_ff = scriptCall.parameters.copy()
+        subdict_ff["model"] = modelOf(scriptCall.operands[0])
+        subdict_ff["simulation"] = simulationOf(scriptCall.operands[0])
+        subdict_ff["project"] = projectOf(scriptCall.operands[0])
+        subdict_ff["realm"] = realmOf(scriptCall.operands[0])
+        subdict_ff["grid"] = gridOf(scriptCall.operands[0])
+        # return paths: (linkname, targetname)
+        scr_fixed_fields = script.fixedfields
+        files_exist = dict()
+        for ll, lt in scr_fixed_fields:
+            # Replace input data placeholders with filenames for fixed fields
+            template_ff_target = Template(lt).substitute(subdict_ff)
+            # symlink if needed
+            files_exist[ll] = False
+            if os.path.islink(ll):
+                if os.path.realpath(ll) != template_ff_target:
+                    os.remove(ll)
+                    os.symlink(template_ff_target, ll)
+            elif os.path.isfile(ll):
+                files_exist[ll] = True
+            else:
+                os.symlink(template_ff_target, ll)
+    #
+    tim1 = time.time()
+    clogger.info("Launching command:" + template)
+    #
+    try:
+        with tempfile.NamedTemporaryFile(mode="w+", dir=logdir, prefix="last.", suffix=".out",
+                                         delete=False) as logfile:
+            logfilename = logfile.name
+            logfile.write(
+                "\n\nstdout and stderr of script call :\n\t " + template + "\n\n")
+            try:
+                executors.run(template, logfile)
+                failed = False
+            except subprocess.CalledProcessError:
+                failed = True
+        try:
+            with open(logfilename, "r") as logfile:
+                output = logfile.read()
+            with scripts_output_lock:
+                with open(logdir + '/last.out', scripts_output_write_mode) as logfile:
+                    logfile.write(output)
+        finally:
+            os.remove(logfilename)
+    finally:
+        # Clean fixed fields symbolic links (linkname, targetname)
+        if script.fixedfields:
+            for ll, lt in script.fixedfields:
+                if not files_exist[ll]:
+                    os.system("rm -f " + ll)
+    if failed:
+        raise Climaf_Driver_Error("Something went wrong when computing %s. See file ./last.out for details" %
+                                  scriptCall.crs)
+    return output, time.time() - tim1
+
+
 def ceval_evt(climaf_name, script, *operands, **parameters):
     """
     Evaluates OPERANDS and forward them to function
@@ -1167,6 +1533,21 @@ def ceval_select(includer, included, userflags, format, deep, derived_list, recu
         return None, compute_cost()
 
 
+def ceval_select_domain(includer, included, domain, userflags, deep, derived_list, recurse_list):
+    """ Extract object INCLUDED, which datasets have DOMAIN (a list [latmin, latmax,
+    lonmin, lonmax]), from (existing) object INCLUDER, which is the same object on a
+    larger domain. Returns a filename and a cost object
+    """
+    latmin, latmax, lonmin, lonmax = domain
+    extract = capply('llbox', includer, latmin=latmin, latmax=latmax, lonmin=lonmin, lonmax=lonmax)
+    clogger.debug("extract domain %s out of %s" % (repr(domain), includer.crs))
+    objfile, costs = ceval(extract, userflags, 'file', deep, derived_list, recurse_list)
+    if objfile:
+        return rename(objfile, included.crs), costs
+    else:
+        raise Climaf_Driver_Error("Cannot evaluate " + repr(extract))
+
+
 def cread(datafile, varname=None, period=None):
     if not datafile:
         return None
@@ -1313,7 +1694,7 @@ def noselect(userflags, ds, format):
 # Commodity functions
 #########################
 
-def cfile(object, target=None, ln=None, hard=None, deep=None):
+def cfile(object, target=None, ln=None, hard=None, deep=None, workers=None):
     """
     Provide the filename for a CliMAF object, or copy this file to target. Launch computation if needed.
 
@@ -1341,6 +1722,10 @@ def cfile(object, target=None, ln=None, hard=None, deep=None):
 
         - True  : make a deep computation, i.e. do not use any cached value
 
+      workers (int, optional) : number of script calls which can be run concurrently, for
+       evaluating independent sub-trees of the object; defaults to
+       :py:data:`climaf.scheduler.default_workers`, and 1 means a sequential evaluation
+
     Returns:
 
        - if target is provided, returns this filename (or linkname) if computation is
@@ -1356,7 +1741,11 @@ def cfile(object, target=None, ln=None, hard=None, deep=None):
     clogger.debug("Starting cfile at: " +
                   start_time.strftime("%Y-%m-%d %H:%M:%S"))
     #
-    # -- Evaluate the CliMAF object
+    # -- Evaluate the CliMAF object, possibly evaluating first its independent sub-trees concurrently
+    if workers is None:
+        workers = scheduler.default_workers
+    if workers > 1:
+        deep = ceval_dag(object, deep=deep, workers=workers)
     result, costs = ceval(object, format='file', deep=deep)
     #
     end_time = datetime.now()
@@ -1434,7 +1823,18 @@ def cxr(obj):
     """
     Provide the Xarray value of a CliMAF object. Launch computation if needed.
     (current design is as simple as possible : no control of re-computation)
+
+    The value of a call to an in-process operator (see :py:class:`~climaf.operators.coperator`)
+    which is not cached is computed without writing it in the cache
     """
+    if isinstance(obj, ctree) and obj.operator in operators and not operators[obj.operator].materialize \
+            and not hasExactObject(obj)[0]:
+        opened = list()
+        try:
+            value, _ = ceval_operator(obj, None, opened=opened)
+            return value.load()
+        finally:
+            xarray_operators.close_datasets(opened)
     with xarray.open_dataset(cfile(obj)) as f:
         return f[obj.variable]
 
@@ -1838,9 +2238,14 @@ def efile(obj, filename, force=False):
                 raise Climaf_Driver_Error(
                     "File '%s' already exists: use 'force=True' to overwrite it" % filename)
 
+        # Materialize all members first, possibly concurrently (see ensemble_workers)
+        files, errors = scheduler.map_isolated(lambda lab: cfile(obj[lab]), obj.order, ensemble_workers)
+        if errors:
+            raise Climaf_Driver_Error("Evaluation failed for member(s) %s of ensemble %s" %
+                                      (", ".join([lab for lab in obj.order if lab in errors]), obj.crs))
         for lab in obj.order:
             memb = obj[lab]
-            ffile = cfile(memb)
+            ffile = files[lab]
 
             f = tempfile.NamedTemporaryFile(suffix=".nc")
             command = "ncrename -O -v %s,%s_%s %s %s" % (
@@ -1853,6 +2258,6 @@ def efile(obj, filename, force=False):
                 raise Climaf_Driver_Error(
                     "Issue when merging %s and %s (using command: %s)" % (f.name, filename, command2))
             f.close()
-            return True
+        return True
     else:
         clogger.warning("objet is not a 'cens' objet")
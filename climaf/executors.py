@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Executors for the commands of script calls (see :py:func:`~climaf.driver.apply_script`)
+
+The executor is selected by `script_executor` (or environment variable
+CLIMAF_SCRIPT_EXECUTOR), among :
+
+ - 'inline' (the default) : the command is run by the calling process, in a shell
+   (or by a warm Python worker, see :py:mod:`~climaf.python_workers`)
+ - 'pool' : the command is run as with 'inline', but at most `pool_processes`
+   commands run at the same time, whatever the number of threads evaluating
+   objects (see :py:func:`~climaf.driver.ceval_dag`)
+ - 'batch' : the command is submitted as a job to a batch scheduler (using
+   `batch_submit`, e.g. SLURM's sbatch), and the executor waits for its completion,
+   which the job signals by writing a status file. Jobs must thus see the same file
+   system as the calling process, which keeps managing the cache and its index.
+   The job id printed by the submit command is used for periodically checking, with
+   `batch_status`, that the job is still known to the scheduler, so that a job which
+   was killed (or cancelled) before writing its status file is detected.
+
+Using the 'batch' executor together with many concurrent workers for evaluating
+a DAG (e.g. ``cfile(obj, workers=50)``) distributes its script calls on cluster nodes.
+
+`script_executor` may also be an instance of a sub-class of :py:class:`executor`.
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import time
+import uuid
+import shlex
+import threading
+import subprocess
+from string import Template
+
+import env
+from env.environment import *
+from env.clogging import clogger
+from climaf.utils import Climaf_Driver_Error
+from climaf import python_workers
+
+#: The executor for script calls : 'inline', 'pool', 'batch', or an executor instance
+script_executor = os.getenv("CLIMAF_SCRIPT_EXECUTOR", "inline")
+#: Maximum number of commands run at the same time by executor 'pool'
+pool_processes = os.cpu_count() or 1
+#: Command for submitting a job script with executor 'batch'; ${script} is the job script,
+#  ${log} the file for its outputs, and ${name} a job name
+batch_submit = os.getenv("CLIMAF_BATCH_SUBMIT", "sbatch --parsable --job-name=${name} --output=${log} ${script}")
+#: Directory for job scripts, logs and status files of executor 'batch' (None means : sub-directory
+#  'batch_jobs' of the current cache). It must be visible from the batch nodes
+batch_directory = None
+#: Period at which executor 'batch' checks for the completion of jobs (in seconds)
+batch_polling_period = 2.
+#: Maximum duration of a job for executor 'batch', including its queuing time (in seconds, None means no limit)
+batch_timeout = None
+#: Command for checking that a job submitted by executor 'batch' is still pending or running;
+#  ${jobid} is the job id (the first ';'-separated field of the last line output by the submit
+#  command). The job is considered as ended when the command fails or outputs nothing.
+#  None means : no check
+batch_status = os.getenv("CLIMAF_BATCH_STATUS", "squeue --noheader --jobs=${jobid}")
+#: Period at which executor 'batch' checks with `batch_status` that jobs are still alive (in seconds)
+batch_status_period = 30.
+
+
+class executor(object):
+    """
+    Base class for the executors of script calls commands
+    """
+
+    def run(self, command, logfile):
+        """
+        Run shell COMMAND, appending its standard output and error to LOGFILE (an open
+        file). Raises subprocess.CalledProcessError if the command fails
+        """
+        raise NotImplementedError
+
+
+class inline_executor(executor):
+    """
+    Run commands in the calling process
+    """
+
+    def run(self, command, logfile):
+        logfile.flush()
+        if not python_workers.run_in_worker(command, logfile.name):
+            logfile.seek(0, os.SEEK_END)
+            subprocess.check_call(command, stdout=logfile, stderr=subprocess.STDOUT, shell=True)
+
+
+class pool_executor(inline_executor):
+    """
+    Run commands in the calling process, with at most PROCESSES (defaults to
+    `pool_processes`) commands running at the same time
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes
+        self.slots = None
+        self.lock = threading.Lock()
+
+    def run(self, command, logfile):
+        with self.lock:
+            if self.slots is None:
+                self.slots = threading.BoundedSemaphore(max(1, int(self.processes or pool_processes)))
+        with self.slots:
+            super(pool_executor, self).run(command, logfile)
+
+
+class batch_executor(executor):
+    """
+    Submit commands as batch jobs (using SUBMIT, which defaults to `batch_submit`),
+    and wait for their completion, checking with STATUS (which defaults to `batch_status`)
+    that the jobs are still alive
+    """
+
+    def __init__(self, submit=None, directory=None, polling_period=None, timeout=None, status=None,
+                 status_period=None):
+        self.submit = submit
+        self.directory = directory
+        self.polling_period = polling_period
+        self.timeout = timeout
+        self.status = status
+        self.status_period = status_period
+
+    def job_directory(self):
+        directory = self.directory or batch_directory
+        if directory is None:
+            directory = os.path.join(os.path.expanduser(env.environment.currentCache), "batch_jobs")
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def write_job(self, command, name):
+        """
+        Writes the job script for COMMAND, and returns the names of the script, log and
+        status files
+        """
+        prefix = os.path.join(self.job_directory(), name)
+        script, log, status = prefix + ".sh", prefix + ".out", prefix + ".status"
+        with open(script, "w") as f:
+            f.write("#!/bin/bash\n")
+            f.write("cd %s\n" % shlex.quote(os.getcwd()))
+            f.write("( %s\n) >> %s 2>&1\n" % (command, shlex.quote(log)))
+            # The status file is written atomically, as the last action of the job
+            f.write("echo $? > %s.tmp && mv %s.tmp %s\n" % ((shlex.quote(status), ) * 3))
+        os.chmod(script, 0o755)
+        return script, log, status
+
+    def is_alive(self, jobid):
+        """
+        False if the status command tells that job JOBID is no more pending or running
+        """
+        status = self.status or batch_status
+        if status is None or not jobid:
+            return True
+        command = Template(status).safe_substitute(jobid=jobid)
+        try:
+            output = subprocess.check_output(command, shell=True, stderr=subprocess.STDOUT,
+                                             universal_newlines=True)
+        except subprocess.CalledProcessError as e:
+            clogger.debug("Job %s status command %s failed : %s" % (jobid, command, e.output))
+            return False
+        return output.strip() != ""
+
+    def run(self, command, logfile):
+        name = "climaf_%s" % uuid.uuid4().hex[:12]
+        script, log, status = self.write_job(command, name)
+        submit = Template(self.submit or batch_submit).safe_substitute(script=script, log=log + ".job", name=name)
+        clogger.debug("Submitting job %s : %s" % (name, submit))
+        try:
+            output = subprocess.check_output(submit, shell=True, stderr=subprocess.STDOUT, universal_newlines=True)
+        except subprocess.CalledProcessError as e:
+            logfile.write(e.output or "")
+            raise Climaf_Driver_Error("Cannot submit job for command %s (using %s) : %s" % (command, submit, e.output))
+        clogger.info("Job %s submitted for %s (%s)" % (name, command, output.strip()))
+        lines = output.strip().splitlines()
+        jobid = lines[-1].split(";")[0].strip() if len(lines) > 0 else None
+        polling_period = self.polling_period or batch_polling_period
+        status_period = self.status_period or batch_status_period
+        timeout = self.timeout or batch_timeout
+        start = time.time()
+        last_check = start
+        missing = 0
+        while not os.path.exists(status):
+            if timeout is not None and time.time() - start > timeout:
+                raise Climaf_Driver_Error("Job %s for command %s did not complete within %d s. See %s" %
+                                          (name, command, timeout, log))
+            if time.time() - last_check > status_period:
+                last_check = time.time()
+                # The job must be found ended twice, for leaving time to its status file to
+                # become visible, and for bearing with a transient failure of the status command
+                missing = 0 if self.is_alive(jobid) else missing + 1
+                if missing >= 2 and not os.path.exists(status):
+                    raise Climaf_Driver_Error("Job %s (%s) for command %s ended without writing its status. "
+                                              "See %s and %s" % (name, jobid, command, log, log + ".job"))
+            time.sleep(polling_period)
+        with open(status) as f:
+            returncode = int(f.read().strip() or 1)
+        if os.path.exists(log):
+            with open(log) as f:
+                logfile.write(f.read())
+            logfile.flush()
+        for filename in [script, log, status, log + ".job"]:
+            if returncode == 0 and os.path.exists(filename):
+                os.remove(filename)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+
+executors = dict(inline=inline_executor(), pool=pool_executor(), batch=batch_executor())
+
+
+def get_executor():
+    """
+    Returns the executor instance selected by `script_executor`
+    """
+    if isinstance(script_executor, executor):
+        return script_executor
+    if script_executor not in executors:
+        raise Climaf_Driver_Error("Unknown script executor %s; known ones are : %s" %
+                                  (script_executor, ", ".join(sorted(executors))))
+    return executors[script_executor]
+
+
+def run(command, logfile):
+    """
+    Run shell COMMAND using the selected executor, appending its standard output and
+    error to LOGFILE (an open file). Raises subprocess.CalledProcessError if the command fails
+    """
+    get_executor().run(command, logfile)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A persistent cache of data files metadata (variables, dimensions, global attributes,
+time limits...), as computed by functions of :py:mod:`~climaf.netcdfbasics`
+
+Metadata are stored in a SQLite database (in WAL mode, so that it can be shared by
+concurrent CliMAF sessions), and keyed by file path and metadata name. Each entry
+also records the size, modification time and inode of the file when the metadata
+was computed, and is recomputed as soon as one of them changes.
+
+A session-wide, in-memory, layer avoids querying the database repeatedly.
+
+Entries of files removed from the CliMAF cache are deleted (see :py:func:`forget_metadata`),
+entries of files which no longer exist or have changed are deleted by :py:func:`prune_metadata`
+(which :py:func:`~climaf.cache.csync` calls at most once every `metadata_cache_prune_period`
+seconds, across all sessions), and the number of entries is capped to `metadata_cache_max_entries`
+by deleting the least recently written ones.
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from env.clogging import clogger
+
+#: Should data files metadata be cached (in memory and in file `metadata_cache_file`)
+use_metadata_cache = True
+#: The SQLite file for the persistent cache of data files metadata
+metadata_cache_file = os.getenv("CLIMAF_FILE_METADATA", "~/.climaf.file_metadata.sqlite")
+#: Maximum number of entries in the persistent cache of data files metadata (None means : no limit);
+#  it is enforced every `metadata_cache_cap_period` writes
+metadata_cache_max_entries = 200000
+#: Number of writes in the persistent cache of data files metadata between two enforcements
+#  of `metadata_cache_max_entries`
+metadata_cache_cap_period = 1000
+#: Minimum delay (in seconds) between two automatic prunings of the persistent cache of data
+#  files metadata (see :py:func:`prune_metadata`); None disables automatic pruning
+metadata_cache_prune_period = 86400.
+
+_schema = """
+CREATE TABLE IF NOT EXISTS metadata (
+    path TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    inode INTEGER,
+    value TEXT,
+    PRIMARY KEY (path, key)
+);
+CREATE TABLE IF NOT EXISTS pruning (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    time REAL
+);
+"""
+
+
+def file_signature(filename):
+    """
+    Returns the tuple (size, mtime, inode) of FILENAME, which changes when the file changes,
+    or None if the file does not exist
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime, stat.st_ino
+
+
+class metadata_cache(object):
+    """
+    The cache of data files metadata, stored in SQLite database FILENAME. Values must be
+    JSON-serializable
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self.lock = threading.RLock()
+        self.memory = dict()
+        self.connection = None
+        self.writes = 0
+
+    def _connect(self):
+        # Open the database lazily, and go on without it if it cannot be opened
+        if self.connection is None:
+            try:
+                dirname = os.path.dirname(self.filename)
+                if dirname and not os.path.isdir(dirname):
+                    os.makedirs(dirname, exist_ok=True)
+                self.connection = sqlite3.connect(self.filename, timeout=60., isolation_level=None,
+                                                  check_same_thread=False)
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.execute("PRAGMA synchronous=NORMAL")
+                self.connection.executescript(_schema)
+            except sqlite3.Error as e:
+                clogger.warning("Cannot use file metadata cache %s : %s" % (self.filename, str(e)))
+                self.connection = False
+        return self.connection
+
+    def close(self):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+            self.connection = None
+            self.memory.clear()
+
+    def get(self, filename, key, compute):
+        """
+        Returns the metadata KEY of file FILENAME, either from the cache if it is
+        up to date, or by calling COMPUTE(FILENAME) (and then caching the result)
+        """
+        path = os.path.abspath(filename)
+        signature = file_signature(path)
+        if signature is None:
+            return compute(filename)
+        with self.lock:
+            entry = self.memory.get((path, key))
+            if entry is not None and entry[0] == signature:
+                return json.loads(entry[1])
+            connection = self._connect()
+            if connection:
+                try:
+                    rows = connection.execute("SELECT size, mtime, inode, value FROM metadata "
+                                              "WHERE path=? AND key=?", (path, key)).fetchall()
+                except sqlite3.Error as e:
+                    clogger.debug("Cannot read file metadata cache : %s" % str(e))
+                    rows = []
+                if len(rows) > 0 and tuple(rows[0][0:3]) == signature:
+                    self.memory[(path, key)] = (signature, rows[0][3])
+                    return json.loads(rows[0][3])
+        value = compute(filename)
+        try:
+            serialized = json.dumps(value)
+        except (TypeError, ValueError):
+            clogger.debug("Cannot cache metadata %s of %s" % (key, filename))
+            return value
+        with self.lock:
+            self.memory[(path, key)] = (signature, serialized)
+            connection = self._connect()
+            if connection:
+                try:
+                    connection.execute("INSERT OR REPLACE INTO metadata VALUES (?,?,?,?,?,?)",
+                                       (path, key) + signature + (serialized, ))
+                    self.writes += 1
+                    if self.writes % metadata_cache_cap_period == 0:
+                        self.cap()
+                except sqlite3.Error as e:
+                    clogger.debug("Cannot write in file metadata cache : %s" % str(e))
+        return json.loads(serialized)
+
+    def forget(self, filename=None, directory=None):
+        """
+        Forget metadata of FILENAME (a path or a list of paths), or of all files under
+        DIRECTORY, or of all files if both are None
+        """
+        with self.lock:
+            if directory is not None:
+                prefix = os.path.join(os.path.abspath(os.path.expanduser(directory)), "")
+                for key in [k for k in self.memory if k[0].startswith(prefix)]:
+                    self.memory.pop(key)
+                requests = [("DELETE FROM metadata WHERE substr(path, 1, ?)=?", (len(prefix), prefix))]
+            elif filename is None:
+                self.memory.clear()
+                requests = [("DELETE FROM metadata", ())]
+            else:
+                if isinstance(filename, (list, tuple, set)):
+                    paths = set([os.path.abspath(f) for f in filename])
+                else:
+                    paths = {os.path.abspath(filename)}
+                for key in [k for k in self.memory if k[0] in paths]:
+                    self.memory.pop(key)
+                requests = [("DELETE FROM metadata WHERE path=?", (path, )) for path in paths]
+            connection = self._connect()
+            if connection:
+                try:
+                    connection.execute("BEGIN IMMEDIATE")
+                    try:
+                        for request, args in requests:
+                            connection.execute(request, args)
+                    finally:
+                        connection.execute("COMMIT")
+                except sqlite3.Error as e:
+                    clogger.debug("Cannot delete in file metadata cache : %s" % str(e))
+
+    def cap(self):
+        """
+        Delete the least recently written entries beyond `metadata_cache_max_entries`
+        """
+        if metadata_cache_max_entries is None:
+            return
+        with self.lock:
+            connection = self._connect()
+            if connection:
+                # INSERT OR REPLACE gives a new rowid, hence rowids follow the write order
+                connection.execute("DELETE FROM metadata WHERE rowid IN (SELECT rowid FROM metadata "
+                                   "ORDER BY rowid DESC LIMIT -1 OFFSET ?)", (metadata_cache_max_entries, ))
+
+    def prune(self, force=True):
+        """
+        Delete the entries of files which no longer exist or have changed, and enforce
+        `metadata_cache_max_entries`. Returns the number of remaining entries
+
+        If FORCE is False, do nothing (and return None) if the database was pruned less
+        than `metadata_cache_prune_period` seconds ago
+        """
+        with self.lock:
+            connection = self._connect()
+            if not force and (metadata_cache_prune_period is None or not connection or
+                              not self._prune_is_due(connection)):
+                return None
+            for key in [k for k, entry in self.memory.items() if file_signature(k[0]) != entry[0]]:
+                self.memory.pop(key)
+            if not connection:
+                return len(self.memory)
+            try:
+                rows = connection.execute("SELECT DISTINCT path, size, mtime, inode FROM metadata").fetchall()
+                stale = [tuple(row) for row in rows if file_signature(row[0]) != tuple(row[1:])]
+                connection.executemany("DELETE FROM metadata WHERE path=? AND size=? AND mtime=? AND inode=?",
+                                       stale)
+                self.cap()
+                connection.execute("INSERT OR REPLACE INTO pruning VALUES (0, ?)", (time.time(), ))
+                return connection.execute("SELECT count(*) FROM metadata").fetchone()[0]
+            except sqlite3.Error as e:
+                clogger.debug("Cannot prune file metadata cache : %s" % str(e))
+                return None
+
+    def _prune_is_due(self, connection):
+        # Record the pruning time right away, so that concurrent sessions do not prune too
+        now = time.time()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute("SELECT time FROM pruning").fetchall()
+                # The delay for a new database starts now
+                due = len(rows) > 0 and now - rows[0][0] >= metadata_cache_prune_period
+                if due or len(rows) == 0:
+                    connection.execute("INSERT OR REPLACE INTO pruning VALUES (0, ?)", (now, ))
+            finally:
+                connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            clogger.debug("Cannot read file metadata cache pruning time : %s" % str(e))
+            return False
+        return due
+
+
+metadata = metadata_cache(metadata_cache_file)
+
+
+def cached_metadata(filename, key, compute):
+    """
+    Returns the metadata KEY of file FILENAME, as computed by COMPUTE(FILENAME), using
+    the cache of data files metadata if `use_metadata_cache` is True
+    """
+    if not use_metadata_cache:
+        return compute(filename)
+    return metadata.get(filename, key, compute)
+
+
+def forget_metadata(filenames=None, directory=None):
+    """
+    Forget the cached metadata of FILENAMES (a path or a list of paths), or of all files
+    under DIRECTORY, or of all files if both are None
+    """
+    metadata.forget(filenames, directory)
+
+
+def prune_metadata(force=True):
+    """
+    Delete the cached metadata of files which no longer exist or have changed, and cap
+    the number of entries to `metadata_cache_max_entries`. This stats all cached files.
+
+    If FORCE is False, pruning is done only if the last one is older than
+    `metadata_cache_prune_period` seconds
+    """
+    return metadata.prune(force)
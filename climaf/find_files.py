@@ -16,7 +16,6 @@ import os
 import six
 import os.path
 import re
-import glob
 from string import Template
 import ftplib as ftp
 import getpass
@@ -30,6 +29,7 @@ import env
 from climaf.utils import Climaf_Error, Climaf_Classes_Error, cartesian_product_substitute
 from climaf.period import init_period, sort_periods_list, cperiod, build_date_regexp_pattern
 from climaf.netcdfbasics import fileHasVar, timeLimits
+from climaf.path_index import index_glob
 from climaf.projects.intake_search import intake_find
 
 #: Regular expression for matching periods and catching their components
@@ -129,6 +129,8 @@ def selectGenericFiles(urls, kwargs, return_combinations=None, use_frequency=Fal
 
     """
     rep = list()
+    # The set of files in rep, for quick membership tests
+    selected = set()
     #
     period = kwargs['period']
     if period != '*' and isinstance(period, six.string_types):
@@ -209,7 +211,7 @@ def selectGenericFiles(urls, kwargs, return_combinations=None, use_frequency=Fal
                 #
 
                 for f in lfiles:
-                    if f in rep:
+                    if remote_prefix + f in selected:
                         continue
                     if check_for_variable(f, url, variable, altvar):
                         # Extract facet values from filename
@@ -221,6 +223,7 @@ def selectGenericFiles(urls, kwargs, return_combinations=None, use_frequency=Fal
                                                       kwargs, wildcards, merge_periods_on,
                                                       return_combinations, periods, periods_dict):
                                 rep.append(remote_prefix + f)
+                                selected.add(remote_prefix + f)
                             # else:
                             #    clogger.info("Not appending for" +repr(values))
                         # else:
@@ -462,13 +465,13 @@ def my_glob(template, url, project):
                       (len(lfiles), remote_prefix + pattern))
     else:  # local data
         if project != 'CMIP6' or not env.environment.optimize_cmip6_wildcards:
-            lfiles = sorted(glob.glob(pattern))
+            lfiles = sorted(index_glob(pattern))
         else:
             # If using cmip6_optimize_wildcards_by_subsets , should
             # rather use a globbing which tests that leaf directory
             # exists before globing
             # lfiles = sorted(leaf_glob(pattern))
-            lfiles = sorted(glob.glob(pattern))
+            lfiles = sorted(index_glob(pattern))
         clogger.debug("Before regexp filtering : Globbing %d files for varname on %s : " % (
             len(lfiles), pattern))
 
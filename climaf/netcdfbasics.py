@@ -8,15 +8,24 @@ import re
 import warnings
 import xarray as xr
 import six
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
 from datetime import timedelta
 
 from climaf.utils import Climaf_Error
 from env.environment import *
 from env.clogging import clogger, dedent
 from climaf.period import cperiod, freq_to_minutes, init_period, build_date_regexp_pattern
+from climaf.file_metadata import cached_metadata
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+#: Should headers of NetCDF files be read using netCDF4 (which is much quicker than
+#  opening them with xarray) when possible
+use_netcdf4_headers = True
+
 
 def varOfFile(filename):
     lvars = varsOfFile(filename)
@@ -36,37 +45,96 @@ def varOfFile(filename):
         return lvars[0]
 
 
+def _jsonable(value):
+    # Turn numpy scalars and arrays, as found in attributes, into plain python values
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value
+
+
+#: Attributes which xarray moves to variables encoding, and which are thus not reported as attributes
+encoding_attributes = ["_FillValue", "missing_value", "scale_factor", "add_offset", "_Unsigned", "coordinates"]
+
+
+def headerOfFile(filename):
+    """
+    Returns a description of the header of NetCDF file FILENAME, as a dict with keys :
+
+     - 'variables' : the list of all variables names (including coordinates)
+     - 'dims' : a dict of dimensions sizes
+     - 'attrs' : a dict of global attributes
+     - 'var_attrs' : a dict of the dicts of attributes of each variable
+
+    The header is read only once per file (see :py:mod:`~climaf.file_metadata`)
+    """
+    return cached_metadata(filename, "header", _read_header)
+
+
+def _read_header(filename):
+    # Read the header with netCDF4, which does not read data nor build indexes; use
+    # xarray for files netCDF4 cannot handle
+    if netCDF4 is not None and use_netcdf4_headers:
+        try:
+            with netCDF4.Dataset(filename) as nc:
+                var_attrs = dict()
+                for var in nc.variables:
+                    ncvar = nc.variables[var]
+                    var_attrs[str(var)] = dict([(str(att), _jsonable(ncvar.getncattr(att)))
+                                                for att in ncvar.ncattrs() if att not in encoding_attributes])
+                return dict(variables=[str(var) for var in nc.variables],
+                            dims=dict([(str(dim), len(nc.dimensions[dim])) for dim in nc.dimensions]),
+                            attrs=dict([(str(att), _jsonable(nc.getncattr(att))) for att in nc.ncattrs()]),
+                            var_attrs=var_attrs)
+        except (IOError, OSError, RuntimeError) as e:
+            clogger.debug("Cannot read header of %s with netCDF4 (%s), using xarray" % (filename, str(e)))
+    return _read_header_with_xarray(filename)
+
+
+def _read_header_with_xarray(filename):
+    with xr.open_dataset(filename, decode_times=False) as ds:
+        var_attrs = dict()
+        for var in ds.variables:
+            var_attrs[str(var)] = dict([(str(att), _jsonable(value)) for att, value in ds[var].attrs.items()])
+        return dict(variables=[str(var) for var in ds.variables],
+                    dims=dict([(str(dim), int(size)) for dim, size in ds.sizes.items()]),
+                    attrs=dict([(str(att), _jsonable(value)) for att, value in ds.attrs.items()]),
+                    var_attrs=var_attrs)
+
+
 def varsOfFile(filename, all=False):
     """
     Returns the list of variable names in NetCDF file FILENAME. If ALL is False
     only variable which are not dimensions nor scalar coordinates are returned
     """
-    lvars = list()
-    with xr.open_dataset(filename, decode_times=False) as ds:
-        lvars = set(list(ds.variables.keys()))
-        if all is False:
-            # remove dimensions
-            lvars = lvars - set(list(ds.dims))
-            # Remove scalar coordinates
-            lvars = [elt for elt in lvars if not (
-                hasattr(ds[elt], "axis") or hasattr(ds[elt], "bounds"))]
-            # Remove variables which are related to dimensions (e.g. dim bounds....)
-            lvars = [elt for elt in lvars
-                     if not re.findall("(^lat|^lon|^LAT|^LON|nav_lat*|nav_lon*|^time|crs|_bnds$)", elt)]
-        else:
-            lvars = lvars + set(list(ds.dim))
+    header = headerOfFile(filename)
+    lvars = set(header["variables"])
+    if all is False:
+        # remove dimensions
+        lvars = lvars - set(header["dims"])
+        # Remove scalar coordinates
+        lvars = [elt for elt in lvars if not (
+            "axis" in header["var_attrs"][elt] or "bounds" in header["var_attrs"][elt])]
+        # Remove variables which are related to dimensions (e.g. dim bounds....)
+        lvars = [elt for elt in lvars
+                 if not re.findall("(^lat|^lon|^LAT|^LON|nav_lat*|nav_lon*|^time|crs|_bnds$)", elt)]
+    else:
+        lvars = lvars | set(header["dims"])
     return sorted(list(lvars))
 
 
+def variablesOfFile(filename):
+    """
+    Returns the list of all variables names (including coordinates) in FILENAME
+    """
+    return headerOfFile(filename)["variables"]
+
+
 def fileHasVar(filename, varname):
     """
     returns True if FILENAME has variable VARNAME
     """
-    rep = False
-    clogger.debug("opening " + filename +
-                  " for checkin if has variable " + varname)
-    with xr.open_dataset(filename, decode_times=False) as ds:
-        return varname in ds
+    clogger.debug("checking if " + filename + " has variable " + varname)
+    return varname in variablesOfFile(filename)
 
 
 def fileHasDim(filename, dimname):
@@ -78,11 +146,9 @@ def fileHasDim(filename, dimname):
 
 def dimsOfFile(filename):
     """
-    returns the list of dimensions of the netcdf file filename
+    returns the dimensions of the netcdf file filename, as a dict of their sizes
     """
-    clogger.debug("opening " + filename + " for checking the dimensions")
-    with xr.open_dataset(filename, decode_times=False) as ds:
-        return ds.dims
+    return headerOfFile(filename)["dims"]
 
 
 def model_id(filename):
@@ -116,6 +182,24 @@ def timeLimits(filename_or_timedim, use_frequency=False, strict_on_time_dim_name
          months are averaged and adjust to month start/end )
 
     """
+    if isinstance(filename_or_timedim, six.string_types):
+        key = "timeLimits(%s,%s,%s,%s)" % (use_frequency, strict_on_time_dim_name, cell_methods, time_average)
+
+        def compute(filename):
+            period = _timeLimits(filename, use_frequency, strict_on_time_dim_name, cell_methods, time_average)
+            if period is None:
+                return None
+            return [period.start.isoformat(), period.end.isoformat()]
+
+        limits = cached_metadata(filename_or_timedim, key, compute)
+        if limits is None:
+            return None
+        return cperiod(datetime.datetime.fromisoformat(limits[0]), datetime.datetime.fromisoformat(limits[1]))
+    return _timeLimits(filename_or_timedim, use_frequency, strict_on_time_dim_name, cell_methods, time_average)
+
+
+def _timeLimits(filename_or_timedim, use_frequency=False, strict_on_time_dim_name=True,
+                cell_methods=None, time_average=None):
     tdim = None
     if isinstance(filename_or_timedim, six.string_types):
         with xr.open_dataset(filename_or_timedim, use_cftime=True) as ds:
@@ -237,20 +321,18 @@ def isVerticalLevel(varname):
 
 
 def verticalLevelName(filename):
-    with xr.open_dataset(filename, decode_times=False) as ds:
-        varname = [var for var in ds.variables if isVerticalLevel(var)]
-        if len(varname) > 0:
-            return varname[0]
-        else:
-            raise Climaf_Error(
-                "No vertical level dimension identified in %s" % filename)
+    varname = [var for var in variablesOfFile(filename) if isVerticalLevel(var)]
+    if len(varname) > 0:
+        return varname[0]
+    else:
+        raise Climaf_Error(
+            "No vertical level dimension identified in %s" % filename)
 
 
 def verticalLevelUnits(filename):
     lev = verticalLevelName(filename)
     if lev:
-        with xr.open_dataset(filename, decode_times=False) as ds:
-            return ds[lev].units
+        return attrsOfFile(filename, lev)["units"]
 
 
 def verticalLevelValues(filename):
@@ -260,14 +342,24 @@ def verticalLevelValues(filename):
             return list(ds[lev].values)
 
 
+def attrsOfFile(filename, variable=None):
+    """
+    Returns the dict of global attributes of FILENAME, or of the attributes of
+    VARIABLE if it is not None
+    """
+    header = headerOfFile(filename)
+    if variable is None:
+        return header["attrs"]
+    else:
+        return header["var_attrs"][variable]
+
+
 def attrOfFile(filename, attribute, default=None):
-    with xr.open_dataset(filename, decode_times=False) as ds:
-        return getattr(ds, attribute, default)
+    return attrsOfFile(filename).get(attribute, default)
 
 
 def attrOfDataset(filename, variable, attribute, default=None):
-    with xr.open_dataset(filename, decode_times=False) as ds:
-        return getattr(ds[variable], attribute, default)
+    return attrsOfFile(filename, variable).get(attribute, default)
 
 
 def infer_freq(times, monthly):
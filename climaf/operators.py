@@ -413,10 +413,56 @@ def fixed_fields(operator, *paths):
 
 
 class coperator(object):
-    def __init__(self, op, command, canOpendap=False, canSelectVar=False,
-                 canSelectTime=False, canSelectDomain=False, canAggregateTime=False,
-                 canAlias=False, canMissing=False, commuteWithEnsemble=False):
-        clogger.error("Not yet developped")
+    def __init__(self, name, function, materialize=False, commuteWithEnsemble=True,
+                 commuteWithTimeConcatenation=False, commuteWithSpaceConcatenation=False, output_var="%s"):
+        """
+        Declare a Python function as an in-process 'CliMAF operator', and define a Python
+        function with the same name (see :py:mod:`~climaf.xarray_operators`)
+
+        Args:
+          name (str): name for the CliMAF operator.
+          function : the Python function, which is called with one xarray DataArray per
+            operand, and with the parameters of the operator call as keyword arguments, and
+            which must return a DataArray; it should preferably not compute data (but
+            only build lazy operations on its inputs)
+          materialize (bool, optional): should results be written in the cache even when
+            used by another in-process operator (by default, they are only when needed as files)
+          commuteWithEnsemble, commuteWithTimeConcatenation, commuteWithSpaceConcatenation
+            (bool, optional): see :py:class:`cscript`
+          output_var (str, optional): a format string for computing the variable name of
+            results from the variable name of first operand; defaults to '%s'
+
+        Returns:
+          None
+
+        Example::
+
+        >>> coperator('anomaly', lambda a: a - a.mean('time'))
+        >>> tas_anomaly = anomaly(tas_ds)
+
+        """
+        if not callable(function):
+            raise Climaf_Operator_Error("When defining %s : %s is not callable" % (name, repr(function)))
+        self.name = name
+        self.function = function
+        self.materialize = materialize
+        self.command = None
+        self.fixedfields = None
+        self.outputFormat = "nc"
+        self.outputs = {None: output_var, '': output_var}
+        self.flags = scriptFlags(commuteWithEnsemble=commuteWithEnsemble,
+                                 commuteWithTimeConcatenation=commuteWithTimeConcatenation,
+                                 commuteWithSpaceConcatenation=commuteWithSpaceConcatenation)
+        operators[name] = self
+        doc = function.__doc__ or "CliMAF in-process operator : %s" % getattr(function, "__name__", name)
+        defs = 'def %s(*args,**dic) :\n  """%s"""\n  return capply("%s",*args,**dic)\n' \
+               % (name, doc, name)
+        exec(defs, globals())
+        exec("from climaf.operators import %s" % name, sys.modules['__main__'].__dict__)
+        clogger.debug("CliMAF operator %s has been declared" % name)
+
+    def __repr__(self):
+        return "CliMAF in-process operator : " + self.name
 
 
 if __name__ == "__main__":
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A persistent index of directory listings, used for answering glob patterns on data
+archives (see :py:func:`~climaf.find_files.my_glob`) without listing directories again
+and again on the file system
+
+The listing of each directory visited when globbing is stored in a SQLite database (in
+WAL mode, so that it can be shared by concurrent CliMAF sessions), together with the
+directory modification time. A listing is re-used as is during `path_index_ttl` seconds
+after it has been checked; beyond that delay, the directory modification time is checked
+again (which costs a single stat), and the directory is listed again only if it changed.
+
+Directories involved in a glob pattern are listed level by level, concurrently.
+
+The index is not used by default (see `use_path_index`). Its database lives in
+`path_index_file`, which defaults to ``~/.climaf.path_index.sqlite`` and can be set by
+environment variable CLIMAF_PATH_INDEX. Listings made more than `path_index_max_age`
+seconds ago are deleted when a session first opens the database, so that it does not
+keep growing with directories which are no longer visited.
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import re
+import glob
+import json
+import time
+import fnmatch
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from env.clogging import clogger
+
+#: Should glob patterns on local data be answered using the index of directory listings
+use_path_index = False
+#: The SQLite file for the persistent index of directory listings
+path_index_file = os.getenv("CLIMAF_PATH_INDEX", "~/.climaf.path_index.sqlite")
+#: Delay (in seconds) during which a directory listing is used without checking the directory modification time
+path_index_ttl = 0
+#: Age (in seconds) beyond which directory listings are deleted from the persistent index
+#  when it is opened; None disables pruning
+path_index_max_age = 30 * 86400.
+#: Number of threads used for listing directories
+path_index_workers = 8
+
+_schema = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    scanned REAL,
+    entries TEXT
+);
+CREATE INDEX IF NOT EXISTS dirs_scanned ON dirs (scanned);
+"""
+
+_magic = re.compile(r"[*?[]")
+
+
+def has_magic(string):
+    return _magic.search(string) is not None
+
+
+class path_index(object):
+    """
+    An index of directory listings stored in SQLite database FILENAME. For each directory,
+    the listing is a dict which keys are entries names and values are True for sub-directories
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self.lock = threading.RLock()
+        # Directory path -> (time of last check, mtime, time of listing, listing)
+        self.memory = dict()
+        self.connection = None
+
+    def _connect(self):
+        # Open the database lazily, and go on without it if it cannot be opened
+        if self.connection is None:
+            try:
+                dirname = os.path.dirname(self.filename)
+                if dirname and not os.path.isdir(dirname):
+                    os.makedirs(dirname, exist_ok=True)
+                self.connection = sqlite3.connect(self.filename, timeout=60., isolation_level=None,
+                                                  check_same_thread=False)
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.execute("PRAGMA synchronous=NORMAL")
+                self.connection.executescript(_schema)
+            except sqlite3.Error as e:
+                clogger.warning("Cannot use path index %s : %s" % (self.filename, str(e)))
+                self.connection = False
+            else:
+                self.prune()
+        return self.connection
+
+    def prune(self):
+        """
+        Delete the listings made more than `path_index_max_age` seconds ago. Returns the
+        number of deleted listings
+        """
+        with self.lock:
+            if path_index_max_age is None or not self.connection:
+                return 0
+            try:
+                return self.connection.execute("DELETE FROM dirs WHERE scanned < ?",
+                                               (time.time() - path_index_max_age, )).rowcount
+            except sqlite3.Error as e:
+                clogger.debug("Cannot prune path index : %s" % str(e))
+                return 0
+
+    def close(self):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+            self.connection = None
+            self.memory.clear()
+
+    def _stored(self, path):
+        with self.lock:
+            connection = self._connect()
+            if not connection:
+                return None
+            rows = connection.execute("SELECT mtime, scanned, entries FROM dirs WHERE path=?", (path, )).fetchall()
+        if len(rows) == 0:
+            return None
+        mtime, scanned, entries = rows[0]
+        return mtime, scanned, json.loads(entries)
+
+    def _store(self, path, mtime, scanned, listing):
+        with self.lock:
+            connection = self._connect()
+            if connection:
+                try:
+                    connection.execute("INSERT OR REPLACE INTO dirs VALUES (?,?,?,?)",
+                                       (path, mtime, scanned, json.dumps(listing)))
+                except sqlite3.Error as e:
+                    clogger.debug("Cannot write in path index : %s" % str(e))
+
+    def listdir(self, path):
+        """
+        Returns the listing of directory PATH (see class doc), or None if it is not
+        a directory
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(path)
+        if entry is not None and now - entry[0] <= path_index_ttl:
+            return entry[3]
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            with self.lock:
+                self.memory.pop(path, None)
+            return None
+        if entry is None:
+            entry = self._stored(path)
+            if entry is not None:
+                entry = (now, ) + entry
+        # A listing is valid if the directory did not change since it was made (a
+        # listing made in the same second as a modification may be incomplete)
+        if entry is None or entry[1] != mtime or entry[2] <= mtime + 1:
+            try:
+                listing = dict()
+                for dir_entry in os.scandir(path):
+                    try:
+                        listing[dir_entry.name] = dir_entry.is_dir()
+                    except OSError:
+                        listing[dir_entry.name] = False
+            except OSError:
+                return None
+            self._store(path, mtime, now, listing)
+            entry = (now, mtime, now, listing)
+        else:
+            entry = (now, ) + entry[1:]
+        with self.lock:
+            self.memory[path] = entry
+        return entry[3]
+
+    def glob(self, pattern):
+        """
+        Returns the list of paths matching glob PATTERN (which must be an absolute path),
+        as glob.glob would do, but using the index of directory listings
+        """
+        parts = pattern.split(os.sep)
+        # The longest leading part without wildcards is not listed
+        first = 1
+        while first < len(parts) and not has_magic(parts[first]):
+            first += 1
+        if first == len(parts):
+            return [pattern] if os.path.lexists(pattern) else []
+        base = os.sep.join(parts[0:first]) or os.sep
+        candidates = [base]
+        with ThreadPoolExecutor(max_workers=path_index_workers) as executor:
+            for level, part in enumerate(parts[first:]):
+                last = (first + level == len(parts) - 1)
+                if part == "":
+                    # A trailing '/' only keeps directories, which is already the case
+                    if last:
+                        candidates = [candidate + os.sep for candidate in candidates]
+                    continue
+                listings = executor.map(self.listdir, candidates)
+                new_candidates = list()
+                for directory, listing in zip(candidates, listings):
+                    if listing is None:
+                        continue
+                    if has_magic(part):
+                        names = [name for name in listing if fnmatch.fnmatchcase(name, part) and
+                                 (part.startswith(".") or not name.startswith("."))]
+                    elif part in listing:
+                        names = [part]
+                    elif part in [".", ".."]:
+                        listing = {part: True}
+                        names = [part]
+                    else:
+                        names = []
+                    new_candidates.extend([os.path.join(directory, name) for name in names
+                                           if last or listing[name]])
+                candidates = new_candidates
+                if len(candidates) == 0:
+                    break
+        return candidates
+
+
+index = path_index(path_index_file)
+
+
+def index_glob(pattern):
+    """
+    Returns the list of paths matching glob PATTERN, using the index of directory listings
+    if `use_path_index` is True and PATTERN is an absolute path, and glob.glob otherwise
+    """
+    if use_path_index and os.path.isabs(pattern):
+        return index.glob(pattern)
+    return glob.glob(pattern)
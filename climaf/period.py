@@ -9,15 +9,37 @@
 from __future__ import print_function, division, unicode_literals, absolute_import
 
 import re
+import sys
 import datetime
 import six
 import copy
+import numpy as np
 
 from climaf.utils import Climaf_Error
 from env.clogging import clogger, dedent
 from env.environment import *
 
 
+#: Origin of the integer-minute representation of periods bounds
+period_origin = datetime.datetime(1, 1, 1)
+
+
+def date_to_minutes(date):
+    """
+    Returns the number of minutes between `period_origin` and datetime DATE, rounded
+    to the nearest minute (CliMAF handles date-time values with a 1 minute accuracy)
+    """
+    delta = date - period_origin
+    return delta.days * 1440 + (delta.seconds * 1000000 + delta.microseconds + 30000000) // 60000000
+
+
+def minutes_to_date(minutes):
+    """
+    Returns the datetime which is MINUTES minutes after `period_origin`
+    """
+    return period_origin + datetime.timedelta(minutes=minutes)
+
+
 class cperiod(object):
     """
     A class for handling a pair of datetime objects defining a period.
@@ -25,10 +47,17 @@ class cperiod(object):
     Period is defined as [ date1, date2 ]. Resolution for date2 is 1 minute
     Attribute 'pattern' usually provides a more condensed form
 
+    For the sake of memory footprint, dates are stored as integer numbers of
+    minutes (see :py:func:`date_to_minutes`), and attributes 'start' and 'end'
+    are computed on the fly
+
     """
+    __slots__ = ("fx", "pattern", "_start", "_end")
 
     def __init__(self, start, end=None, pattern=None):
         self.fx = False
+        self._start = None
+        self._end = None
         if isinstance(start, six.string_types) and start == 'fx':
             self.fx = True
             self.pattern = 'fx'
@@ -45,57 +74,65 @@ class cperiod(object):
             if start > end:
                 raise Climaf_Period_Error("Period's start (%s) must be before period's end (%s)" %
                                           (repr(start), repr(end)))
-            self.start = start
-            self.end = end
+            self._start = date_to_minutes(start)
+            self._end = date_to_minutes(end)
             if pattern is None:
-                self.pattern = self.__repr__()
-            else:
-                self.pattern = pattern
+                pattern = self.__repr__()
+            self.pattern = sys.intern(pattern) if type(pattern) is str else pattern
+
+    @classmethod
+    def from_minutes(cls, start, end):
+        """
+        Returns the period for integer-minute bounds START and END (see :py:func:`date_to_minutes`)
+        """
+        rep = cls.__new__(cls)
+        rep.fx = False
+        rep._start = start
+        rep._end = end
+        rep.pattern = sys.intern(rep.pr())
+        return rep
+
+    # Periods 'fx' have no start nor end
+    @property
+    def start(self):
+        if self._start is None:
+            raise AttributeError("Period 'fx' has no attribute 'start'")
+        return minutes_to_date(self._start)
+
+    @start.setter
+    def start(self, value):
+        self._start = date_to_minutes(value)
+
+    @property
+    def end(self):
+        if self._end is None:
+            raise AttributeError("Period 'fx' has no attribute 'end'")
+        return minutes_to_date(self._end)
+
+    @end.setter
+    def end(self, value):
+        self._end = date_to_minutes(value)
 
     #
     def __eq__(self, other):
-        test = not other == "*" and isinstance(other, cperiod)
-        if test and self.fx != other.fx:
-            test = False
-        if test and self.pattern != other.pattern:
-            test = False
-        start_self = getattr(self, "start", None)
-        start_other = getattr(other, "start", None)
-        if test and start_self != start_other:
-            test = False
-        end_self = getattr(self, "end", None)
-        end_other = getattr(other, "end", None)
-        if test and end_self != end_other:
-            test = False
-        return test
+        return isinstance(other, cperiod) and self.fx == other.fx and self.pattern == other.pattern and \
+            self._start == other._start and self._end == other._end
 
     def __le__(self, other):
-        if self.start != other.start:
-            return self.start <= other.start
-        else:
-            return self.end <= other.end
+        return (self._start, self._end) <= (other._start, other._end)
 
     def __lt__(self, other):
-        if self.start != other.start:
-            return self.start < other.start
-        else:
-            return self.end < other.end
+        return (self._start, self._end) < (other._start, other._end)
 
     def __ge__(self, other):
-        if self.start != other.start:
-            return self.start >= other.start
-        else:
-            return self.end >= other.end
+        return (self._start, self._end) >= (other._start, other._end)
 
     def __gt__(self, other):
-        if self.start != other.start:
-            return self.start > other.start
-        else:
-            return self.end > other.end
+        return (self._start, self._end) > (other._start, other._end)
 
     #
     def __hash__(self):
-        return hash((self.fx, self.pattern, getattr(self, "start", None), getattr(self, "end", None)))
+        return hash((self.fx, self.pattern, self._start, self._end))
 
     #
     def __repr__(self):
@@ -119,45 +156,47 @@ class cperiod(object):
     def pr(self):
         if self.fx:
             return 'fx'
-        if self.start.minute != 0 or self.start.minute != 0:
-            return ("%04d%02d%02d%02d%02d-%04d%02d%02d%02d%02d" % (self.start.year, self.start.month, self.start.day,
-                                                                   self.start.hour, self.start.minute, self.end.year,
-                                                                   self.end.month, self.end.day, self.end.hour,
-                                                                   self.end.minute))
-        elif self.start.hour != 0 or self.end.hour != 0:
-            return ("%04d%02d%02d%02d-%04d%02d%02d%02d" % (self.start.year, self.start.month, self.start.day,
-                                                           self.start.hour, self.end.year, self.end.month, self.end.day,
-                                                           self.end.hour))
-        elif self.start.day != 1 or self.end.day != 1:
-            if self.end.day != 1:
-                d = self.end.day - 1
-                m = self.end.month
-                y = self.end.year
-            else:
-                end = self.end - datetime.timedelta(1)
-                y = end.year
+        # Bounds are computed once, see properties start and end
+        start, end = self.start, self.end
+        if start.minute != 0 or start.minute != 0:
+            return ("%04d%02d%02d%02d%02d-%04d%02d%02d%02d%02d" % (start.year, start.month, start.day,
+                                                                   start.hour, start.minute, end.year,
+                                                                   end.month, end.day, end.hour,
+                                                                   end.minute))
+        elif start.hour != 0 or end.hour != 0:
+            return ("%04d%02d%02d%02d-%04d%02d%02d%02d" % (start.year, start.month, start.day,
+                                                           start.hour, end.year, end.month, end.day,
+                                                           end.hour))
+        elif start.day != 1 or end.day != 1:
+            if end.day != 1:
+                d = end.day - 1
                 m = end.month
-                d = end.day
-            if (self.start.year, self.start.month, self.start.day) == (y, m, d):
+                y = end.year
+            else:
+                last = end - datetime.timedelta(1)
+                y = last.year
+                m = last.month
+                d = last.day
+            if (start.year, start.month, start.day) == (y, m, d):
                 return "%04d%02d%02d" % (y, m, d)
             else:
-                return "%04d%02d%02d-%04d%02d%02d" % (self.start.year, self.start.month, self.start.day, y, m, d)
-        elif self.start.month != 1 or self.end.month != 1:
-            if self.end.month != 1:
-                m = self.end.month - 1
-                y = self.end.year
+                return "%04d%02d%02d-%04d%02d%02d" % (start.year, start.month, start.day, y, m, d)
+        elif start.month != 1 or end.month != 1:
+            if end.month != 1:
+                m = end.month - 1
+                y = end.year
             else:
                 m = 12
-                y = self.end.year - 1
-            if self.start.year == y and self.start.month == m:
-                return "%04d%02d" % (self.start.year, self.start.month)
+                y = end.year - 1
+            if start.year == y and start.month == m:
+                return "%04d%02d" % (start.year, start.month)
             else:
-                return "%04d%02d-%04d%02d" % (self.start.year, self.start.month, y, m)
+                return "%04d%02d-%04d%02d" % (start.year, start.month, y, m)
         else:
-            if self.start.year != self.end.year - 1:
-                return "%04d-%04d" % (self.start.year, self.end.year - 1)
+            if start.year != end.year - 1:
+                return "%04d-%04d" % (start.year, end.year - 1)
             else:
-                return "%04d" % self.start.year
+                return "%04d" % start.year
 
     #
     def hasFullYear(self, year):
@@ -341,44 +380,161 @@ def init_period(dates):
                     "Could not create a period with string %s" % dates)
 
 
-def sort_periods_list(periods_list):
-    #
-    class SortTree(object):
-        def __init__(self, el):
-            self.pivot = el
-            self.smaller = None
-            self.larger = None
+#: Origin of integer-minute bounds, as a numpy datetime64
+period_origin64 = np.datetime64("0001-01-01T00:00", "m")
 
-    #
-    def insert(el, tree=None):
+
+def merge_bounds(starts, ends, handle_360_days_year=True):
+    """
+    Given arrays STARTS and ENDS of integer-minute bounds (see :py:func:`date_to_minutes`),
+    returns the permutation which sorts them by start and end, and the indices (in sorted
+    order) of the first period of each group of overlapping or consecutive periods
+
+    If HANDLE_360_DAYS_YEAR is True, periods which miss only a 31st december are also
+    considered as consecutive
+    """
+    order = np.lexsort((ends, starts))
+    starts = starts[order]
+    ends = ends[order]
+    if len(starts) == 0:
+        return order, np.zeros(0, dtype=np.int64)
+    # A period joins the previous group if it begins before the end of any preceding period
+    previous_ends = np.maximum.accumulate(ends)[:-1]
+    joined = starts[1:] <= previous_ends
+    if handle_360_days_year:
+        next_days = (period_origin64 + previous_ends).astype("datetime64[D]") + np.timedelta64(1, "D")
+        start_days = (period_origin64 + starts[1:]).astype("datetime64[D]")
+        next_years = next_days.astype("datetime64[Y]")
+        joined |= (next_days == next_years) & (start_days == next_years)
+    return order, np.concatenate(([0], np.nonzero(~joined)[0] + 1))
+
+
+class period_set(object):
+    """
+    A set of periods, held as sorted numpy arrays of integer-minute bounds (see
+    :py:func:`date_to_minutes`) of disjoint and non-consecutive periods
+
+    It is built from an iterable of (non 'fx') cperiod objects, which are merged;
+    if HANDLE_360_DAYS_YEAR is True (the default), periods which miss only a 31st
+    december (such as with 360-days calendars) are merged too. Building and set
+    operations cost O(n log n)
+
+    >>> periods = period_set([init_period("1980-1989"), init_period("1995"), init_period("1990-1992")])
+    >>> periods.periods()
+    [1980-1992, 1995]
+    >>> periods.includes(init_period("1985-1990")), periods.gaps()
+    (True, [1993-1994])
+
+    """
+    __slots__ = ("starts", "ends", "members")
+
+    def __init__(self, periods=(), handle_360_days_year=True):
+        periods = list(periods)
+        for period in periods:
+            if not isinstance(period, cperiod) or period._start is None:
+                raise Climaf_Period_Error("A period_set can only gather non-fx cperiod objects, not %s" %
+                                          repr(period))
+        starts = np.fromiter((p._start for p in periods), dtype=np.int64, count=len(periods))
+        ends = np.fromiter((p._end for p in periods), dtype=np.int64, count=len(periods))
+        self.set_bounds(starts, ends, handle_360_days_year, periods)
+
+    @classmethod
+    def from_bounds(cls, starts, ends, handle_360_days_year=True):
         """
+        Returns the period_set for arrays STARTS and ENDS of integer-minute bounds
         """
-        if tree is None:
-            return SortTree(el)
-        if repr(tree.pivot) == repr(el):
-            return tree  # Discard identical periods
-        if el.is_before(tree.pivot):
-            tree.smaller = insert(el, tree.smaller)
-        else:
-            tree.larger = insert(el, tree.larger)
-        return tree
+        rep = cls.__new__(cls)
+        rep.set_bounds(np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64), handle_360_days_year)
+        return rep
 
-    #
-    def walk(tree):
-        if tree is None:
-            return []
-        rep = walk(tree.smaller)
-        rep.append(tree.pivot)
-        rep.extend(walk(tree.larger))
+    def set_bounds(self, starts, ends, handle_360_days_year=True, periods=None):
+        order, firsts = merge_bounds(starts, ends, handle_360_days_year)
+        ends = ends[order]
+        self.starts = starts[order][firsts]
+        self.ends = np.maximum.reduceat(ends, firsts) if len(ends) > 0 else ends
+        # A merged period which is one of the provided periods is returned as such
+        # by method periods(); this preserves its pattern
+        self.members = None
+        if periods:
+            self.members = [periods[order[first]] if end == ends[first] else None
+                            for first, end in zip(firsts, self.ends)]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(self.periods())
+
+    def __eq__(self, other):
+        return isinstance(other, period_set) and np.array_equal(self.starts, other.starts) and \
+            np.array_equal(self.ends, other.ends)
+
+    def __repr__(self):
+        return repr(self.periods())
+
+    def periods(self):
+        """ Returns the list of (merged) cperiod objects of the set """
+        rep = list()
+        for i, (start, end) in enumerate(zip(self.starts.tolist(), self.ends.tolist())):
+            if self.members is not None and self.members[i] is not None:
+                rep.append(self.members[i])
+            else:
+                rep.append(cperiod.from_minutes(start, end))
         return rep
 
-    #
+    def includes(self, period):
+        """ True if cperiod PERIOD is entirely included in one of the periods of the set """
+        if not isinstance(period, cperiod) or period._start is None:
+            return False
+        i = np.searchsorted(self.starts, period._start, side="right") - 1
+        return bool(i >= 0 and self.ends[i] >= period._end)
+
+    def intersection(self, other):
+        """
+        Returns the period_set of the intersections of the periods of SELF and OTHER
+        (another period_set)
+        """
+        # For each period of self, the range of the periods of other which overlap it
+        lows = np.searchsorted(other.ends, self.starts, side="right")
+        highs = np.searchsorted(other.starts, self.ends, side="left")
+        counts = np.maximum(highs - lows, 0)
+        mine = np.repeat(np.arange(len(self)), counts)
+        theirs = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lows, counts)
+        starts = np.maximum(self.starts[mine], other.starts[theirs])
+        ends = np.minimum(self.ends[mine], other.ends[theirs])
+        kept = starts < ends
+        return period_set.from_bounds(starts[kept], ends[kept], handle_360_days_year=False)
+
+    def union(self, other):
+        """ Returns the period_set of the periods of SELF and OTHER (another period_set) """
+        return period_set.from_bounds(np.concatenate((self.starts, other.starts)),
+                                      np.concatenate((self.ends, other.ends)), handle_360_days_year=False)
+
+    def gaps(self, period=None):
+        """
+        Returns the period_set of the gaps between the periods of the set; if cperiod
+        PERIOD is provided, the gaps are those of the set within PERIOD (including
+        at its edges)
+        """
+        starts = self.ends[:-1]
+        ends = self.starts[1:]
+        if period is not None:
+            starts = np.maximum(np.concatenate(([period._start], self.ends)), period._start)
+            ends = np.minimum(np.concatenate((self.starts, [period._end])), period._end)
+        kept = starts < ends
+        return period_set.from_bounds(starts[kept], ends[kept], handle_360_days_year=False)
+
+
+def sort_periods_list(periods_list):
+    """
+    Returns the list of cperiod objects PERIODS_LIST sorted by start and end, after
+    discarding identical periods; 'fx' periods come last
+    """
     if isinstance(periods_list, list) and all([isinstance(elt, cperiod) for elt in periods_list]):
-        clist = copy.copy(periods_list)
-        sorted_tree = SortTree(clist.pop())
-        while clist:
-            insert(clist.pop(), sorted_tree)
-        return walk(sorted_tree)
+        unique = dict()
+        for period in periods_list:
+            unique[(period.fx, period._start, period._end)] = period
+        return sorted(unique.values(), key=lambda p: (p._start is None, p._start or 0, p._end or 0))
     else:
         raise Climaf_Period_Error(
             "Can not deal with something else than a list of cperiod objects.")
@@ -389,69 +545,37 @@ def merge_periods(remain_to_merge, already_merged=list(), handle_360_days_year=T
     Provided with a list of periods (even un-sorted), returns a list of periods 
     where all consecutive periods have been merged.
 
-    Argument 'already_merged' is used only in the underlying recursion, and shouldn't 
+    Argument 'already_merged' is a list of periods to merge too, and shouldn't
     usually be provided
 
     Argument 'handle_360_days_year' allows to merge consecutive periods which miss 
     only a 31st december,such as in the case with 360-days calendars. It defaults to True
 
-    For dealing with very long list of periods, which do not allow for recursion, we
-    proceed with batches of N elements
+    The merge is done by a :py:class:`period_set`
     """
     if not (isinstance(remain_to_merge, list) and all([isinstance(elt, cperiod) for elt in remain_to_merge])):
         raise Climaf_Period_Error(
             "Can not deal with something else than a list of cperiod objects.")
-    else:
-        N = 300
-        if isinstance(already_merged, list) and len(already_merged) == 0:
-            if len(remain_to_merge) < 2:
-                return remain_to_merge
-            else:
-                sorted_remain = sorted(remain_to_merge)
-                if len(sorted_remain) <= N:
-                    return merge_periods(sorted_remain[1:], [sorted_remain[0]], handle_360_days_year)
-                else:
-                    # Avoid too much recursion
-                    first_batch = merge_periods(sorted_remain[0:N])
-                    return merge_periods(sorted_remain[N:], first_batch, handle_360_days_year)
-        else:
-            if len(remain_to_merge) > 0:
-                last = already_merged[-1]
-                next_one = remain_to_merge.pop(0)
-                # print "last.end=",last.end,"next.start=",next_one.start
-                # if (last.end == next_one.start) :
-                #    already_merged[-1]=cperiod(last.start,next_one.end)
-                if next_one.start <= last.end or (handle_360_days_year and last.end.month == 12 and
-                                                  last.end.day == 31 and
-                                                  next_one.start.month == 1 and
-                                                  next_one.start.day == 1 and
-                                                  next_one.start.year == last.end.year + 1):
-                    if next_one.end > last.end:
-                        # the next period is not entirely included in the
-                        # last merged one
-                        already_merged[-1] = cperiod(last.start, next_one.end)
-                else:
-                    # There is no overlap between both periods
-                    already_merged.append(next_one)
-            #
-            if len(remain_to_merge) > 0:
-                return merge_periods(remain_to_merge, already_merged, handle_360_days_year)
-            else:
-                return already_merged
+    periods = already_merged + remain_to_merge
+    if len(periods) < 2:
+        return periods
+    return period_set(periods, handle_360_days_year).periods()
 
 
 def intersect_periods_list(lperiod1, lperiod2):
     """
     Given two lists of periods, returns a list of the periods representing their intersection
 
-    Algorithm : for each period in l1, compute intersection with all periods in l2,
-    and add it in a big list; finally, merge  the big list
+    Algorithm : intersect the period_sets of both lists (where 360-days years are not
+    handled), and finally merge the result
     """
     if not (isinstance(lperiod1, list) and [isinstance(elt, cperiod) for elt in lperiod1] and
             isinstance(lperiod2, list) and [isinstance(elt, cperiod) for elt in lperiod2]):
         raise Climaf_Period_Error(
             "Can not deal with something else than list of cperiod objects")
-    else:
+    elif any([elt.fx for elt in lperiod1 + lperiod2]):
+        # For each period in l1, compute intersection with all periods in l2,
+        # and add it in a big list; finally, merge the big list
         big = []
         for p1 in lperiod1:
             for p2 in lperiod2:
@@ -459,6 +583,9 @@ def intersect_periods_list(lperiod1, lperiod2):
                 if inter:
                     big.append(inter)
         return merge_periods(big)
+    else:
+        inter = period_set(lperiod1, False).intersection(period_set(lperiod2, False))
+        return period_set.from_bounds(inter.starts, inter.ends).periods()
 
 
 def lastyears(period, nyears):
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A pool of warm Python workers, for running Python operator scripts (such as mcdo.py,
+plotmap.py or ensemble_time_series_plot.py) without paying for an interpreter start
+and for heavy imports (xarray, matplotlib, cartopy...) at each script call
+
+Each worker (see scripts/python_worker.py) is a long-lived Python process which
+imports `preloaded_modules` once, and then forks for running each script as __main__,
+with the command arguments, working directory and environment of the script call.
+Workers are started on first use, and talk with CliMAF through pipes.
+
+A command is run by a worker only if it is the plain call of a Python script
+(as ``mcdo.py --operator=... file1 file2`` or ``python3 /path/plotmap.py ...``),
+without any shell construct (pipes, redirections, variables, wildcards...), and
+if the interpreter which the shell would use (the one called, or the one of the
+script's shebang, as found in PATH) is the interpreter running CliMAF. In all other
+cases, and whenever the worker itself fails (but not when the script fails), the
+command is run in a shell as usual (see :py:func:`~climaf.driver.apply_script`).
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import json
+import queue
+import shlex
+import atexit
+import shutil
+import threading
+import subprocess
+
+from env.clogging import clogger
+
+#: Should Python operator scripts be run by warm Python workers
+use_python_workers = True
+#: Maximum number of warm Python workers (i.e. of Python scripts running concurrently in workers)
+python_workers_number = min(4, os.cpu_count() or 1)
+#: Modules imported by workers at start
+preloaded_modules = ["six", "numpy", "netCDF4", "cftime", "xarray", "matplotlib", "matplotlib.pyplot",
+                     "cartopy", "cartopy.crs", "geocat.viz", "cmaps"]
+#: Python scripts which are never run by workers (basenames)
+excluded_scripts = []
+
+worker_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "scripts", "python_worker.py")
+_python_interpreters = ["python", "python3", os.path.basename(sys.executable)]
+
+
+def needs_shell(command):
+    """
+    True if COMMAND uses shell constructs (other than quoting) : unquoted pipes,
+    redirections, separators, wildcards or home directory expansion, and variables or
+    command substitution outside single quotes
+    """
+    quote = None
+    previous = " "
+    for char in command:
+        if quote == "'":
+            if char == "'":
+                quote = None
+        elif char == "\\":
+            # An escaped character is left to the shell
+            return True
+        elif char in "$`":
+            return True
+        elif quote == '"':
+            if char == '"':
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char in "|&;<>()*?[{\n" or (char in "~#" and previous in " ="):
+            return True
+        previous = char
+    return quote is not None
+
+
+def is_python_script(filename):
+    """
+    True if FILENAME is a Python script, according to its suffix or to its first line
+    """
+    if filename.endswith(".py"):
+        return True
+    try:
+        with open(filename, "rb") as f:
+            first_line = f.readline(200)
+    except (IOError, OSError):
+        return False
+    return first_line.startswith(b"#!") and b"python" in first_line
+
+
+def is_climaf_interpreter(path):
+    """
+    True if PATH is the Python interpreter running CliMAF (sys.executable), in the same
+    environment
+    """
+    if not path:
+        return False
+    path = os.path.abspath(path)
+    executable = os.path.abspath(sys.executable)
+    if os.path.realpath(path) != os.path.realpath(executable):
+        return False
+    # In a virtual environment, the environment depends on the directory of the called path
+    return sys.prefix == sys.base_prefix or os.path.dirname(path) == os.path.dirname(executable)
+
+
+def script_interpreter(filename):
+    """
+    Returns the path of the interpreter of script FILENAME according to its shebang
+    (searched in PATH for '#!/usr/bin/env name'), or None if it has no shebang, or
+    if the shebang provides interpreter options
+    """
+    try:
+        with open(filename, "rb") as f:
+            first_line = f.readline(200)
+    except (IOError, OSError):
+        return None
+    if not first_line.startswith(b"#!"):
+        return None
+    words = first_line[2:].decode("utf-8", "replace").split()
+    if len(words) == 2 and os.path.basename(words[0]) == "env":
+        return shutil.which(words[1])
+    if len(words) == 1:
+        return words[0]
+    return None
+
+
+def python_call(command):
+    """
+    If COMMAND is the plain call of a Python script by the interpreter running CliMAF,
+    returns the argv list for the script (with the script full path as first item), and
+    None otherwise
+    """
+    if needs_shell(command):
+        return None
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return None
+    if len(args) == 0 or "=" in args[0]:
+        return None
+    if os.path.basename(args[0]) in _python_interpreters:
+        if not is_climaf_interpreter(shutil.which(args[0])):
+            return None
+        args = args[1:]
+        if len(args) == 0 or args[0].startswith("-"):
+            return None
+        script = args[0]
+        if not os.path.isfile(script):
+            return None
+    else:
+        script = shutil.which(args[0])
+        if script is None or not is_python_script(script) or \
+                not is_climaf_interpreter(script_interpreter(script)):
+            return None
+    if os.path.basename(script) in excluded_scripts:
+        return None
+    return [os.path.abspath(script)] + args[1:]
+
+
+class python_worker(object):
+    """
+    A warm Python worker process
+    """
+
+    def __init__(self):
+        self.process = subprocess.Popen([sys.executable, worker_script] + preloaded_modules,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, universal_newlines=True, close_fds=True)
+        self._answer()
+
+    def _answer(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise OSError("Python worker %d died" % self.process.pid)
+        return json.loads(line)
+
+    def run(self, argv, log):
+        """
+        Run the script call ARGV, appending its outputs to file LOG, and returns its return code
+        """
+        request = dict(argv=argv, cwd=os.getcwd(), env=dict(os.environ), log=log)
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        return self._answer()["returncode"]
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+
+
+class python_workers_pool(object):
+    """
+    A pool of at most `python_workers_number` warm Python workers, started on demand
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = queue.LifoQueue()
+        self.workers = list()
+
+    def _acquire(self):
+        while True:
+            with self.lock:
+                if self.idle.empty() and len(self.workers) < python_workers_number:
+                    worker = python_worker()
+                    self.workers.append(worker)
+                    return worker
+            worker = self.idle.get()
+            if worker.is_alive():
+                return worker
+            self._discard(worker)
+
+    def _discard(self, worker):
+        worker.stop()
+        with self.lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+
+    def run(self, argv, log):
+        """
+        Run script call ARGV in a worker, appending its outputs to file LOG, and returns
+        its return code. Raises OSError (or ValueError) if the worker fails
+        """
+        worker = self._acquire()
+        try:
+            returncode = worker.run(argv, log)
+        except (OSError, ValueError, KeyError):
+            self._discard(worker)
+            raise
+        self.idle.put(worker)
+        return returncode
+
+    def stop(self):
+        with self.lock:
+            workers, self.workers = self.workers, list()
+        for worker in workers:
+            worker.stop()
+        while not self.idle.empty():
+            self.idle.get()
+
+
+pool = python_workers_pool()
+atexit.register(pool.stop)
+
+
+def run_in_worker(command, log):
+    """
+    Run shell COMMAND in a warm Python worker if it is the plain call of a Python script
+    (see :py:func:`python_call`), appending its outputs to file LOG.
+
+    Returns True if the command was run successfully; False if it was not run in a worker,
+    or if the worker failed (in which case it should be run again, by a shell). Raises
+    subprocess.CalledProcessError if the script returned a non-zero code
+    """
+    if not use_python_workers or not hasattr(os, "fork"):
+        return False
+    argv = python_call(command)
+    if argv is None:
+        return False
+    try:
+        returncode = pool.run(argv, log)
+    except (OSError, ValueError, KeyError) as e:
+        clogger.debug("Python worker failed for %s : %s" % (command, str(e)))
+        return False
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return True
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A session-wide (and optionally persistent) cache of the results of data files searches
+for datasets, as done by :py:meth:`~climaf.classes.cdataset.explore` (and hence by
+:py:meth:`~climaf.classes.cdataset.baseFiles` and the evaluation of datasets)
+
+A search result (the data files and the values of wildcard facets) is keyed by the
+dataset's facets dict, by the search options and by the data locations which apply
+(so that declaring new data locations does not require any invalidation). It is used
+during `resolution_cache_ttl` seconds, after which the search is done again. Datasets
+sharing the same facets, although built in different places, thus query the file system
+only once in that delay.
+
+Searches which find no file are not cached. Cached results can be explicitly forgotten
+using :py:func:`forget_resolutions`
+
+If `resolution_cache_file` is set, results are also stored in that SQLite database (in WAL
+mode, so that it can be shared by concurrent CliMAF sessions) and used by later sessions
+in the same delay.
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from env.clogging import clogger
+from climaf.period import cperiod
+from climaf.dataloc import selectFiles, getlocs
+
+#: Should the results of data files searches for datasets be cached
+use_resolution_cache = True
+#: Delay (in seconds) during which a cached search result is used (None means : no limit)
+resolution_cache_ttl = 600.
+#: The SQLite file for a persistent cache of search results (None means : in memory only)
+resolution_cache_file = os.getenv("CLIMAF_RESOLUTION_CACHE", None)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS resolutions (
+    key TEXT PRIMARY KEY,
+    facets TEXT,
+    time REAL,
+    value TEXT
+);
+"""
+
+
+def resolution_key(facets, merge_periods_on, use_frequency):
+    """
+    Returns the key of the search for dict FACETS with options MERGE_PERIODS_ON and USE_FREQUENCY
+    """
+    locations = getlocs(project=facets["project"], model=facets.get("model", "*"),
+                        simulation=facets.get("simulation", "*"), frequency=facets.get("frequency", "*"),
+                        realm=facets.get("realm", "*"), table=facets.get("table", "*"))
+    return repr((sorted([(k, repr(v)) for k, v in facets.items()]), merge_periods_on, repr(use_frequency),
+                 repr(locations)))
+
+
+def encode(files, wildcards):
+    """
+    Returns a JSON string for search result FILES and WILDCARDS, where the periods
+    are represented by their integer-minute bounds
+    """
+    rep = dict(files=files, wildcards=dict([(k, v) for k, v in wildcards.items() if k != "period"]))
+    if "period" in wildcards:
+        rep["periods"] = [[key, [None if p.fx else [p._start, p._end] for p in periods]]
+                          for key, periods in wildcards["period"].items()]
+    return json.dumps(rep)
+
+
+def decode(value):
+    """
+    Returns the pair (files, wildcards) for JSON string VALUE (see :py:func:`encode`)
+    """
+    rep = json.loads(value)
+    wildcards = rep["wildcards"]
+    if "periods" in rep:
+        wildcards["period"] = dict([(key, [cperiod("fx") if p is None else cperiod.from_minutes(*p)
+                                           for p in periods])
+                                    for key, periods in rep["periods"]])
+    return rep["files"], wildcards
+
+
+class resolution_cache(object):
+    """
+    The cache of the results of data files searches for datasets
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.memory = dict()
+        # Key -> [lock, number of threads using that lock]
+        self.searching = dict()
+        self.filename = None
+        self.connection = None
+
+    def _connect(self):
+        # Open the database lazily, and go on without it if it cannot be opened
+        filename = resolution_cache_file and os.path.expanduser(resolution_cache_file)
+        if filename != self.filename:
+            self.close()
+            self.filename = filename
+        if self.connection is None and filename:
+            try:
+                dirname = os.path.dirname(filename)
+                if dirname and not os.path.isdir(dirname):
+                    os.makedirs(dirname, exist_ok=True)
+                self.connection = sqlite3.connect(filename, timeout=60., isolation_level=None,
+                                                  check_same_thread=False)
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.execute("PRAGMA synchronous=NORMAL")
+                self.connection.executescript(_schema)
+            except sqlite3.Error as e:
+                clogger.warning("Cannot use resolution cache %s : %s" % (filename, str(e)))
+                self.connection = False
+        return self.connection
+
+    def close(self):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+            self.connection = None
+
+    def lookup(self, key):
+        """
+        Returns the JSON value cached for KEY if it is not older than `resolution_cache_ttl`,
+        or None
+        """
+        with self.lock:
+            entry = self.memory.get(key)
+            connection = self._connect()
+            if entry is None and connection:
+                try:
+                    rows = connection.execute("SELECT facets, time, value FROM resolutions WHERE key=?",
+                                              (key, )).fetchall()
+                except sqlite3.Error as e:
+                    clogger.debug("Cannot read resolution cache : %s" % str(e))
+                    rows = []
+                if len(rows) > 0:
+                    entry = (json.loads(rows[0][0]), rows[0][1], rows[0][2])
+                    self.memory[key] = entry
+            if entry is None:
+                return None
+            if resolution_cache_ttl is not None and time.time() - entry[1] > resolution_cache_ttl:
+                self.memory.pop(key, None)
+                return None
+            return entry[2]
+
+    def store(self, key, facets, value):
+        with self.lock:
+            facets = dict([(k, repr(v)) for k, v in facets.items()])
+            entry = (facets, time.time(), value)
+            self.memory[key] = entry
+            connection = self._connect()
+            if connection:
+                try:
+                    connection.execute("INSERT OR REPLACE INTO resolutions VALUES (?,?,?,?)",
+                                       (key, json.dumps(facets), entry[1], value))
+                except sqlite3.Error as e:
+                    clogger.debug("Cannot write in resolution cache : %s" % str(e))
+
+    def get(self, facets, merge_periods_on, use_frequency, force=False):
+        """
+        Returns the pair (files, wildcards) of the search of data files for dict FACETS
+        (see :py:func:`~climaf.dataloc.selectFiles`), either from the cache or by doing
+        the search (if FORCE is True, or if the cached result is too old)
+        """
+        key = resolution_key(facets, merge_periods_on, use_frequency)
+        with self.lock:
+            # Concurrent searches for the same key are done only once : the key lock is kept
+            # until all threads waiting for it got the result
+            searching = self.searching.setdefault(key, [threading.Lock(), 0])
+            searching[1] += 1
+        try:
+            with searching[0]:
+                value = None if force else self.lookup(key)
+                if value is None:
+                    wildcards = dict()
+                    files = selectFiles(return_wildcards=wildcards, merge_periods_on=merge_periods_on,
+                                        use_frequency=use_frequency, **facets)
+                    if not files:
+                        return files, wildcards
+                    try:
+                        value = encode(files, wildcards)
+                    except (TypeError, ValueError):
+                        clogger.debug("Cannot cache search result for %s" % repr(facets))
+                        return files, wildcards
+                    self.store(key, facets, value)
+                else:
+                    clogger.debug("Using cached search result for %s" % repr(facets))
+        finally:
+            with self.lock:
+                searching[1] -= 1
+                if searching[1] == 0:
+                    self.searching.pop(key, None)
+        return decode(value)
+
+    def forget(self, **facets):
+        """
+        Forget the search results for the datasets which match all FACETS values, or all
+        search results if no facet is provided
+        """
+        facets = dict([(k, repr(v)) for k, v in facets.items()])
+
+        def match(entry_facets):
+            return all([entry_facets.get(k) == v for k, v in facets.items()])
+
+        with self.lock:
+            for key in [k for k, entry in self.memory.items() if match(entry[0])]:
+                self.memory.pop(key)
+            connection = self._connect()
+            if connection:
+                if len(facets) == 0:
+                    connection.execute("DELETE FROM resolutions")
+                else:
+                    rows = connection.execute("SELECT key, facets FROM resolutions").fetchall()
+                    keys = [(key, ) for key, entry_facets in rows if match(json.loads(entry_facets))]
+                    connection.executemany("DELETE FROM resolutions WHERE key=?", keys)
+
+
+resolutions = resolution_cache()
+
+
+def cached_selectFiles(facets, merge_periods_on=None, use_frequency=False, force=False):
+    """
+    Returns the pair (files, wildcards) of the search of data files for dict FACETS (see
+    :py:func:`~climaf.dataloc.selectFiles`, which fills wildcards), using the cache of
+    search results if `use_resolution_cache` is True and FORCE is False
+    """
+    if not use_resolution_cache:
+        wildcards = dict()
+        files = selectFiles(return_wildcards=wildcards, merge_periods_on=merge_periods_on,
+                            use_frequency=use_frequency, **facets)
+        return files, wildcards
+    return resolutions.get(facets, merge_periods_on, use_frequency, force)
+
+
+def forget_resolutions(**facets):
+    """
+    Forget the cached search results for the datasets which match all FACETS values
+    (e.g. ``forget_resolutions(project="CMIP6", model="CNRM-CM6-1")``), or all
+    cached search results if no facet is provided
+
+    Use it after data files were added or removed in archives, if you cannot
+    wait for `resolution_cache_ttl`
+    """
+    resolutions.forget(**facets)
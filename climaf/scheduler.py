@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CliMAF scheduler : evaluate independent sub-trees of a CliMAF object concurrently
+
+A CliMAF object (ctree, cens, cpage...) is turned into a DAG of script calls,
+where identical sub-trees (i.e. having the same CRS) are represented by a single
+node. Nodes which inputs are all available are then submitted to a bounded pool
+of threads; threads are enough, as script calls actually run as external processes.
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from env.environment import *
+from env.clogging import clogger
+from climaf.classes import cobject, ctree, scriptChild, cens, cpage_all
+
+#: Default number of workers used for evaluating independent sub-trees (1 means sequential evaluation)
+default_workers = 1
+
+
+def is_schedulable(cobj):
+    """
+    True if COBJ is a call to a script which delivers some output, and can thus be
+    evaluated (and cached) on its own
+    """
+    return isinstance(cobj, ctree) and cobj.operator in cscripts and \
+        cscripts[cobj.operator].outputFormat not in none_formats
+
+
+def build_dag(cobj):
+    """
+    Returns the DAG of the script calls involved in the evaluation of COBJ, as a dict
+    which keys are the CRS of the calls, and values are pairs (ctree object, set of
+    the CRS of the calls it depends on).
+
+    Identical sub-trees lead to a single node. Datasets are not nodes : they are
+    evaluated by the script calls using them
+    """
+    dag = dict()
+    _add_nodes(cobj, dag, dict())
+    return dag
+
+
+def _add_nodes(cobj, dag, seen):
+    # Returns the set of the CRS of the DAG nodes which COBJ directly depends on
+    # (or of COBJ itself if it is a node). SEEN memoizes the result by CRS
+    if not isinstance(cobj, cobject):
+        return set()
+    if isinstance(cobj, scriptChild):
+        return _add_nodes(cobj.father, dag, seen)
+    crs = getattr(cobj, "crs", None)
+    if crs in seen:
+        return seen[crs]
+    deps = set()
+    if isinstance(cobj, ctree):
+        for op in cobj.operands:
+            deps.update(_add_nodes(op, dag, seen))
+        if is_schedulable(cobj):
+            dag[crs] = (cobj, deps)
+            deps = {crs}
+    elif isinstance(cobj, cens):
+        for member in cobj.order:
+            deps.update(_add_nodes(cobj[member], dag, seen))
+    elif isinstance(cobj, cpage_all):
+        for line in cobj.fig_lines:
+            for fig in line:
+                deps.update(_add_nodes(fig, dag, seen))
+    if crs is not None:
+        seen[crs] = deps
+    return deps
+
+
+def dag_roots(dag):
+    """
+    Returns the set of the CRS of those nodes of DAG which no other node depends on
+    """
+    rep = set(dag)
+    for _, deps in dag.values():
+        rep.difference_update(deps)
+    return rep
+
+
+def run_dag(dag, func, workers=None):
+    """
+    Apply FUNC on the object of each node of DAG, once FUNC has been applied on all
+    nodes it depends on, using at most WORKERS concurrent threads (defaults to
+    ``default_workers``)
+
+    Returns a dict of FUNC's results, keyed by CRS. The first exception raised by
+    FUNC cancels pending nodes and is re-raised once running nodes are completed
+    """
+    if workers is None:
+        workers = default_workers
+    workers = max(1, int(workers))
+    waiting = dict([(crs, set(deps)) for crs, (_, deps) in dag.items()])
+    dependents = dict([(crs, set()) for crs in dag])
+    for crs, (_, deps) in dag.items():
+        for dep in deps:
+            dependents[dep].add(crs)
+    results = dict()
+    clogger.debug("Scheduling %d nodes on %d workers" % (len(dag), workers))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = dict()
+
+        def submit_ready_nodes():
+            for crs in [c for c in waiting if len(waiting[c]) == 0]:
+                waiting.pop(crs)
+                running[executor.submit(func, dag[crs][0])] = crs
+
+        submit_ready_nodes()
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                crs = running.pop(future)
+                try:
+                    results[crs] = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+                for dependent in dependents[crs]:
+                    waiting[dependent].discard(crs)
+            submit_ready_nodes()
+    return results
+
+
+def map_isolated(func, items, workers=None):
+    """
+    Apply FUNC on each element of ITEMS, using at most WORKERS concurrent threads
+    (defaults to ``default_workers``). A failure for one element does not prevent
+    the evaluation of other ones
+
+    Returns a pair of dicts keyed by the elements of ITEMS : the results of FUNC, and
+    the exceptions raised by FUNC
+    """
+    if workers is None:
+        workers = default_workers
+    workers = max(1, min(int(workers), len(items)))
+    results = dict()
+    errors = dict()
+    if workers == 1:
+        for item in items:
+            try:
+                results[item] = func(item)
+            except Exception as e:
+                errors[item] = e
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = dict([(item, executor.submit(func, item)) for item in items])
+        for item in items:
+            try:
+                results[item] = futures[item].result()
+            except Exception as e:
+                errors[item] = e
+    return results, errors
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Spatially tiled evaluation of CliMAF objects
+
+A call to a script (or in-process operator) which, like all the script calls it
+depends on, commutes with space concatenation (see flag `commuteWithSpaceConcatenation`
+in :py:class:`~climaf.operators.cscript`) can be evaluated on latitude bands of the
+domain of its datasets, rather than on the whole domain. Bands are evaluated
+concurrently, each one is cached on its own (as the same object on a smaller domain),
+and the results are re-assembled (see :py:func:`~climaf.driver.ceval_space_tiles`).
+Bands boundaries are the latitudes multiple of `band_height`, so that objects on
+overlapping domains share their bands.
+
+Re-assembling is done by xarray, along latitude, and applies only to fields on
+regular latitude-longitude grids (i.e. having a 1-D latitude coordinate). Objects which
+datasets are on other grids (e.g. the curvilinear grids of ocean models), or which data
+files cannot be checked, are not evaluated by bands. As dataset domains have integer
+bounds, and extraction includes the bounds, grid points lying on a band boundary are
+extracted for both bands; they are kept once.
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import copy
+import math
+
+import xarray as xr
+
+from env.environment import *
+from env.clogging import clogger
+from climaf.utils import Climaf_Error
+from climaf.classes import cdataset, ctree
+from climaf.xarray_operators import find_dim, lat_names
+from climaf.netcdfbasics import headerOfFile
+
+#: Height of latitude bands, in degrees, used for evaluating objects which commute with
+#  space concatenation; None disables spatially tiled evaluation
+band_height = None
+#: Number of latitude bands which are evaluated concurrently
+tile_workers = os.cpu_count() or 1
+
+#: The domain equivalent to domain 'global', as [latmin, latmax, lonmin, lonmax]
+global_domain = [-90, 90, 0, 360]
+
+
+def domain_bounds(domain):
+    """
+    Returns DOMAIN ('global' or a list [latmin, latmax, lonmin, lonmax]) as a list
+    of bounds, or None for other domains
+    """
+    if domain == "global":
+        return list(global_domain)
+    if isinstance(domain, (list, tuple)) and len(domain) == 4:
+        return list(domain)
+    return None
+
+
+def domain_includes(includer, included):
+    """
+    True if domain INCLUDER includes domain INCLUDED (see :py:func:`domain_bounds`)
+    """
+    includer = domain_bounds(includer)
+    included = domain_bounds(included)
+    if includer is None or included is None:
+        return False
+    latmin, latmax, lonmin, lonmax = [float(v) for v in includer]
+    if not (latmin <= float(included[0]) and float(included[1]) <= latmax):
+        return False
+    if lonmax - lonmin >= 360.:
+        return True
+    # Longitudes are compared modulo 360 (the includer may cross the longitudes origin)
+    width = lonmax - lonmin
+    if width < 0:
+        width += 360.
+    start = (float(included[2]) - lonmin) % 360.
+    return start + float(included[3]) - float(included[2]) <= width
+
+
+def latitude_bands(domain, height=None):
+    """
+    Returns the list of the domains which split DOMAIN in latitude bands, which
+    boundaries are the latitudes multiple of HEIGHT (defaults to `band_height`)
+
+    >>> latitude_bands("global", 60)
+    [[-90, -60, 0, 360], [-60, 0, 0, 360], [0, 60, 0, 360], [60, 90, 0, 360]]
+    """
+    if height is None:
+        height = band_height
+    bounds = domain_bounds(domain)
+    if bounds is None or not height or int(height) < 1:
+        return [domain, ]
+    height = int(height)
+    latmin, latmax, lonmin, lonmax = bounds
+    edges = [latmin, ]
+    edge = (int(math.floor(latmin)) // height + 1) * height
+    while edge < latmax:
+        edges.append(edge)
+        edge += height
+    edges.append(latmax)
+    return [[edges[i], edges[i + 1], lonmin, lonmax] for i in range(len(edges) - 1)]
+
+
+def commutes_with_space_concatenation(cobj, domain=None):
+    """
+    True if COBJ is a dataset, or a script call which, as all the script calls it
+    depends on, commutes with space concatenation, and which datasets all have the
+    same domain (DOMAIN, if provided)
+    """
+    return common_domain(cobj, domain) is not None
+
+
+def common_domain(cobj, domain=None):
+    """
+    Returns the domain common to all datasets of COBJ (which must be DOMAIN, if
+    provided) if COBJ commutes with space concatenation, and None otherwise
+    """
+    if isinstance(cobj, cdataset):
+        if domain_bounds(cobj.domain) is None:
+            return None
+        if domain is not None and cobj.domain != domain:
+            return None
+        return cobj.domain
+    if not isinstance(cobj, ctree) or not cobj.flags or not cobj.flags.commuteWithSpaceConcatenation:
+        return None
+    for op in cobj.operands:
+        domain = common_domain(op, domain)
+        if domain is None:
+            return None
+    return domain
+
+
+def setdomain(cobj, domain):
+    """
+    Modifies the domain for all datasets of COBJ, a dataset or a tree of script calls
+    """
+    if isinstance(cobj, cdataset):
+        cobj.erase()
+        cobj.domain = domain
+        cobj.kvp['domain'] = domain
+        cobj.crs = cobj.buildcrs()
+        cobj.register()
+    elif isinstance(cobj, ctree):
+        cobj.erase()
+        for op in cobj.operands:
+            setdomain(op, domain)
+        cobj.crs = cobj.buildcrs()
+        cobj.register()
+
+
+def has_latitude_coordinate(filename):
+    """
+    True if NetCDF file FILENAME has a 1-D latitude coordinate, i.e. a variable named after
+    its dimension among `lat_names` (which does not hold for curvilinear grids)
+    """
+    try:
+        header = headerOfFile(filename)
+    except Exception:
+        return False
+    return any([name in header["dims"] and name in header["variables"] for name in lat_names])
+
+
+def on_latitude_grids(cobj):
+    """
+    True if the data files of all datasets of COBJ, a dataset or a tree of script calls,
+    have a 1-D latitude coordinate (checking the first file of each dataset)
+    """
+    if isinstance(cobj, cdataset):
+        files = cobj.baseFiles()
+        if not files:
+            return False
+        first = files.split()[0]
+        return os.path.exists(first) and has_latitude_coordinate(first)
+    if isinstance(cobj, ctree):
+        return all([on_latitude_grids(op) for op in cobj.operands if op])
+    return False
+
+
+def space_tiles(cobj, height=None):
+    """
+    Returns the list of the copies of COBJ on the latitude bands of its domain (see
+    :py:func:`latitude_bands`), or None if COBJ is not a script call which commutes
+    with space concatenation, if its domain lies within a single band, or if its data
+    are not on grids with a 1-D latitude coordinate
+    """
+    if not isinstance(cobj, ctree):
+        return None
+    domain = common_domain(cobj, None)
+    if domain is None:
+        return None
+    bands = latitude_bands(domain, height)
+    if len(bands) < 2:
+        return None
+    if not on_latitude_grids(cobj):
+        clogger.debug("Not evaluating %s by latitude bands, as its data have no 1-D latitude" % cobj.crs)
+        return None
+    rep = list()
+    for band in bands:
+        tile = copy.deepcopy(cobj)
+        setdomain(tile, band)
+        rep.append(tile)
+    clogger.debug("Latitude bands for %s : %s" % (cobj.crs, repr(bands)))
+    return rep
+
+
+def assemble(files, filename):
+    """
+    Writes in FILENAME the concatenation along latitude of NetCDF FILES, which hold
+    fields on successive latitude bands; grid points duplicated at bands boundaries are
+    kept once
+    """
+    datasets = [xr.open_dataset(f, decode_times=False) for f in files]
+    try:
+        sample = datasets[0]
+        lat_dim = None
+        for var in sample.data_vars:
+            lat_dim = find_dim(sample[var], lat_names, "Y")
+            if lat_dim is not None:
+                break
+        if lat_dim is None or lat_dim not in sample.coords or sample.coords[lat_dim].ndim != 1:
+            raise Climaf_Error("Cannot assemble latitude bands for fields without a 1-D latitude coordinate (%s)"
+                               % files[0])
+        ascending = sample.sizes[lat_dim] < 2 or float(sample[lat_dim][1]) > float(sample[lat_dim][0])
+        # Variables which do not depend on latitude (e.g. time bounds) are taken from first band
+        merged = xr.concat(datasets, lat_dim, data_vars="minimal", coords="minimal", compat="override")
+        merged = merged.drop_duplicates(lat_dim).sortby(lat_dim, ascending=ascending)
+        merged.to_netcdf(filename, unlimited_dims=sample.encoding.get("unlimited_dims", None))
+    finally:
+        for dataset in datasets:
+            dataset.close()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time-chunked evaluation of CliMAF objects
+
+A call to a script (or in-process operator) which, like all the script calls it
+depends on, commutes with time concatenation (see flag `commuteWithTimeConcatenation`
+in :py:class:`~climaf.operators.cscript`) can be evaluated on successive time chunks
+(e.g. decades) rather than on its whole period. Chunks are evaluated concurrently,
+each one is cached on its own, and the results are concatenated (see
+:py:func:`~climaf.driver.ceval_time_chunks`).
+
+Chunks boundaries are aligned on years which are multiples of `chunk_years`, so that
+objects on overlapping periods share their chunks : extending the period of a series,
+or re-evaluating it after dropping one chunk, only computes the missing chunks.
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import copy
+import datetime
+
+from env.environment import *
+from env.clogging import clogger
+from climaf.period import cperiod
+from climaf.classes import cdataset, ctree
+
+#: Length of time chunks, in years; None disables time-chunked evaluation
+chunk_years = None
+#: Number of time chunks which are evaluated concurrently
+chunk_workers = os.cpu_count() or 1
+
+
+def chunk_periods(period, years=None):
+    """
+    Returns the list of the successive sub-periods of cperiod PERIOD, which boundaries
+    are the starts of the years which are multiples of YEARS (defaults to `chunk_years`)
+
+    >>> chunk_periods(init_period("1850-2014"), 50)
+    [1850-1899, 1900-1949, 1950-1999, 2000-2014]
+    """
+    if years is None:
+        years = chunk_years
+    if not isinstance(period, cperiod) or period.fx or not years or int(years) < 1:
+        return [period, ]
+    years = int(years)
+    rep = list()
+    start = period.start
+    year = (start.year // years + 1) * years
+    while True:
+        boundary = datetime.datetime(year=year, month=1, day=1)
+        if boundary >= period.end:
+            break
+        rep.append(cperiod(start, boundary))
+        start = boundary
+        year += years
+    rep.append(cperiod(start, period.end))
+    return rep
+
+
+def commutes_with_time_concatenation(cobj, period=None):
+    """
+    True if COBJ is a dataset, or a script call which, as all the script calls it
+    depends on, commutes with time concatenation, and which datasets all have the
+    same period (PERIOD, if provided)
+    """
+    return _common_period(cobj, period) is not None
+
+
+def _common_period(cobj, period):
+    # Returns the period common to all datasets of COBJ if it commutes with time
+    # concatenation, and None otherwise
+    if isinstance(cobj, cdataset):
+        if not isinstance(cobj.period, cperiod) or cobj.period.fx:
+            return None
+        if period is not None and cobj.period != period:
+            return None
+        return cobj.period
+    if not isinstance(cobj, ctree) or not cobj.flags or not cobj.flags.commuteWithTimeConcatenation:
+        return None
+    for op in cobj.operands:
+        period = _common_period(op, period)
+        if period is None:
+            return None
+    return period
+
+
+def time_chunks(cobj, years=None):
+    """
+    Returns the list of the copies of COBJ on its time chunks (see :py:func:`chunk_periods`),
+    or None if COBJ is not a script call which commutes with time concatenation, or if
+    its period is shorter than a chunk
+    """
+    if not isinstance(cobj, ctree):
+        return None
+    period = _common_period(cobj, None)
+    if period is None:
+        return None
+    periods = chunk_periods(period, years)
+    if len(periods) < 2:
+        return None
+    rep = list()
+    for chunk_period in periods:
+        chunk = copy.deepcopy(cobj)
+        chunk.setperiod(chunk_period)
+        rep.append(chunk)
+    clogger.debug("Time chunks for %s : %s" % (cobj.crs, repr(periods)))
+    return rep
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process CliMAF operators, working on xarray DataArrays (see :py:class:`~climaf.operators.coperator`)
+
+When evaluating a call to such an operator, its operands are opened lazily as
+DataArrays : datasets are opened directly from their data files (with variable,
+alias and period selection done by xarray) when possible, calls to other in-process
+operators are chained in memory, and other objects are evaluated as files, as usual.
+Data is actually computed only when the result is needed as a MaskedArray, or stored
+in the cache (which occurs when the result is needed as a file, or when the operator
+was declared with materialize=True).
+
+This module also declares some standard lightweight operators : arithmetic
+(``xr_plus``, ``xr_minus``, ``xr_times``, ``xr_divide``, ``xr_rescale``),
+averages (``xr_time_average``, ``xr_space_average``), subsetting (``xr_llbox``,
+``xr_select_level``) and masking (``xr_mask``). E.g.::
+
+    >>> anomaly = xr_minus(tas, xr_time_average(tas))
+    >>> cfile(xr_space_average(anomaly))
+
+only writes the final result in cache.
+
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import datetime
+
+import numpy as np
+import xarray as xr
+
+from env.environment import *
+from env.clogging import clogger
+from climaf.utils import Climaf_Error
+from climaf.period import cperiod
+from climaf.classes import cdataset
+from climaf.operators_derive import is_derived_variable
+
+try:
+    import dask
+except ImportError:
+    dask = None
+
+time_names = ["time", "time_counter", "t"]
+lat_names = ["lat", "latitude", "nav_lat", "y", "rlat"]
+lon_names = ["lon", "longitude", "nav_lon", "x", "rlon"]
+level_names = ["plev", "lev", "level", "depth", "deptht", "height", "z", "olevel", "alevel"]
+
+
+def find_dim(da, names, axis=None):
+    """
+    Returns the name of the dimension of DataArray DA which has one of NAMES, or which
+    coordinate has attribute 'axis' equal to AXIS; or None
+    """
+    for dim in da.dims:
+        if dim in names:
+            return dim
+        if axis is not None and dim in da.coords and da.coords[dim].attrs.get("axis", None) == axis:
+            return dim
+    return None
+
+
+def open_lazily(files):
+    """
+    Returns the xarray Dataset for a list of NetCDF FILES, which variables are lazily loaded
+    """
+    if hasattr(xr, "coders"):
+        decoding = dict(decode_times=xr.coders.CFDatetimeCoder(use_cftime=True))
+    else:
+        decoding = dict(use_cftime=True)
+    if len(files) == 1:
+        return xr.open_dataset(files[0], **decoding)
+    return xr.open_mfdataset(files, combine="by_coords", data_vars="minimal", coords="minimal",
+                             compat="override", **decoding)
+
+
+def close_datasets(opened):
+    """
+    Closes the xarray Datasets of list OPENED (as filled by :py:func:`file_array` and
+    :py:func:`dataset_array`), and empties it
+    """
+    while opened:
+        opened.pop().close()
+
+
+def file_array(filename, variable, opened=None):
+    """
+    Returns the lazily loaded DataArray for VARIABLE in NetCDF file FILENAME
+
+    If OPENED is a list, the underlying xarray Dataset is appended to it, so that the caller
+    can close it once the DataArray has been computed (see :py:func:`close_datasets`)
+    """
+    dataset = open_lazily([filename, ])
+    if variable not in dataset.data_vars:
+        if len(dataset.data_vars) != 1:
+            dataset.close()
+            raise Climaf_Error("File %s doesn't have requested variable %s" % (filename, variable))
+        variable = list(dataset.data_vars)[0]
+    if opened is not None:
+        opened.append(dataset)
+    return dataset[variable]
+
+
+def dataset_array(ds, opened=None):
+    """
+    Returns the lazily loaded DataArray for dataset DS, with variable, alias and period
+    selection done by xarray; or None if DS must rather be extracted by script 'select'
+    (remote or derived variable, named domain or domain on a non-regular grid,
+    non-NetCDF files, or multiple files without dask)
+
+    Arg OPENED has the same meaning as for :py:func:`file_array`
+    """
+    if not isinstance(ds, cdataset) or not ds.isLocal() or "," in ds.variable or \
+            is_derived_variable(ds.variable, ds.project) or \
+            not (ds.domain in ["global", None] or (isinstance(ds.domain, list) and len(ds.domain) == 4)):
+        return None
+    files = ds.baseFiles()
+    if not files:
+        return None
+    files = files.split()
+    if not all([f.endswith(".nc") for f in files]) or (len(files) > 1 and dask is None):
+        return None
+    if ds.alias:
+        filevar, scale, offset, units, _, missing, _ = ds.alias
+    else:
+        filevar, scale, offset, units, missing = ds.variable, 1., 0., None, None
+    try:
+        dataset = open_lazily(files)
+    except (IOError, OSError, ValueError) as e:
+        clogger.debug("Cannot open %s lazily : %s" % (ds.crs, str(e)))
+        return None
+    if filevar not in dataset.data_vars:
+        dataset.close()
+        return None
+    da = dataset[filevar]
+    if missing is not None:
+        da = da.where(da != float(missing))
+    if float(scale) != 1. or float(offset) != 0.:
+        da = (da * float(scale) + float(offset)).assign_attrs(da.attrs)
+    if units is not None:
+        da = da.assign_attrs(units=units)
+    period = ds.period
+    time_dim = find_dim(da, time_names, "T")
+    if isinstance(period, cperiod) and not period.fx and time_dim is not None:
+        end = period.end - datetime.timedelta(0, 60)
+        da = da.sel({time_dim: slice(period.start.isoformat(), end.isoformat())})
+    if isinstance(ds.domain, list):
+        lat_dim = find_dim(da, lat_names, "Y")
+        lon_dim = find_dim(da, lon_names, "X")
+        if lat_dim not in da.coords or lon_dim not in da.coords or \
+                da.coords[lat_dim].ndim != 1 or da.coords[lon_dim].ndim != 1:
+            dataset.close()
+            return None
+        da = llbox(da, *ds.domain)
+    if opened is not None:
+        opened.append(dataset)
+    return da.rename(ds.variable)
+
+
+def _aligned(a, b):
+    # Arithmetic on fields from different files should not depend on tiny differences
+    # in coordinates values : use coordinates of A
+    if isinstance(b, xr.DataArray):
+        a, b = xr.align(a, b, join="override")
+    return a, b
+
+
+def plus(a, b):
+    a, b = _aligned(a, b)
+    return (a + b).assign_attrs(a.attrs)
+
+
+def minus(a, b):
+    a, b = _aligned(a, b)
+    return (a - b).assign_attrs(a.attrs)
+
+
+def times(a, b):
+    a, b = _aligned(a, b)
+    return (a * b).assign_attrs(a.attrs)
+
+
+def divide(a, b):
+    a, b = _aligned(a, b)
+    return (a / b).assign_attrs(a.attrs)
+
+
+def rescale(a, scale=1., offset=0.):
+    return (a * float(scale) + float(offset)).assign_attrs(a.attrs)
+
+
+def time_average(a):
+    time_dim = find_dim(a, time_names, "T")
+    if time_dim is None:
+        return a
+    return a.mean(time_dim, keep_attrs=True)
+
+
+def space_average(a):
+    """
+    Area-weighted average (with cos(latitude) weights, if latitude is a 1-D coordinate)
+    """
+    lat_dim = find_dim(a, lat_names, "Y")
+    lon_dim = find_dim(a, lon_names, "X")
+    dims = [d for d in [lat_dim, lon_dim] if d is not None]
+    if len(dims) == 0:
+        return a
+    if lat_dim is not None and lat_dim in a.coords and a.coords[lat_dim].ndim == 1 and lat_dim not in ["y", ]:
+        weights = np.cos(np.deg2rad(a.coords[lat_dim]))
+        return a.weighted(weights).mean(dims, keep_attrs=True)
+    return a.mean(dims, keep_attrs=True)
+
+
+def llbox(a, latmin, latmax, lonmin, lonmax):
+    """
+    Select a lat-lon box, for 1-D latitude and longitude coordinates
+    """
+    lat = a.coords[find_dim(a, lat_names, "Y")]
+    lon = a.coords[find_dim(a, lon_names, "X")]
+    latmin, latmax, lonmin, lonmax = [float(v) for v in (latmin, latmax, lonmin, lonmax)]
+    # Longitudes are compared modulo 360 (the box may cross the longitudes origin)
+    width = lonmax - lonmin
+    if width < 0:
+        width += 360.
+    a = a.isel({lat.name: ((lat >= latmin) & (lat <= latmax)).values,
+                lon.name: ((lon - lonmin) % 360. <= width).values})
+    return a.isel({lon.name: np.argsort(((a.coords[lon.name] - lonmin) % 360.).values)})
+
+
+def mask(a, vmin=None, vmax=None):
+    """
+    Set values lower than VMIN or greater than VMAX as missing
+    """
+    if vmin is not None:
+        a = a.where(a >= float(vmin))
+    if vmax is not None:
+        a = a.where(a <= float(vmax))
+    return a
+
+
+def select_level(a, level):
+    level_dim = find_dim(a, level_names, "Z")
+    if level_dim is None:
+        raise Climaf_Error("Cannot find a vertical dimension for %s" % a.name)
+    return a.sel({level_dim: float(level)}, method="nearest")
+
+
+def load_xarray_operators():
+    """
+    Declare the standard in-process operators. Invoked by standard CliMAF setup
+    """
+    from climaf.operators import coperator
+    coperator("xr_plus", plus)
+    coperator("xr_minus", minus)
+    coperator("xr_times", times)
+    coperator("xr_divide", divide)
+    coperator("xr_rescale", rescale, commuteWithTimeConcatenation=True, commuteWithSpaceConcatenation=True)
+    coperator("xr_time_average", time_average, commuteWithSpaceConcatenation=True)
+    coperator("xr_space_average", space_average, commuteWithTimeConcatenation=True)
+    coperator("xr_llbox", llbox, commuteWithTimeConcatenation=True)
+    coperator("xr_mask", mask, commuteWithTimeConcatenation=True, commuteWithSpaceConcatenation=True)
+    coperator("xr_select_level", select_level, commuteWithTimeConcatenation=True,
+              commuteWithSpaceConcatenation=True)
@@ -15,9 +15,11 @@ import os
 import subprocess
 import time
 import shutil
+import datetime
 import six
 import xarray as xr
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -73,14 +75,22 @@ def parse_args():
     parser.add_argument("--test", help="Test the script, provide output file")
     parser.add_argument("--running_climaf_tests", type=bool, default=False,
                         help="If True, apply settings common to all sites, when needed")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Number of CDO commands run concurrently (default: $CLIMAF_MCDO_JOBS or %d)"
+                             % default_jobs)
 
     args = parser.parse_args()
     return dict(input_files=args.input_files, operator=args.operator, output_file=args.output_file,
                 variable=args.variable, period=args.period, region=args.region, alias=args.alias, units=args.units,
                 vm=args.vm, apply_operator_after_merge=args.apply_operator_after_merge,
-                running_climaf_tests=args.running_climaf_tests)
+                running_climaf_tests=args.running_climaf_tests, jobs=args.jobs)
 
 
+# Number of CDO commands run concurrently, for pre-processing input files and merging them
+default_jobs = int(os.environ.get("CLIMAF_MCDO_JOBS", min(8, os.cpu_count() or 1)))
+# Maximum number of files merged by a single CDO command
+merge_fan_in = 10
+
 # Define several auxiliary functions
 clim_timefix_pattern = re.compile(r'IGCM_OUT.*_SE_.*(?P<value>\d{4})_\d{4}_1M.*nc')
 
@@ -95,6 +105,91 @@ IPSL_CMIP6_msftyz_filename_pattern = re.compile(r'.*msftyz_Omon_IPSL-CM6A.*\.nc'
 IPSL_CMIP6_msftyz_issue_pattern = re.compile(r'.*x = 1 ;.*')
 
 
+filename_period_pattern = re.compile(r'.*_(?P<begin>\d{4,14})(-(?P<end>\d{4,14}))?(-clim)?\.nc$')
+date_formats = {4: "%Y", 6: "%Y%m", 8: "%Y%m%d", 10: "%Y%m%d%H", 12: "%Y%m%d%H%M", 14: "%Y%m%d%H%M%S"}
+
+
+def date_interval(date_string):
+    # Returns the interval [start, end[ covered by a date string such as 1850, 185001 or 18500101
+    date_format = date_formats.get(len(date_string), None)
+    if date_format is None:
+        return None
+    try:
+        start = datetime.datetime.strptime(date_string, date_format)
+    except ValueError:
+        return None
+    if len(date_string) == 4:
+        end = start.replace(year=start.year + 1)
+    elif len(date_string) == 6:
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    else:
+        end = start + {8: datetime.timedelta(days=1), 10: datetime.timedelta(hours=1),
+                       12: datetime.timedelta(minutes=1), 14: datetime.timedelta(seconds=1)}[len(date_string)]
+    return start, end
+
+
+def filename_period(file_to_treat):
+    # Returns the interval [start, end[ covered by a data file according to the period at the end
+    # of its name (as e.g. in tas_Amon_CNRM-CM5_historical_r1i1p1_185001-189912.nc), or None
+    match = filename_period_pattern.match(os.path.basename(file_to_treat))
+    if match is None:
+        return None
+    begin = date_interval(match.group("begin"))
+    end = date_interval(match.group("end") or match.group("begin"))
+    if begin is None or end is None or end[1] <= begin[0]:
+        return None
+    return begin[0], end[1]
+
+
+def selected_period(period):
+    # Returns the pair of datetimes of a period as provided to seldate (e.g.
+    # 1850-06-01T00:00:00,1852-04-03T00:00:00), or None
+    try:
+        start, end = period.split(",")
+        return (datetime.datetime.strptime(start, "%Y-%m-%dT%H:%M:%S"),
+                datetime.datetime.strptime(end, "%Y-%m-%dT%H:%M:%S"))
+    except ValueError:
+        return None
+
+
+def periods_are_reliable(files_to_treat, periods):
+    # True if the PERIODS read in the names of FILES_TO_TREAT can be trusted : the name of
+    # every file ends with a period, with the same date formats, and the periods follow each
+    # other without gap nor overlap (unlike e.g. version dates or chunk numbers, which look
+    # like dates, as in tas_20190312.nc or tas_0001.nc)
+    if any([file_period is None for file_period in periods]):
+        return False
+    formats = set()
+    for a_file in files_to_treat:
+        match = filename_period_pattern.match(os.path.basename(a_file))
+        formats.add((len(match.group("begin")), len(match.group("end") or "")))
+    if len(formats) > 1:
+        return False
+    distinct = sorted(set(periods))
+    return all([previous[1] == following[0] for previous, following in zip(distinct[:-1], distinct[1:])])
+
+
+def files_in_period(files_to_treat, period):
+    # Discard files which period, as read in their name, does not intersect PERIOD (a seldate
+    # period, which end is included). This is done only if the periods of the files can be
+    # trusted (see periods_are_reliable); all files are kept if none would remain
+    selected = selected_period(period)
+    if selected is None:
+        return files_to_treat
+    periods = [filename_period(a_file) for a_file in files_to_treat]
+    if not periods_are_reliable(files_to_treat, periods):
+        return files_to_treat
+    rep = list()
+    for a_file, file_period in zip(files_to_treat, periods):
+        if file_period[0] <= selected[1] and file_period[1] > selected[0]:
+            rep.append(a_file)
+        else:
+            clogger.debug("Skipping file %s, which is outside period %s" % (a_file, period))
+    if len(rep) == 0:
+        return files_to_treat
+    return rep
+
+
 def clim_timefix(file_to_treat):
     # Check if the time axis for a data file should be fixed, based solely on its name,
     # and hence echoes the relevant CDO syntax (to be inserted in a CDO pipe) for fixing it
@@ -279,10 +374,14 @@ def remove_dir_and_content(path_to_treat):
             os.remove(path_to_treat)
 
 
-def apply_cdo_command_on_slice(init_cdo_command, cdo_command, files_to_treat, output_file, test=None):
+def apply_cdo_command_on_slice(init_cdo_command, cdo_command, files_to_treat, output_file, test=None,
+                               executor=None, level=0):
+    # Apply CDO_COMMAND (e.g. -mergetime) on FILES_TO_TREAT, by slices of at most merge_fan_in files which
+    # results are then combined the same way (a tree reduction). Slices of a same level are processed
+    # concurrently if an EXECUTOR is provided
     if len(files_to_treat) <= 0:
         raise ValueError("No input file!")
-    elif len(files_to_treat) <= 10:
+    elif len(files_to_treat) <= merge_fan_in:
         cdo_command = " ".join([init_cdo_command, cdo_command] + files_to_treat + [output_file, ])
         print_in_file(cdo_command, output_file=test)
         call_subprocess(cdo_command)
@@ -290,16 +389,32 @@ def apply_cdo_command_on_slice(init_cdo_command, cdo_command, files_to_treat, ou
             os.remove(f)
         return [output_file, ]
     else:
-        tmp_output_file_1 = output_file.replace(".nc", "1.nc")
-        tmp_output_file_2 = output_file.replace(".nc", "2.nc")
-        tmp_output_file = [tmp_output_file_1, tmp_output_file_2]
-        apply_cdo_command_on_slice(init_cdo_command, cdo_command, files_to_treat[0:10], tmp_output_file_1)
-        if not os.path.isfile(tmp_output_file_1):
-            raise OSError("Could not create file %s" % tmp_output_file_1)
-        apply_cdo_command_on_slice(init_cdo_command, cdo_command, files_to_treat[10:], tmp_output_file_2)
-        if not os.path.isfile(tmp_output_file_2):
-            raise OSError("Could not create file %s" % tmp_output_file_2)
-        return apply_cdo_command_on_slice(init_cdo_command, cdo_command, tmp_output_file, output_file)
+        slices = [files_to_treat[i:i + merge_fan_in] for i in range(0, len(files_to_treat), merge_fan_in)]
+        tmp_output_files = [output_file.replace(".nc", "_{}_{}.nc".format(level, i)) for i in range(len(slices))]
+        arguments = [(init_cdo_command, cdo_command, a_slice, tmp_output_file, test)
+                     for (a_slice, tmp_output_file) in zip(slices, tmp_output_files)]
+        if executor is None:
+            list(map(lambda args: apply_cdo_command_on_slice(*args), arguments))
+        else:
+            list(executor.map(lambda args: apply_cdo_command_on_slice(*args), arguments))
+        for tmp_output_file in tmp_output_files:
+            if not os.path.isfile(tmp_output_file):
+                raise OSError("Could not create file %s" % tmp_output_file)
+        return apply_cdo_command_on_slice(init_cdo_command, cdo_command, tmp_output_files, output_file, test=test,
+                                          executor=executor, level=level + 1)
+
+
+def preprocess_file(cdo_command, a_file, tmp_file_path, allow_seldate_failure):
+    # Apply CDO_COMMAND on A_FILE, and put the result in place of A_FILE. Returns
+    # False if the command selected no data
+    command_succeed = call_subprocess(cdo_command, allow_seldate_failure=allow_seldate_failure)
+    os.remove(a_file)
+    if command_succeed is True:
+        shutil.move(tmp_file_path, a_file)
+        if not os.path.isfile(a_file):
+            clogger.error("Could not create file %s" % a_file)
+            raise Exception("Could not create file %s" % a_file)
+    return command_succeed
 
 
 def find_tmp_filename(filename, tmp):
@@ -335,7 +450,11 @@ def change_to_tmp_dir(func):
 @change_to_tmp_dir
 def main(input_files, output_file, tmp, original_directory, variable=None, alias=None, region=None, units=None, vm=None,
          period=None, operator=None, apply_operator_after_merge=None, seldate_is_first=True, test=None,
-         running_climaf_tests=False):
+         running_climaf_tests=False, jobs=None):
+    if jobs is None:
+        jobs = default_jobs
+    jobs = max(1, jobs)
+
     # Initialize cdo commands
     cdo_commands_before_merge = list()
     cdo_commands_for_selvar = list()
@@ -399,6 +518,9 @@ def main(input_files, output_file, tmp, original_directory, variable=None, alias
         clim_time_fix = clim_timefix(input_files[0])
         if clim_time_fix is not None:
             seldate = " ".join([seldate, clim_time_fix])
+        else:
+            # Files which name shows that they are outside the period are not processed at all
+            input_files = files_in_period(input_files, period)
         if not seldate_is_first:
             cdo_commands_after_merge.append(seldate)
 
@@ -436,7 +558,9 @@ def main(input_files, output_file, tmp, original_directory, variable=None, alias
         files_to_treat_before_merging.append(l_file)
 
     if len(files_to_treat_before_merging) > 1:
+        # Pre-process files concurrently; commands are logged in input files order
         files_to_treat_after_merging = list()
+        preprocessings = list()
         for a_file in files_to_treat_before_merging:
             tmp_file_path = find_tmp_filename(a_file, tmp)
             if len(cdo_commands_for_selvar) == 1 and os.path.basename(a_file).startswith(filevar):
@@ -449,28 +573,26 @@ def main(input_files, output_file, tmp, original_directory, variable=None, alias
                 cdo_command = " ".join([init_cdo_command, ] + list(reversed(total_cdo_commands_before_merge)) +
                                        [a_file, tmp_file_path])
                 print_in_file(cdo_command, output_file=test)
-                command_succeed = call_subprocess(cdo_command, allow_seldate_failure=seldate_is_first)
-                os.remove(a_file)
-                if command_succeed is True:
-                    shutil.move(tmp_file_path, a_file)
-                    if not os.path.isfile(a_file):
-                        clogger.error("Could not create file %s" % a_file)
-                        raise Exception("Could not create file %s" % a_file)
-                    files_to_treat_after_merging.append(a_file)
-                else:
-                    # Assume that seldate provided no data, and just ignore that file
-                    pass
+                preprocessings.append((cdo_command, a_file, tmp_file_path, seldate_is_first))
             else:
                 if not os.path.isfile(a_file):
                     clogger.error("Could not access file %s" % a_file)
                     raise Exception("Could not access file %s" % a_file)
-                files_to_treat_after_merging.append(a_file)
-        if cdo_command_for_merge is not None:
-            tmp_output_file = find_tmp_filename(output_file, tmp)
-            files_to_treat_after_merging = apply_cdo_command_on_slice(init_cdo_command=init_cdo_command,
-                                                                      cdo_command=cdo_command_for_merge,
-                                                                      files_to_treat=files_to_treat_after_merging,
-                                                                      output_file=tmp_output_file, test=test)
+                preprocessings.append((None, a_file, None, None))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = [executor.submit(preprocess_file, *args) if args[0] is not None else None
+                       for args in preprocessings]
+            for (args, result) in zip(preprocessings, results):
+                # If seldate provided no data, just ignore that file
+                if result is None or result.result() is True:
+                    files_to_treat_after_merging.append(args[1])
+            if cdo_command_for_merge is not None:
+                tmp_output_file = find_tmp_filename(output_file, tmp)
+                files_to_treat_after_merging = apply_cdo_command_on_slice(init_cdo_command=init_cdo_command,
+                                                                          cdo_command=cdo_command_for_merge,
+                                                                          files_to_treat=files_to_treat_after_merging,
+                                                                          output_file=tmp_output_file, test=test,
+                                                                          executor=executor)
         cdo_command = " ".join([init_cdo_command, ] + list(reversed(cdo_commands_after_merge)) +
                                files_to_treat_after_merging + [output_file, ])
         print_in_file(cdo_command, output_file=test)
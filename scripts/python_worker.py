@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A warm worker for running Python operator scripts, used by climaf.python_workers
+
+Usage : python_worker.py [module ...]
+
+The worker imports the modules given as arguments (those which cannot be imported
+are ignored), and then reads requests on its standard input, one JSON dict per line,
+with keys :
+
+ - argv : the script path, followed by its arguments
+ - cwd : the directory where to run the script
+ - env : the environment variables for the script
+ - log : the file where to append the script standard output and error
+
+For each request, the worker forks : the child runs the script as __main__ (thus
+benefiting from the modules already imported), and the worker answers on its
+standard output with a JSON dict having key 'returncode'. Each script runs in its
+own process, so that it cannot alter the worker state
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import runpy
+import traceback
+import importlib
+
+
+def run_script(request):
+    # Runs in the forked child : never returns
+    code = 1
+    try:
+        log_fd = os.open(request["log"], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        script = request["argv"][0]
+        sys.argv = list(request["argv"])
+        sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+        runpy.run_path(script, run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def serve(modules):
+    # Keep a private copy of stdout for answers, so that what is printed when importing
+    # modules does not interfere with them
+    answers = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            pass
+    answers.write(json.dumps({"ready": True}) + "\n")
+    answers.flush()
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            break
+        pid = os.fork()
+        if pid == 0:
+            run_script(request)
+        _, status = os.waitpid(pid, 0)
+        if os.WIFEXITED(status):
+            returncode = os.WEXITSTATUS(status)
+        else:
+            returncode = -os.WTERMSIG(status)
+        answers.write(json.dumps({"returncode": returncode}) + "\n")
+        answers.flush()
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1:])
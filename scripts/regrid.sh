@@ -8,9 +8,10 @@ Only variable VARIABLE is kept in output
 
 If grids are the same, do not interpolate (because otherwise, CDO 
 generate diffs)
-No effort to optimize (e.g. by using pre-computed weights) yet !
+Interpolation weights are cached in \$CLIMAF_REGRID_WEIGHTS (see regrid_weights.sh)
 "
 set -ex
+. $(dirname $0)/regrid_weights.sh
 fieldin=$1
 gridfield=$2
 fieldout=$3
@@ -23,11 +24,12 @@ if [ -f $gridfield ] ; then
     # interpolate only if input grid is not the same as target grid
     cdo griddes $fieldin > climaf_tmp_input_grid_$$
     if ! diff -q climaf_tmp_target_grid_$$ climaf_tmp_input_grid_$$ ; then
-	interpolator="$option,climaf_tmp_target_grid_$$"
+	remap_with_weights $option climaf_tmp_target_grid_$$ $fieldin $fieldout $var climaf_tmp_input_grid_$$
+    else
+	cdo selname,$var $fieldin $fieldout
     fi
-    cdo $interpolator -selname,$var $fieldin $fieldout 
     rm climaf_tmp_*_grid_$$
 else
     grid=$gridfield
-    cdo $option,$grid -selname,$var $fieldin $fieldout 
+    remap_with_weights $option $grid $fieldin $fieldout $var
 fi
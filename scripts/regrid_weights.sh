@@ -0,0 +1,63 @@
+#!/bin/bash
+# Helper sourced by regrid.sh and regridll.sh : interpolation using regridding
+# weights cached in directory $CLIMAF_REGRID_WEIGHTS (as set by CliMAF, see
+# climaf.cache.set_regrid_weights_dir)
+#
+# Weights are computed once with CDO operator gen<method>, for a given source
+# grid, target grid, method, variable and missing values mask of the source
+# field (because weights depend on that mask), and then applied with 'cdo remap'.
+# The mask is that of the first time step (as used by gen<method>); it is
+# represented in the key by a digest of the field where valid values are set
+# to 1 and missing values to 0. As computing that digest reads the whole first
+# time step, the key is itself cached (in a '.key' file), by path, size,
+# modification time and inode of the source file, and by method, variable and
+# target grid, so that it is computed once per source file.
+# A weights file is first written under a temporary name and then renamed,
+# so that concurrent processes can share the weights directory
+#
+# Caching is not used if CLIMAF_REGRID_WEIGHTS is empty, or for methods which
+# have no gen* counterpart
+
+# remap_with_weights METHOD TARGET_GRID FIELDIN FIELDOUT [VARIABLE [SOURCE_GRID_DESCRIPTION]]
+#
+# Interpolate FIELDIN to FIELDOUT, with CDO remapping METHOD (e.g. remapbil),
+# on TARGET_GRID (a CDO grid name or a grid description file). Only VARIABLE
+# is kept, if provided. SOURCE_GRID_DESCRIPTION is the output of 'cdo griddes'
+# for FIELDIN, if already available
+remap_with_weights () {
+    local method=$1 target=$2 fieldin=$3 fieldout=$4 var=$5 source_grid=$6
+    local select=""
+    [ -n "$var" ] && select="-selname,$var"
+    local cached=no
+    case $method in
+	remapbil|remapbic|remapnn|remapdis|remapcon|remapcon2|remaplaf|remapycon) cached=yes ;;
+    esac
+    if [ -z "$CLIMAF_REGRID_WEIGHTS" -o $cached = no ] ; then
+	cdo $method,$target $select $fieldin $fieldout
+	return
+    fi
+    mkdir -p $CLIMAF_REGRID_WEIGHTS
+    local key keyfile
+    keyfile=$CLIMAF_REGRID_WEIGHTS/${method}_$( {
+	readlink -f $fieldin
+	stat -L -c "%s %Y %i" $fieldin
+	if [ -f $target ] ; then cat $target ; else echo $target ; fi
+	echo $method $var
+    } | md5sum | cut -c1-32 ).key
+    [ -f $keyfile ] && key=$(cat $keyfile)
+    if [ -z "$key" ] ; then
+	key=$( {
+	    if [ -n "$source_grid" -a -f "$source_grid" ] ; then cat $source_grid ; else cdo -s griddes $fieldin ; fi
+	    if [ -f $target ] ; then cat $target ; else echo $target ; fi
+	    echo $method $var
+	    cdo -s output -setmisstoc,0 -setrtoc,-1e+300,1e+300,1 -seltimestep,1 $select $fieldin | md5sum
+	} | md5sum | cut -c1-32 )
+	echo $key > $keyfile.tmp_$$ && mv -f $keyfile.tmp_$$ $keyfile
+    fi
+    local weights=$CLIMAF_REGRID_WEIGHTS/${method}_$key.weights
+    if [ ! -f $weights ] ; then
+	cdo gen${method#remap},$target $select $fieldin $weights.tmp_$$
+	mv -f $weights.tmp_$$ $weights
+    fi
+    cdo remap,$target,$weights $select $fieldin $fieldout
+}
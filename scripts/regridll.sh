@@ -3,9 +3,11 @@ doc="
 $0 FIELDIN FIELDOUT GRIDNAME LATMIN LATMAX LONMIN LONMAX REMAP_OPTION
 
 Interpolate FIELDIN as FIELDOUT on a box of a regular latlon grid 
+Interpolation weights are cached in \$CLIMAF_REGRID_WEIGHTS (see regrid_weights.sh)
 
 "
 set -ex
+. $(dirname $0)/regrid_weights.sh
 fieldin=$1
 fieldout=$2
 gridname=$3
@@ -23,7 +25,7 @@ cdo sellonlatbox,$lonmin,$lonmax,$latmin,$latmax tmp_grid_$$.nc tmp_grid_llb_$$.
 cdo griddes tmp_grid_llb_$$.nc > climaf_tmp_grid_$$
 
 # Regrid 
-cdo $option,climaf_tmp_grid_$$ $fieldin $fieldout 
+remap_with_weights $option climaf_tmp_grid_$$ $fieldin $fieldout
 
 # Cleanup
 rm tmp_grid_*$$.nc  climaf_tmp_grid_$$
@@ -67,9 +67,11 @@ setup(name='climaf',
           'scripts/mtimavg.sh',
           'scripts/plot_cross_section.ncl',
           'scripts/plotmap.ncl',
+          'scripts/python_worker.py',
           'scripts/read_ncks.sh',
           'scripts/regridll.sh',
           'scripts/regrid.sh',
+          'scripts/regrid_weights.sh',
           'scripts/time_average_basics.sh',
           'scripts/wcdo.sh',
       ],
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the interpretation of cache CRS expressions : parsing them with crs_parser
+(first and memoised parse), building the corresponding CliMAF objects, and evaluating
+them as Python expressions (as was formerly done)
+
+Run it as : python benchmark_crs_parser.py [-n number_of_crs] [-b number_of_crs_to_build]
+
+CRS expressions are synthetic ones, built on datasets of project 'example'
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("CLIMAF_CHECK_DEPENDENCIES", "no")
+
+from climaf.api import *
+from climaf import crs_parser
+from climaf.crs_parser import parse_crs, crs_object
+
+
+def sample_crs(number):
+    rep = list()
+    for i in range(number):
+        dataset = "ds('example|SIMU%05d|%s|%d-%d|global|monthly')" % (i // 10, ["tas", "pr"][i % 2], 1900 + i % 100,
+                                                                     1910 + i % 100)
+        kind = i % 4
+        if kind == 0:
+            rep.append(dataset)
+        elif kind == 1:
+            rep.append("space_average(time_average(%s))" % dataset)
+        elif kind == 2:
+            rep.append("ccdo(regrid(%s,%s),operator='yearmean')" % (dataset, dataset.replace("SIMU", "REF")))
+        else:
+            rep.append("cens({'a':%s,'b':ccdo(%s,operator='sellonlatbox,0,%d,-10,10')})" % (dataset, dataset, i % 360))
+    return rep
+
+
+def per_crs_cost(crss, function):
+    start = time.time()
+    for crs in crss:
+        function(crs)
+    return (time.time() - start) / len(crss) * 1.e6, time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=100000, help="number of CRS expressions to parse")
+    parser.add_argument("-b", "--build", type=int, default=2000, help="number of CRS expressions to build objects for")
+    args = parser.parse_args()
+
+    crss = sample_crs(args.number)
+    namespace = sys.modules['__main__'].__dict__
+    print("Per-CRS cost (microseconds) and total cost (s)")
+    crs_parser.forget_parsed_crs()
+    print("  parse, %7d CRS                 : %8.1f %8.2f" % ((len(crss), ) + per_crs_cost(crss, parse_crs)))
+    print("  memoised parse, %7d CRS        : %8.1f %8.2f" % ((len(crss), ) + per_crs_cost(crss, parse_crs)))
+    some = crss[0:args.build]
+    print("  build objects, %7d CRS         : %8.1f %8.2f" % ((len(some), ) + per_crs_cost(some, crs_object)))
+    print("  eval in Python, %7d CRS        : %8.1f %8.2f" %
+          ((len(some), ) + per_crs_cost(some, lambda crs: eval(crs, namespace))))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the search of a cached object which includes a requested one (see
+:py:func:`~climaf.cache.hasMatchingObject`), when the cache index holds many objects
+with the same top-level operator, with and without screening candidates on the shape
+of their CRS syntax tree (see `climaf.cache.use_shape_screening`)
+
+Each search is timed with cold memos (no parsed CRS, no CliMAF object built for
+the candidates) and with warm memos (second search)
+
+Run it as : python benchmark_matching_objects.py [-n number_of_cached_objects]
+
+CRS expressions are synthetic ones, built on datasets of project 'example'
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("CLIMAF_CHECK_DEPENDENCIES", "no")
+
+from climaf.api import *
+from climaf import cache
+from climaf.crs_parser import forget_parsed_crs
+
+
+def timed(label, function, *args):
+    start = time.time()
+    rep = function(*args)
+    print("  %-45s : %8.3f s" % (label, time.time() - start))
+    return rep
+
+
+def including(cobject):
+    return cache.hasMatchingObject(cobject, lambda a, b: a.period.includes(b.period) if
+                                   a.buildcrs(period="") == b.buildcrs(period="") else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=20000, help="number of cached objects")
+    args = parser.parse_args()
+
+    cscript("bench_copy", "cp ${in} ${out}", commuteWithTimeConcatenation=True)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Only the objects which may match need an actual file
+        cache.crs2filename.clear()
+        for i in range(args.number):
+            obj = capply("bench_copy", ds(project="example", simulation="SIMU%05d" % i, variable="tas",
+                                          period="%d-%d" % (1900 + i % 100, 1950 + i % 100)))
+            cache.crs2filename[obj.crs] = (os.path.join(tmpdir, "%d.nc" % i), cache.compute_cost())
+        target = args.number - 1
+        with open(os.path.join(tmpdir, "%d.nc" % target), "w") as f:
+            f.write("")
+        request = capply("bench_copy", ds(project="example", simulation="SIMU%05d" % target, variable="tas",
+                                          period="%d" % (1910 + target % 100)))
+
+        print("Search among %d cached objects with the same operator" % args.number)
+        results = list()
+        for screening in [False, True]:
+            cache.use_shape_screening = screening
+            forget_parsed_crs()
+            cache.crs2eval.clear()
+            label = "with" if screening else "without"
+            results.append(timed("%s screening, cold" % label, including, request))
+            timed("%s screening, warm" % label, including, request)
+        assert repr(results[0]) == repr(results[1]) and results[0][0] is not None
+    finally:
+        cache.crs2filename.clear()
+        shutil.rmtree(tmpdir)
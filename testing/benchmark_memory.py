@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the memory footprint of CliMAF's most numerous objects : periods (cperiod),
+compute costs (compute_cost) and datasets (cdataset), and of the resident set size of a
+cache index (dict crs2filename) with many entries.
+
+'legacy' figures use replicas of the former, __dict__ based, cperiod and compute_cost
+classes (with datetime bounds); 'compact' figures use the current classes
+
+Run it as : python benchmark_memory.py [-n number_of_objects] [-i number_of_index_entries]
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import datetime
+import argparse
+import resource
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("CLIMAF_CHECK_DEPENDENCIES", "no")
+
+
+class legacy_cost(object):
+    def __init__(self, cost=0., total_cost=None):
+        self.lc = cost
+        self.tc = cost if total_cost is None else total_cost
+
+
+class legacy_period(object):
+    def __init__(self, start, end, pattern):
+        self.fx = False
+        self.start = start
+        self.end = end
+        self.pattern = pattern
+
+
+def bounds(i):
+    start = datetime.datetime(1850 + i % 150, 1 + i % 12, 1)
+    return start, start + datetime.timedelta(days=30 + i % 400)
+
+
+def footprint(make, number):
+    """ Returns the mean memory size (bytes) of the objects returned by MAKE(i) """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [make(i) for i in range(number)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # Account for the list itself
+    return (size - sys.getsizeof(objects)) / len(objects)
+
+
+def index_rss(variant, entries):
+    """ Returns the growth (MB) of the maximum RSS when building a cache index with ENTRIES entries """
+    from climaf.cache import compute_cost
+    cost_class = legacy_cost if variant == "legacy" else compute_cost
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    index = dict()
+    for i in range(entries):
+        crs = "space_average(ds('CMIP6%%ACCESS-CM2%%r%di1p1f1%%tas%%%d-%d%%global'))" % (i // 1000, 1850 + i % 1000,
+                                                                                         1860 + i % 1000)
+        index[crs] = ("/cache/%02x/%034x.nc" % (i % 256, i), cost_class(1., 2.))
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=100000, help="number of objects for footprints")
+    parser.add_argument("-i", "--index", type=int, default=1000000, help="number of cache index entries")
+    parser.add_argument("--index-variant", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.index_variant:
+        print(index_rss(args.index_variant, args.index))
+        sys.exit(0)
+
+    from climaf.api import *
+    from climaf.period import cperiod
+    from climaf.cache import compute_cost
+
+    n = args.number
+    print("Per-object footprint (bytes)               legacy   compact")
+    print("  compute_cost                            %8.1f  %8.1f" %
+          (footprint(lambda i: legacy_cost(1., 2.), n), footprint(lambda i: compute_cost(1., 2.), n)))
+    print("  cperiod                                 %8.1f  %8.1f" %
+          (footprint(lambda i: legacy_period(*(bounds(i) + ("%d" % i, ))), n),
+           footprint(lambda i: cperiod(*bounds(i)), n)))
+    print("  cdataset (incl. its period and kvp)               %8.1f" %
+          footprint(lambda i: cdataset(project="example", simulation="AMIPV6ALB2G", variable="-".join(["tas", "x"]),
+                                       period="%d" % (1850 + i % 150)), n // 10))
+    print("RSS growth for a %d entries cache index (MB)" % args.index)
+    for variant in ["legacy", "compact"]:
+        rss = subprocess.check_output([sys.executable, __file__, "--index-variant", variant, "-i", str(args.index)],
+                                      universal_newlines=True)
+        print("  %-8s                                %8.1f" % (variant, float(rss.split()[-1])))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the per-file cost of inspecting NetCDF files headers with netcdfbasics :
+opening files with xarray, reading headers with netCDF4, and using the file metadata cache
+
+Run it as : python benchmark_netcdfbasics.py [-n number_of_files] [file ...]
+
+If no file is provided, sample files are created in a temporary directory
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+import argparse
+
+import netCDF4
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("CLIMAF_CHECK_DEPENDENCIES", "no")
+
+from climaf import netcdfbasics, file_metadata
+from climaf.file_metadata import metadata_cache
+
+
+def create_sample_files(dirname, number):
+    rep = list()
+    for i in range(number):
+        filename = os.path.join(dirname, "tas_%04d.nc" % i)
+        with netCDF4.Dataset(filename, "w") as dataset:
+            dataset.createDimension("time", None)
+            dataset.createDimension("lat", 90)
+            dataset.createDimension("lon", 180)
+            dataset.setncattr("model_id", "sample")
+            dataset.createVariable("time", "f8", ("time", )).units = "days since 2000-01-01"
+            dataset.createVariable("lat", "f4", ("lat", )).axis = "Y"
+            dataset.createVariable("lon", "f4", ("lon", )).axis = "X"
+            tas = dataset.createVariable("tas", "f4", ("time", "lat", "lon"))
+            tas.units = "K"
+            tas[0:12, :, :] = 280.
+        rep.append(filename)
+    return rep
+
+
+def per_file_cost(files, function):
+    start = time.time()
+    for filename in files:
+        function(filename)
+    return (time.time() - start) / len(files) * 1000.
+
+
+def inspect(filename):
+    netcdfbasics.varsOfFile(filename)
+    netcdfbasics.fileHasVar(filename, "tas")
+    netcdfbasics.fileHasDim(filename, "lat")
+    netcdfbasics.attrOfFile(filename, "model_id")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=200, help="number of sample files to create")
+    parser.add_argument("files", nargs="*", help="NetCDF files to inspect")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        files = args.files or create_sample_files(tmpdir, args.number)
+        file_metadata.metadata = metadata_cache(os.path.join(tmpdir, "metadata.sqlite"))
+        print("Per-file cost (ms) of varsOfFile + fileHasVar + fileHasDim + attrOfFile, on %d files"
+              % len(files))
+        file_metadata.use_metadata_cache = False
+        netcdfbasics.use_netcdf4_headers = False
+        print("  xarray, one open per call      : %8.3f" % per_file_cost(files, inspect))
+        netcdfbasics.use_netcdf4_headers = True
+        print("  netCDF4 header, one per call   : %8.3f" % per_file_cost(files, inspect))
+        file_metadata.use_metadata_cache = True
+        print("  netCDF4 header, cache filling  : %8.3f" % per_file_cost(files, inspect))
+        print("  in-memory cache                : %8.3f" % per_file_cost(files, inspect))
+        file_metadata.metadata = metadata_cache(file_metadata.metadata.filename)
+        print("  persistent cache (new session) : %8.3f" % per_file_cost(files, inspect))
+        file_metadata.metadata.close()
+    finally:
+        shutil.rmtree(tmpdir)
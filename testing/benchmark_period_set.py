@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of period algebra on the periods of many (daily) files, as met when
+exploring an hourly or daily archive : sorting, merging, intersecting and grouping
+periods (see :py:class:`~climaf.period.period_set`), and getting the period covered
+by a list of filenames
+
+Run it as : python benchmark_period_set.py [-n number_of_files]
+"""
+
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("CLIMAF_CHECK_DEPENDENCIES", "no")
+
+from climaf.period import cperiod, sort_periods_list, merge_periods, intersect_periods_list, group_periods, \
+    period_from_filenames
+
+
+def timed(label, function, *args):
+    start = time.time()
+    rep = function(*args)
+    print("  %-45s : %8.3f s" % (label, time.time() - start))
+    return rep
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=50000, help="number of daily files")
+    args = parser.parse_args()
+
+    random.seed(0)
+    origin = datetime.datetime(1850, 1, 1)
+    days = list(range(args.number))
+    # Some missing days, for having gaps
+    days = [day for day in days if day % 997 != 0]
+    random.shuffle(days)
+    periods = [cperiod(origin + datetime.timedelta(days=day), origin + datetime.timedelta(days=day + 1))
+               for day in days]
+    other = [cperiod(origin + datetime.timedelta(days=day), origin + datetime.timedelta(days=day + 2))
+             for day in days if day % 3 == 0]
+    filenames = " ".join(["tas_day_%s.nc" % p.pr() for p in periods])
+    cases = [dict(model="model%d" % (i % 3), period=p) for i, p in enumerate(periods)]
+
+    print("For %d daily periods" % len(periods))
+    timed("sort_periods_list", sort_periods_list, periods)
+    merged = timed("merge_periods", merge_periods, periods)
+    timed("intersect_periods_list", intersect_periods_list, merged, merge_periods(other))
+    timed("group_periods (3 models)", group_periods, cases)
+    timed("period_from_filenames", period_from_filenames, filenames)
@@ -8,8 +8,11 @@ Test the cache module.
 from __future__ import print_function, division, unicode_literals, absolute_import
 
 
+import pickle
 import shutil
+import tempfile
 import unittest
+import zlib
 
 from tests.tools_for_tests import remove_dir_and_content
 
@@ -21,7 +24,10 @@ from climaf.cmacro import crewrite
 from climaf.cache import setNewUniqueCache, generateUniqueFileName, hash_to_path, alternate_filename, stringToPath, \
     searchFile, register, getCRS, rename, hasMatchingObject, hasIncludingObject, hasBeginObject, hasExactObject, \
     complement, cdrop, cprotect, csync, cload, cload_for_project, craz, cdump, list_cache, clist, cls, crm, cdu, cwc, \
-    rebuild, ccost, Climaf_Cache_Error
+    rebuild, ccost, Climaf_Cache_Error, stamp_netcdf, stamp_png, png_signature, _png_chunk, read_crs, \
+    crs_in_tool_output, crs_read_failure, \
+    set_regrid_weights_dir, can_append_in_place, compute_cost, crs2filename
+import climaf.cache
 from climaf.driver import cfile
 
 
@@ -40,6 +46,21 @@ class SetNewUniqueCacheTests(unittest.TestCase):
         self.assertEqual(env.environment.currentCache, tmp_directory)
         self.assertEqual(env.environment.cacheIndexFileName, tmp_directory + "/index")
 
+    def test_regrid_weights_dir(self):
+        saved = climaf.cache.regrid_weights_dir
+        try:
+            climaf.cache.regrid_weights_dir = None
+            setNewUniqueCache(tmp_directory, raz=False)
+            self.assertEqual(os.environ["CLIMAF_REGRID_WEIGHTS"], tmp_directory + "/regrid_weights")
+            set_regrid_weights_dir(tmp_directory + "/weights")
+            self.assertEqual(os.environ["CLIMAF_REGRID_WEIGHTS"], tmp_directory + "/weights")
+            set_regrid_weights_dir("")
+            self.assertEqual(os.environ["CLIMAF_REGRID_WEIGHTS"], "")
+        finally:
+            set_regrid_weights_dir(saved)
+            climaf.cache.regrid_weights_dir = saved
+            set_regrid_weights_dir()
+
     def tearDown(self):
         craz()
 
@@ -101,12 +122,90 @@ class RegisterTests(unittest.TestCase):
         craz()
 
 
+class StampInProcessTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.crs = "ccdo(ds('example|AMIPV6ALB2G|tas|1980|global|monthly'),operator='timavg')"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stamp_netcdf(self):
+        import netCDF4
+        filename = os.path.join(self.tmpdir, "file.nc")
+        with netCDF4.Dataset(filename, "w") as dataset:
+            dataset.createDimension("x", 2)
+        self.assertTrue(stamp_netcdf(filename, self.crs))
+        with netCDF4.Dataset(filename) as dataset:
+            self.assertEqual(dataset.getncattr("CRS_def"), self.crs)
+            self.assertIn("CliMAF", dataset.ncattrs())
+        self.assertEqual(read_crs(filename), self.crs)
+        self.assertFalse(stamp_netcdf(os.path.join(self.tmpdir, "missing.nc"), self.crs))
+
+    def test_stamp_png(self):
+        filename = os.path.join(self.tmpdir, "file.png")
+        with open(filename, "wb") as f:
+            f.write(png_signature + _png_chunk(b"IHDR", b"\0\0\0\1\0\0\0\1\x08\0\0\0\0") +
+                    _png_chunk(b"IDAT", zlib.compress(b"\0\0")) + _png_chunk(b"IEND", b""))
+        self.assertTrue(stamp_png(filename, "old"))
+        self.assertTrue(stamp_png(filename, self.crs))
+        with open(filename, "rb") as f:
+            content = f.read()
+        self.assertEqual(content.count(b"tEXtCRS_def"), 1)
+        self.assertIn(b"tEXtCRS_def\0" + self.crs.encode("latin-1"), content)
+        self.assertTrue(content.endswith(_png_chunk(b"IEND", b"")))
+        self.assertEqual(read_crs(filename), self.crs)
+        with open(filename, "wb") as f:
+            f.write(b"not a png")
+        self.assertFalse(stamp_png(filename, self.crs))
+
+    def test_read_crs_pdf(self):
+        filename = os.path.join(self.tmpdir, "file.pdf")
+        with open(filename, "w") as f:
+            f.write("%%PDF-1.4\n1 0 obj\n<< /Keywords (old) >>\nendobj\n"
+                    "2 0 obj\n<< /Keywords (cpage\\(ds\\('a'\\)\\)) /Creator (pdftk) >>\nendobj\n")
+        self.assertEqual(read_crs(filename), "cpage(ds('a'))")
+
+
 class GetCRSTests(unittest.TestCase):
 
-    @unittest.skipUnless(False, "The test is not written")
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
     def test_getCRS(self):
-        # TODO: Implement the tests for this function
-        pass
+        filename = os.path.join(self.tmpdir, "file.png")
+        with open(filename, "wb") as f:
+            f.write(png_signature + _png_chunk(b"IHDR", b"\0\0\0\1\0\0\0\1\x08\0\0\0\0") +
+                    _png_chunk(b"IDAT", zlib.compress(b"\0\0")) + _png_chunk(b"IEND", b""))
+        # A file without CRS
+        self.assertEqual(read_crs(filename), "")
+        self.assertEqual(getCRS(filename), "")
+        stamp_png(filename, "cpage(ds('a'))")
+        self.assertEqual(getCRS(filename), "cpage(ds('a'))")
+
+    def test_unreadable(self):
+        # A file which metadata cannot be read is not taken for a file without CRS
+        filename = os.path.join(self.tmpdir, "file.png")
+        with open(filename, "wb") as f:
+            f.write(b"not a png")
+        self.assertIsNone(read_crs(filename))
+        saved = os.environ["PATH"]
+        os.environ["PATH"] = self.tmpdir
+        try:
+            self.assertEqual(getCRS(filename), crs_read_failure)
+        finally:
+            os.environ["PATH"] = saved
+
+    def test_crs_in_tool_output(self):
+        self.assertEqual(crs_in_tool_output("a.nc", "netcdf a {\n\t\t:CRS_def = \"ccdo(ds(\\'a\\'))\" ;\n}"),
+                         "ccdo(ds('a'))")
+        self.assertEqual(crs_in_tool_output("a.nc", "netcdf a {\n}"), "")
+        self.assertEqual(crs_in_tool_output("a.png", "  Properties:\n    CRS_def: cpage(ds('a'))\n"), "cpage(ds('a'))")
+        self.assertEqual(crs_in_tool_output("a.pdf", "Creator: pdftk\nKeywords:  cpage(ds('a:b'))"), "cpage(ds('a:b'))")
 
     def tearDown(self):
         craz()
@@ -167,6 +266,17 @@ class HasExactObjectTests(unittest.TestCase):
         craz()
 
 
+def write_series(filename, start, length, unlimited=True):
+    import netCDF4
+    with netCDF4.Dataset(filename, "w") as f:
+        f.createDimension("time", None if unlimited else length)
+        time = f.createVariable("time", "f8", ("time",))
+        time.units = "days since 2000-01-01"
+        tas = f.createVariable("tas", "f4", ("time",))
+        time[:] = range(start, start + length)
+        tas[:] = range(start, start + length)
+
+
 class ComplementTests(unittest.TestCase):
 
     @unittest.skipUnless(False, "The test is not written")
@@ -174,6 +284,84 @@ class ComplementTests(unittest.TestCase):
         # TODO: Implement the tests for this function
         pass
 
+    def test_can_append_in_place(self):
+        filename = tmp_directory + "/series.nc"
+        write_series(filename, 0, 3)
+        self.assertTrue(can_append_in_place(filename))
+        saved = climaf.cache.append_in_place
+        climaf.cache.append_in_place = False
+        self.assertFalse(can_append_in_place(filename))
+        climaf.cache.append_in_place = saved
+        os.chmod(filename, 0o444)
+        self.assertFalse(can_append_in_place(filename))
+        os.remove(filename)
+        write_series(filename, 0, 3, unlimited=False)
+        self.assertFalse(can_append_in_place(filename))
+        os.remove(filename)
+
+    @unittest.skipUnless(shutil.which("ncrcat"), "ncrcat is not available")
+    def test_complement_in_place(self):
+        import netCDF4
+        for crs, start, length in [("begin", 0, 3), ("end", 3, 2)]:
+            filename = generateUniqueFileName(crs)
+            write_series(filename, start, length)
+            register(filename, crs, compute_cost(1.))
+        fileb = crs2filename["begin"][0]
+        filet, costs = complement("begin", "end", "whole")
+        self.assertEqual(filet, generateUniqueFileName("whole"))
+        self.assertEqual(crs2filename["whole"][0], filet)
+        self.assertNotIn("begin", crs2filename)
+        self.assertNotIn("end", crs2filename)
+        self.assertFalse(os.path.exists(fileb))
+        self.assertEqual(getCRS(filet), "whole")
+        with netCDF4.Dataset(filet) as f:
+            self.assertEqual(list(f["tas"][:]), [0, 1, 2, 3, 4])
+
+    def test_complement_moves_begin(self):
+        # The begin object file is moved, not copied, before appending to it
+        for crs, start, length in [("begin", 0, 3), ("end", 3, 2)]:
+            filename = generateUniqueFileName(crs)
+            write_series(filename, start, length)
+            register(filename, crs, compute_cost(1.))
+        inode = os.stat(crs2filename["begin"][0]).st_ino
+        bindir = tempfile.mkdtemp(dir=tmp_directory)
+        with open(os.path.join(bindir, "ncrcat"), "w") as f:
+            f.write("#!/bin/sh\nexit 0\n")
+        os.chmod(os.path.join(bindir, "ncrcat"), 0o755)
+        saved = os.environ["PATH"]
+        os.environ["PATH"] = bindir + os.pathsep + saved
+        try:
+            filet, costs = complement("begin", "end", "whole")
+        finally:
+            os.environ["PATH"] = saved
+        self.assertEqual(os.stat(filet).st_ino, inode)
+        self.assertNotIn("begin", crs2filename)
+        self.assertNotIn("end", crs2filename)
+
+    def test_complement_failure(self):
+        # A failed append leaves the begin object untouched and indexed
+        for crs, start, length in [("begin", 0, 3), ("end", 3, 2)]:
+            filename = generateUniqueFileName(crs)
+            write_series(filename, start, length)
+            register(filename, crs, compute_cost(1.))
+        fileb = crs2filename["begin"][0]
+        with open(fileb, "rb") as f:
+            content = f.read()
+        saved = os.environ["PATH"]
+        os.environ["PATH"] = tmp_directory
+        try:
+            filet, costs = complement("begin", "end", "whole")
+        finally:
+            os.environ["PATH"] = saved
+        self.assertIsNone(filet)
+        self.assertEqual(crs2filename["begin"][0], fileb)
+        with open(fileb, "rb") as f:
+            self.assertEqual(f.read(), content)
+        # No temporary file is left
+        dirname, basename = os.path.split(generateUniqueFileName("whole"))
+        root = os.path.splitext(basename)[0]
+        self.assertEqual([f for f in os.listdir(dirname) if f.startswith(root)], [])
+
     def tearDown(self):
         craz()
 
@@ -407,6 +595,23 @@ class RebuildTests(unittest.TestCase):
         craz()
 
 
+class ComputeCostTests(unittest.TestCase):
+
+    def test_slots(self):
+        cost = compute_cost(2., 5.)
+        self.assertFalse(hasattr(cost, "__dict__"))
+        cost.increment(1.)
+        self.assertEqual((cost.lc, cost.tc), (1., 6.))
+
+    def test_pickle(self):
+        cost = pickle.loads(pickle.dumps(compute_cost(2., 5.)))
+        self.assertEqual((cost.lc, cost.tc), (2., 5.))
+        # Indexes written before compute_cost had slots
+        cost = compute_cost.__new__(compute_cost)
+        cost.__setstate__(dict(lc=1., tc=3.))
+        self.assertEqual((cost.lc, cost.tc), (1., 3.))
+
+
 class CCostTest(unittest.TestCase):
     def test_ccost(self):
         rst = ds(project="example", simulation="AMIPV6ALB2G",
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the cache quota and eviction functions.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+from env.environment import *
+import env.environment
+from climaf import cache
+from climaf.utils import Climaf_Cache_Error
+from climaf.cache import compute_cost, parse_size, set_quota, evict, use_files, release_files, register
+
+
+class ParseSizeTests(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size(1000), 1000)
+        self.assertEqual(parse_size("300k"), 300 * 1024)
+        self.assertEqual(parse_size("500G"), 500 * 1024 ** 3)
+        self.assertEqual(parse_size("1.5M"), int(1.5 * 1024 ** 2))
+        with self.assertRaises(Climaf_Cache_Error):
+            parse_size("a lot")
+
+
+class EvictionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stamping = cache.stamping
+        cache.stamping = False
+        self.previous_cache = env.environment.currentCache
+        self.tmpdir = tempfile.mkdtemp()
+        cache.setNewUniqueCache(self.tmpdir, raz=False)
+        self.index = cache.crs2filename.copy()
+        cache.crs2filename.clear()
+
+    def tearDown(self):
+        set_quota(None)
+        cache.crs2filename.clear()
+        cache.crs2filename.update(self.index)
+        cache.setNewUniqueCache(self.previous_cache, raz=False)
+        cache.stamping = self.stamping
+        for root, dirs, files in os.walk(self.tmpdir):
+            for name in files:
+                os.chmod(os.path.join(root, name), stat.S_IWUSR | stat.S_IRUSR)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def add(self, name, size, tc=0.):
+        crs = "evict_test(ds('%s'))" % name
+        filename = os.path.join(self.tmpdir, "%s.nc" % name)
+        tmpname = filename + ".tmp"
+        with open(tmpname, "w") as f:
+            f.write("x" * size)
+        self.assertTrue(register(tmpname, crs, compute_cost(tc, tc), outfilename=filename))
+        return crs, filename
+
+    def test_score_ranking(self):
+        big, _ = self.add("big", 4000)
+        expensive, _ = self.add("expensive", 4000, tc=1000.)
+        small, _ = self.add("small", 1000)
+        for crs in [big, expensive, small]:
+            cache.crs_last_access[crs] = time.time() - 100.
+        evicted = evict(target=5500)
+        self.assertEqual(evicted, [big])
+        self.assertNotIn(big, cache.crs2filename)
+        self.assertIn(expensive, cache.crs2filename)
+
+    def test_protected_and_in_use(self):
+        protected, protected_file = self.add("protected", 4000)
+        in_use, in_use_file = self.add("in_use", 4000)
+        other, _ = self.add("other", 1000)
+        os.chmod(protected_file, stat.S_IRUSR)
+        use_files([in_use_file + " " + protected_file])
+        try:
+            self.assertEqual(evict(target=0), [other])
+        finally:
+            release_files([in_use_file + " " + protected_file])
+        self.assertEqual(cache.files_in_use, dict())
+        self.assertEqual(evict(target=0), [in_use])
+        self.assertTrue(os.path.exists(protected_file))
+
+    def test_quota_at_register(self):
+        first, first_file = self.add("first", 3000)
+        cache.crs_last_access[first] = time.time() - 100.
+        set_quota(5000)
+        self.assertIn(first, cache.crs2filename)
+        second, _ = self.add("second", 3000)
+        self.assertNotIn(first, cache.crs2filename)
+        self.assertFalse(os.path.exists(first_file))
+        self.assertIn(second, cache.crs2filename)
+        self.assertEqual(cache.cache_size, 3000)
+
+    def test_quota_smaller_than_result(self):
+        old, old_file = self.add("old", 1000)
+        set_quota(10000)
+        # The result just registered is never evicted, even if it exceeds the quota alone
+        new, new_file = self.add("new", 20000)
+        self.assertTrue(os.path.exists(new_file))
+        self.assertIn(new, cache.crs2filename)
+        self.assertNotIn(old, cache.crs2filename)
+        self.assertFalse(os.path.exists(old_file))
+        self.assertEqual(evict(keep=[new]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
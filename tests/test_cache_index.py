@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the cache_index module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from env.environment import *
+from climaf import cache
+from climaf.cache import compute_cost
+from climaf.cache_index import sqlite_index, crs_hash, crs_operator, skeleton_index, object_period, object_skeleton
+from climaf.classes import ds
+from climaf.driver import capply
+from climaf.operators import cscript
+
+
+cscript('skel_copy', 'cp ${in} ${out}', commuteWithTimeConcatenation=True)
+cscript('skel_diff', 'cat ${in_1} ${in_2} > ${out}')
+
+
+class SqliteIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.tmpdir, "index.sqlite")
+        self.datafile = os.path.join(self.tmpdir, "data.nc")
+        with open(self.datafile, "w") as f:
+            f.write("some data")
+        self.index = sqlite_index(self.dbfile, compute_cost)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_crs_helpers(self):
+        self.assertEqual(crs_operator("ccdo(ds('CMIP6|...'),operator='yearmean')"), "ccdo")
+        self.assertEqual(crs_operator("ds('CMIP6|...')"), "ds")
+        self.assertEqual(len(crs_hash("ds('CMIP6|...')")), 56)
+
+    def test_insert_get_delete(self):
+        crs = "ccdo(ds('a'),operator='yearmean')"
+        self.assertTrue(self.index.is_new)
+        self.index[crs] = (self.datafile, compute_cost(1., 3.))
+        self.assertIn(crs, self.index)
+        self.assertEqual(len(self.index), 1)
+        filename, cost = self.index[crs]
+        self.assertEqual(filename, self.datafile)
+        self.assertEqual((cost.lc, cost.tc), (1., 3.))
+        self.assertEqual(list(self.index), [crs])
+        self.assertEqual(self.index.crs_with_operator("ccdo"), [crs])
+        self.assertEqual(self.index.crs_with_operator("ds"), [])
+        self.assertEqual(self.index.pop(crs)[0], self.datafile)
+        self.assertNotIn(crs, self.index)
+        with self.assertRaises(KeyError):
+            del self.index[crs]
+        self.assertIsNone(self.index.pop(crs, None))
+
+    def test_persistence_and_update(self):
+        entries = dict([("ccdo(ds('%d'))" % i, (self.datafile, compute_cost())) for i in range(10)])
+        self.index.update(entries)
+        self.index.close()
+        other = sqlite_index(self.dbfile, compute_cost)
+        self.assertFalse(other.is_new)
+        self.assertEqual(sorted(other), sorted(entries))
+        self.assertEqual(other.copy()["ccdo(ds('3'))"][0], self.datafile)
+        other.clear()
+        self.assertEqual(len(other), 0)
+        other.close()
+
+    def test_threads(self):
+        def insert(n):
+            for i in range(20):
+                self.index["ccdo(ds('%d_%d'))" % (n, i)] = (self.datafile, compute_cost())
+
+        threads = [threading.Thread(target=insert, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.index), 80)
+
+    def test_concurrent_pops(self):
+        # An entry popped by concurrent sessions is returned to only one of them
+        for i in range(20):
+            self.index["ccdo(ds('%d'))" % i] = (self.datafile, compute_cost())
+        sessions = [sqlite_index(self.dbfile, compute_cost) for _ in range(4)]
+        results = list()
+
+        def pop(session):
+            for i in range(20):
+                results.append(session.pop("ccdo(ds('%d'))" % i, None))
+            while True:
+                try:
+                    results.append(session.popitem())
+                except KeyError:
+                    break
+
+        threads = [threading.Thread(target=pop, args=(session,)) for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for session in sessions:
+            session.close()
+        self.assertEqual(len([r for r in results if r is not None]), 20)
+        self.assertEqual(len(self.index), 0)
+        self.assertRaises(KeyError, self.index.popitem)
+        self.assertRaises(KeyError, self.index.pop, "ccdo(ds('0'))")
+
+    def test_generations(self):
+        other = sqlite_index(self.dbfile, compute_cost)
+        self.index["ccdo(ds('a'))"] = (self.datafile, compute_cost())
+        generation = self.index.generation()
+        self.assertEqual(self.index.crs_since(0), (["ccdo(ds('a'))"], generation))
+        # Insertions by another session are seen, deleted entries are not
+        other["ccdo(ds('b'))"] = (self.datafile, compute_cost())
+        other["ccdo(ds('c'))"] = (self.datafile, compute_cost())
+        del other["ccdo(ds('c'))"]
+        crs_list, current = self.index.crs_since(generation)
+        self.assertEqual(crs_list, ["ccdo(ds('b'))"])
+        self.assertEqual(current, generation + 2)
+        # A replaced entry is a new one
+        other["ccdo(ds('a'))"] = (self.datafile, compute_cost(2.))
+        self.assertEqual(self.index.crs_since(current), (["ccdo(ds('a'))"], current + 1))
+        other.close()
+
+
+class SkeletonIndexTests(unittest.TestCase):
+
+    @staticmethod
+    def obj(period, simulation="AMIPV6ALB2G"):
+        return capply("skel_copy", ds(project="example", simulation=simulation, variable="tas", period=period))
+
+    def setUp(self):
+        self.index = skeleton_index()
+        self.long = self.obj("1980-1990")
+        self.index.add(self.long.crs, self.long)
+        for year in range(1950, 1970):
+            other = self.obj("%d" % year)
+            self.index.add(other.crs, other)
+        other = self.obj("1980-1990", simulation="other")
+        self.index.add(other.crs, other)
+
+    def test_object_period_and_skeleton(self):
+        self.assertEqual(repr(object_period(self.long)), "1980-1990")
+        self.assertEqual(object_skeleton(self.long), object_skeleton(self.obj("1985")))
+        ds1 = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+        ds2 = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1981")
+        self.assertIsNone(object_period(capply("skel_diff", ds1, ds2)))
+        self.assertEqual(repr(object_period(capply("skel_diff", ds1, ds1))), "1980")
+
+    def test_candidates(self):
+        self.assertEqual(len(self.index), 22)
+        self.assertEqual(self.index.candidates(self.obj("1982-1985"), "including"), [self.long.crs])
+        self.assertEqual(self.index.candidates(self.obj("1975-1985"), "including"), [])
+        self.assertEqual(self.index.candidates(self.obj("1980-1995"), "begin"), [self.long.crs])
+        self.assertEqual(self.index.candidates(self.obj("1981-1995"), "begin"), [])
+
+    def test_including_domain_candidates(self):
+        box = self.obj("1980-1990")
+        box.operands[0].domain = [0, 30, 10, 20]
+        box.operands[0].register()
+        box.register()
+        candidates = self.index.candidates(box, "including_domain")
+        self.assertIn(self.long.crs, candidates)
+        self.assertLess(len(candidates), len(self.index))
+        other = capply("skel_diff", self.obj("1980"), self.obj("1981"))
+        self.assertNotIn(self.long.crs, self.index.candidates(other, "including_domain"))
+
+    def test_discard(self):
+        self.index.discard(self.long.crs)
+        self.assertNotIn(self.long.crs, self.index)
+        self.assertEqual(self.index.candidates(self.obj("1982-1985"), "including"), [])
+        self.index.discard(self.long.crs)
+
+    def test_entries_of_other_sessions(self):
+        # With the SQLite backend, entries registered by other sessions get in the skeleton index
+        tmpdir = tempfile.mkdtemp()
+        saved = cache.crs2filename
+        try:
+            cache.crs2filename = sqlite_index(os.path.join(tmpdir, "index.sqlite"), compute_cost)
+            cache.reset_skeletons()
+            self.assertEqual(cache.skeleton_candidates(self.obj("1982-1985"), "including"), [])
+            other = sqlite_index(os.path.join(tmpdir, "index.sqlite"), compute_cost)
+            other[self.long.crs] = (os.path.join(tmpdir, "long.nc"), compute_cost())
+            other.close()
+            self.assertEqual(cache.skeleton_candidates(self.obj("1982-1985"), "including"), [self.long.crs])
+        finally:
+            cache.crs2filename.close()
+            cache.crs2filename = saved
+            cache.reset_skeletons()
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the cdo_fusion module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import unittest
+
+from env.environment import *
+from climaf import cdo_fusion
+from climaf.classes import ds, ctree
+from climaf.operators_scripts import scriptFlags
+from climaf.cdo_fusion import parse_cdo_command, is_fusable, operator_string, input_operands, shared_objects, \
+    chain
+
+
+class script_description(object):
+    # The attributes of a CDO cscript which are used for fusion (CDO may not be available
+    # for declaring actual scripts)
+    def __init__(self, command, inputs):
+        self.command = command
+        self.inputs = inputs
+        self.outputs = {None: "%s", "": "%s"}
+        self.outputFormat = "nc"
+        self.flags = scriptFlags()
+
+
+fusion_scripts = {
+    "fusion_cdo": script_description("cdo ${!operator} ${in} ${out}", {0: ("in", False, False)}),
+    "fusion_sub": script_description("cdo sub ${in_1} ${in_2} ${out}",
+                                     {1: ("in_1", False, False), 2: ("in_2", False, False)}),
+    "fusion_flip": script_description("cdo ${!operator} ${in_2} ${in_1} ${out}",
+                                      {1: ("in_1", False, False), 2: ("in_2", False, False)}),
+    "fusion_level": script_description("cdo sellevel,${level} ${in} ${out}", {0: ("in", False, False)}),
+    "fusion_select": script_description("mcdo.py --operator=${operator} --output_file=${out} ${ins}",
+                                        {0: ("ins", False, True)}),
+}
+
+
+class CdoFusionTests(unittest.TestCase):
+
+    def setUp(self):
+        cscripts.update(fusion_scripts)
+        self.materialize = cdo_fusion.materialize
+        self.ds1 = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+        self.ds2 = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1981")
+        self.evaluated = list()
+
+    def tearDown(self):
+        cdo_fusion.materialize = self.materialize
+        for name in fusion_scripts:
+            cscripts.pop(name)
+
+    @staticmethod
+    def call(script_name, *operands, **parameters):
+        return ctree(script_name, cscripts[script_name], *operands, **parameters)
+
+    def evaluate(self, op, call):
+        self.evaluated.append(op)
+        return "file%d.nc" % len(self.evaluated)
+
+    def test_parse_cdo_command(self):
+        self.assertEqual(parse_cdo_command("cdo ${!operator} ${in} ${out}"), ("${!operator}", ["in"]))
+        self.assertEqual(parse_cdo_command("cdo sub ${in_1} ${in_2} ${out}"), ("sub", ["in_1", "in_2"]))
+        self.assertIsNone(parse_cdo_command("cdo ${!operator} ${mmin} ${out}"))
+        self.assertIsNone(parse_cdo_command("cdo -O timmean ${in} ${out}"))
+        self.assertIsNone(parse_cdo_command("mcdo.py --operator=${operator} ${ins}"))
+
+    def test_operator_string(self):
+        level = self.call("fusion_level", self.ds1, level=850)
+        self.assertEqual(operator_string(level), "sellevel,850")
+        self.assertTrue(is_fusable(level))
+        self.assertFalse(is_fusable(self.call("fusion_cdo", self.ds1)))
+        self.assertFalse(is_fusable(self.call("fusion_cdo", self.ds1, operator="timmean -fldmean")))
+        self.assertFalse(is_fusable(self.call("fusion_select", self.ds1, operator="timmean")))
+        flip = self.call("fusion_flip", self.ds1, self.ds2, operator="ifthen")
+        self.assertEqual(input_operands(flip), [self.ds2, self.ds1])
+
+    def test_chain(self):
+        level = self.call("fusion_level", self.ds1, level=850)
+        mean = self.call("fusion_cdo", level, operator="timmean")
+        self.assertEqual(chain(mean, self.evaluate, lambda op: False, set()),
+                         "-timmean -sellevel,850 file1.nc")
+        self.assertEqual(self.evaluated, [self.ds1])
+        # A cached operand is not fused
+        self.assertEqual(chain(mean, self.evaluate, lambda op: op is level, set()), "-timmean file2.nc")
+        self.assertEqual(self.evaluated[-1], level)
+
+    def test_shared_objects(self):
+        mean = self.call("fusion_cdo", self.call("fusion_level", self.ds1, level=850), operator="timmean")
+        other_mean = self.call("fusion_cdo", self.call("fusion_level", self.ds1, level=850), operator="timmean")
+        diff = self.call("fusion_sub", self.call("fusion_cdo", mean, operator="fldmean"), mean)
+        self.assertEqual(shared_objects(diff), {mean.crs})
+        self.assertEqual(chain(other_mean, self.evaluate, lambda op: False, shared_objects(diff)), None)
+        cdo_fusion.materialize = "none"
+        self.assertEqual(chain(other_mean, self.evaluate, lambda op: False, shared_objects(diff)),
+                         "-timmean -sellevel,850 file1.nc")
+
+    def test_multiple_files(self):
+        mean = self.call("fusion_cdo", self.ds1, operator="timmean")
+        self.assertIsNone(chain(mean, lambda op, call: "a.nc b.nc", lambda op: False, set()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,8 @@ from __future__ import print_function, division, unicode_literals, absolute_impo
 
 
 import os
+import copy
+import threading
 import unittest
 
 from tests.tools_for_tests import remove_dir_and_content
@@ -16,7 +18,7 @@ from env.environment import *
 from env.site_settings import atCNRM, onCiclad, onSpirit, atTGCC, onObelix
 from climaf.cache import setNewUniqueCache, craz
 from climaf.classes import cproject, cdef, Climaf_Classes_Error, cobject, cdummy, processDatasetArgs, cdataset, \
-    calias, crealms
+    calias, crealms, cens, ctree, without_data_check
 from climaf.period import Climaf_Period_Error, init_period
 
 
@@ -450,6 +452,35 @@ class CdatasetTests(unittest.TestCase):
         # TODO: Write the test
         pass
 
+    def test_without_data_check(self):
+        import env.environment
+        saved = env.environment.data_check
+        env.environment.data_check = True
+        kwargs = dict(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1700")
+        try:
+            with self.assertRaises(Climaf_Classes_Error):
+                cdataset(**kwargs)
+            raised = list()
+
+            def other_thread():
+                try:
+                    cdataset(**kwargs)
+                except Climaf_Classes_Error:
+                    raised.append(True)
+
+            with without_data_check():
+                cdataset(**kwargs)
+                self.assertTrue(env.environment.data_check)
+                # Other threads still check datasets
+                thread = threading.Thread(target=other_thread)
+                thread.start()
+                thread.join()
+            self.assertEqual(raised, [True])
+            with self.assertRaises(Climaf_Classes_Error):
+                cdataset(**kwargs)
+        finally:
+            env.environment.data_check = saved
+
     def tearDown(self):
         craz()
 
@@ -471,10 +502,16 @@ class CensTests(unittest.TestCase):
         # TODO: Write the test
         pass
 
-    @unittest.skipUnless(False, "Test not yet written")
     def test_cens_setitem(self):
-        # TODO: Write the test
-        pass
+        tas = cdataset(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+        ens = cens({"a": tas})
+        ens["b"] = tas
+        ens["a"] = tas
+        self.assertEqual(ens.order, ["a", "b"])
+        self.assertEqual(ens.crs, "cens({'a':%s,'b':%s})" % (tas.crs, tas.crs))
+        copied = copy.deepcopy(ens)
+        self.assertEqual(copied.order, ["a", "b"])
+        self.assertEqual(copied.crs, ens.crs)
 
     @unittest.skipUnless(False, "Test not yet written")
     def test_cens_items(self):
@@ -486,10 +523,11 @@ class CensTests(unittest.TestCase):
         # TODO: Write the test
         pass
 
-    @unittest.skipUnless(False, "Test not yet written")
     def test_cens_pop(self):
-        # TODO: Write the test
-        pass
+        tas = cdataset(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+        ens = cens({"a": tas, "b": tas})
+        self.assertEqual(ens.pop("a"), tas)
+        self.assertEqual(ens.crs, "cens({'b':%s})" % tas.crs)
 
     @unittest.skipUnless(False, "Test not yet written")
     def test_cens_clear(self):
@@ -539,20 +577,33 @@ class FdsTests(unittest.TestCase):
 
 class CtreeTests(unittest.TestCase):
 
-    @unittest.skipUnless(False, "Test not yet written")
     def test_ctree_init(self):
-        # TODO: Write the test
-        pass
+        tas = cdataset(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+        tree = ctree("an_operator", None, tas, param=1)
+        self.assertEqual(tree.crs, "an_operator(%s,param=1)" % tas.crs)
+        # Identical calls build independent objects
+        crs = tree.crs
+        other = ctree("an_operator", None, tas, param=1)
+        self.assertIsNot(other, tree)
+        other.setperiod("1981")
+        self.assertEqual(tree.crs, crs)
+        self.assertEqual(other.crs, crs.replace("1980", "1981"))
 
     @unittest.skipUnless(False, "Test not yet written")
     def test_ctree_buildcrs(self):
         # TODO: Write the test
         pass
 
-    @unittest.skipUnless(False, "Test not yet written")
     def test_ctree_setperiod(self):
-        # TODO: Write the test
-        pass
+        tas = cdataset(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+        tree = ctree("an_operator", None, ctree("another_operator", None, tas))
+        skeleton = tree.buildcrs(period="")
+        copied = copy.deepcopy(tree)
+        copied.setperiod("1981")
+        self.assertEqual(copied.crs, tree.crs.replace("1980", "1981"))
+        self.assertEqual(copied.operands[0].crs, tree.operands[0].crs.replace("1980", "1981"))
+        self.assertEqual(copied.buildcrs(period=""), skeleton)
+        self.assertEqual(tree.operands[0].operands[0].period, init_period("1980"))
 
     def tearDown(self):
         craz()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the crs_locks module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import json
+import shutil
+import time
+import socket
+import threading
+import subprocess
+import tempfile
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from env.environment import *
+from climaf import crs_locks
+from climaf.crs_locks import crs_lock, thread_lock, is_stale
+from climaf.cache import generateUniqueFileName, cdrop
+from climaf.classes import fds
+from climaf.driver import capply, cfile
+from climaf.operators import cscript
+
+
+cscript('locks_copy', 'cp ${in} ${out}')
+
+
+class CrsLockTests(unittest.TestCase):
+
+    def setUp(self):
+        self.crs = "test_crs_locks(%f)" % time.time()
+        self.saved = crs_locks.polling_period
+        crs_locks.polling_period = 0.05
+
+    def tearDown(self):
+        crs_locks.polling_period = self.saved
+        if os.path.exists(crs_locks.lock_filename(self.crs)):
+            os.remove(crs_locks.lock_filename(self.crs))
+
+    def test_acquire_release(self):
+        lock = crs_lock(self.crs)
+        self.assertFalse(lock.acquire())
+        with open(lock.filename) as f:
+            self.assertEqual(json.load(f)["pid"], os.getpid())
+        self.assertFalse(is_stale(lock.filename))
+        lock.release()
+        self.assertFalse(os.path.exists(lock.filename))
+
+    def test_wait(self):
+        events = list()
+        lock = crs_lock(self.crs)
+        lock.acquire()
+
+        def other():
+            with crs_lock(self.crs) as waited:
+                events.append(("acquired", waited))
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        time.sleep(0.3)
+        events.append(("released", None))
+        lock.release()
+        thread.join()
+        self.assertEqual(events, [("released", None), ("acquired", True)])
+
+    def test_thread_lock(self):
+        # Without cross-process locks, threads still compute an object one at a time
+        saved = crs_locks.use_crs_locks
+        crs_locks.use_crs_locks = False
+        try:
+            self.assertIsInstance(crs_locks.object_lock(self.crs), thread_lock)
+        finally:
+            crs_locks.use_crs_locks = saved
+        events = list()
+        lock = thread_lock(self.crs)
+        self.assertFalse(lock.acquire())
+
+        def other():
+            with thread_lock(self.crs) as waited:
+                events.append(("acquired", waited))
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        time.sleep(0.2)
+        events.append(("released", None))
+        lock.release()
+        thread.join()
+        self.assertEqual(events, [("released", None), ("acquired", True)])
+        self.assertNotIn(self.crs, thread_lock._locks)
+        self.assertFalse(os.path.exists(crs_locks.lock_filename(self.crs)))
+
+    def test_stale_locks(self):
+        filename = crs_locks.lock_filename(self.crs)
+        # A lock left by a dead process
+        process = subprocess.Popen(["true"])
+        process.wait()
+        with open(filename, "w") as f:
+            json.dump(dict(host=socket.gethostname(), pid=process.pid), f)
+        self.assertTrue(is_stale(filename))
+        with crs_lock(self.crs) as waited:
+            self.assertTrue(waited)
+        # A lock which was not refreshed
+        with open(filename, "w") as f:
+            json.dump(dict(host="elsewhere", pid=1), f)
+        self.assertFalse(is_stale(filename))
+        os.utime(filename, (time.time() - 2 * crs_locks.stale_lock_delay, ) * 2)
+        self.assertTrue(is_stale(filename))
+        with crs_lock(self.crs):
+            pass
+        self.assertFalse(os.path.exists(filename))
+
+
+@unittest.skipUnless(shutil.which("cdo"), "cdo is not available")
+class DeepEvaluationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "tas_1980.nc")
+        time_axis = xr.date_range("1980-01-01", periods=2, freq="MS")
+        tas = xr.DataArray(np.arange(2.), dims=("time", ), coords=dict(time=time_axis), name="tas")
+        tas.to_dataset().to_netcdf(self.filename, unlimited_dims=["time"])
+        self.saved = crs_locks.use_crs_locks, crs_locks.polling_period
+        crs_locks.use_crs_locks = True
+        crs_locks.polling_period = 0.05
+
+    def tearDown(self):
+        crs_locks.use_crs_locks, crs_locks.polling_period = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def evaluate_while_locked(self, obj, deep):
+        # Evaluates OBJ while another evaluation holds its lock, and leaves a file in cache
+        results = list()
+        lock = crs_lock(obj.crs)
+        lock.acquire()
+        thread = threading.Thread(target=lambda: results.append(cfile(obj, deep=deep)))
+        thread.start()
+        time.sleep(0.5)
+        filename = generateUniqueFileName(obj.crs)
+        with open(filename, "w") as f:
+            f.write("other")
+        lock.release()
+        thread.join()
+        with open(results[0], "rb") as f:
+            content = f.read()
+        cdrop(obj)
+        return content
+
+    def test_deep(self):
+        obj = capply("locks_copy", fds(self.filename, variable="tas", period="1980"))
+        # A deep evaluation does not use the object computed meanwhile by another evaluation
+        self.assertNotEqual(self.evaluate_while_locked(obj, True), b"other")
+        self.assertEqual(self.evaluate_while_locked(obj, None), b"other")
+
+
+if __name__ == '__main__':
+    unittest.main()
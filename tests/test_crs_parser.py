@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the crs_parser module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import unittest
+
+from env.environment import *
+from climaf.utils import Climaf_Error
+from climaf.classes import ds, cens, cpage, cdummy
+from climaf.driver import capply
+from climaf.operators import cscript
+from climaf.crs_parser import parse_crs, crs_object, crs_dataset, crs_call, crs_child, crs_arg, crs_list, \
+    crs_dict, parsed_crs, crs_shape, crs_shapes
+
+
+cscript('parse_copy', 'cp ${in} ${out}')
+cscript('parse_split', 'echo ${param} ; cp ${in} ${out} ; cp ${in} ${out_second}')
+
+
+class ParseCrsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tas = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+
+    def test_dataset(self):
+        node = parse_crs(self.tas.crs)
+        self.assertIsInstance(node, crs_dataset)
+        self.assertEqual(node.project, "example")
+        self.assertEqual(node.kvp["simulation"], "AMIPV6ALB2G")
+        self.assertEqual(node.kvp["period"], "1980")
+        # Datasets of undeclared projects are not resolved, and not memoised
+        node = parse_crs("ds('unknown.a.b')")
+        self.assertIsNone(node.project)
+        self.assertNotIn("ds('unknown.a.b')", parsed_crs)
+
+    def test_call(self):
+        crs = "parse_copy(ARG,list=[1, -2.5e3],string='a\\'b',tuple=(1,),flag=True).out"
+        node = parse_crs(crs)
+        self.assertEqual(node, crs_child(crs_call("parse_copy", (crs_arg(), ),
+                                                  (("flag", True), ("list", crs_list((1, -2500.))),
+                                                   ("string", "a'b"), ("tuple", (1, )))), "out"))
+        self.assertIs(parse_crs(crs), node)
+        node = parse_crs("cens({'a':ARG,'b':None})")
+        self.assertEqual(node.operands, (crs_dict((("a", crs_arg()), ("b", None))), ))
+
+    def test_invalid(self):
+        for crs in ["__import__('os').system('ls')+1", "parse_copy(", "ds(1)", "f(a=1,2)", "f(1) g(2)"]:
+            self.assertRaises(Climaf_Error, parse_crs, crs)
+        # No Python code is evaluated
+        self.assertEqual(parse_crs("__import__('os')").operator, "__import__")
+        self.assertIsNone(crs_object("__import__('os')"))
+
+
+class CrsObjectTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tas = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+
+    def test_round_trip(self):
+        copy = capply("parse_copy", self.tas)
+        objects = [self.tas, copy, capply("parse_split", copy, param=[1, 2]).second,
+                   cens({"a": self.tas, "b": copy}), cpage([[self.tas, None], [copy, self.tas]], title="t")]
+        for obj in objects:
+            rebuilt = crs_object(obj.crs)
+            self.assertIsInstance(rebuilt, type(obj))
+            self.assertEqual(rebuilt.crs, obj.crs)
+        self.assertIsInstance(crs_object("parse_copy(ARG)").operands[0], cdummy)
+
+    def test_shape(self):
+        copy = capply("parse_copy", self.tas)
+        other_period = capply("parse_copy", ds(project="example", simulation="AMIPV6ALB2G", variable="tas",
+                                               period="1981-1982", domain=[0, 10, 0, 10]))
+        other_variable = capply("parse_copy", ds(project="example", simulation="AMIPV6ALB2G", variable="pr",
+                                                 period="1980"))
+        self.assertIsNotNone(crs_shape(copy.crs))
+        self.assertEqual(crs_shape(copy.crs), crs_shape(other_period.crs))
+        self.assertNotEqual(crs_shape(copy.crs), crs_shape(other_variable.crs))
+        self.assertNotEqual(crs_shape(copy.crs), crs_shape(capply("parse_split", self.tas).crs))
+        self.assertIn(copy.crs, crs_shapes)
+        # Objects which cannot be summarised have no shape
+        for crs in ["parse_copy(ARG)", "undeclared_operator(%s)" % self.tas.crs, "parse_copy(ds('unknown.a.b'))",
+                    cens({"a": self.tas}).crs, "parse_copy("]:
+            self.assertIsNone(crs_shape(crs))
+
+    def test_unknown(self):
+        self.assertIsNone(crs_object("undeclared_operator(%s)" % self.tas.crs))
+        self.assertIsNone(crs_object("parse_copy(ds('unknown.a.b'))"))
+
+
+if __name__ == '__main__':
+    unittest.main()
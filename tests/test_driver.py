@@ -7,6 +7,9 @@ Test the driver module.
 from __future__ import print_function, division, unicode_literals, absolute_import
 
 import os
+import glob
+import tempfile
+import threading
 import unittest
 
 from tests.tools_for_tests import remove_dir_and_content
@@ -17,9 +20,9 @@ from climaf.driver import capply, capply_script, maketree, capply_operator, ceva
     ceval_operator, cstore, ceval_for_scriptChild, ceval_for_cpage, ceval_for_cpage_pdf, ceval_for_cens, \
     ceval_for_string, ceval, ceval_script, timePeriod, ceval_select, cread, cview, derive_variable, set_variable, \
     noselect, cfile, cshow, cMA, cvalue, cexport, cimport, get_fig_sizes, cfilePage, cfilePage_pdf, calias, \
-    CFlongname, efile
+    CFlongname, efile, run_script_call
 from climaf.utils import Climaf_Driver_Error
-from climaf.classes import ds
+from climaf.classes import ds, cens
 from climaf.period import Climaf_Period_Error, init_period
 
 
@@ -151,6 +154,19 @@ class CevalForCensTests(unittest.TestCase):
         # TODO: Write the test
         pass
 
+    def test_ceval_for_cens_concurrent_failures(self):
+        import climaf.driver
+        ens = cens({"1850": ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1850"),
+                    "1851": ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1851")})
+        climaf.driver.ensemble_workers = 2
+        try:
+            with self.assertRaises(Climaf_Driver_Error) as context:
+                ceval_for_cens(ens, format="file")
+            # All failed members are reported
+            self.assertIn("2 member(s)", str(context.exception))
+        finally:
+            climaf.driver.ensemble_workers = 1
+
     def tearDown(self):
         craz()
 
@@ -184,6 +200,31 @@ class CevalScriptTests(unittest.TestCase):
         # TODO: Write the test
         pass
 
+    def test_concurrent_script_outputs(self):
+        # The outputs of concurrent script calls are not interleaved in last.out
+        import climaf.driver
+        from climaf.operators import cscript
+        script = cscript("concurrent_echo", "echo ${in} > ${out}")
+        saved = climaf.driver.logdir, climaf.driver.scripts_output_write_mode
+        climaf.driver.logdir = tempfile.mkdtemp()
+        climaf.driver.scripts_output_write_mode = 'a'
+        try:
+            threads = [threading.Thread(target=run_script_call,
+                                        args=(script, None, "echo A%d; sleep 0.1; echo B%d" % (i, i)))
+                       for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            with open(os.path.join(climaf.driver.logdir, "last.out")) as f:
+                lines = [line.strip() for line in f.readlines() if line.strip()]
+            for i in range(4):
+                self.assertEqual(lines[lines.index("A%d" % i) + 1], "B%d" % i)
+            self.assertEqual(glob.glob(os.path.join(climaf.driver.logdir, "last.*.out")), [])
+        finally:
+            remove_dir_and_content(climaf.driver.logdir)
+            climaf.driver.logdir, climaf.driver.scripts_output_write_mode = saved
+
     def tearDown(self):
         craz()
 
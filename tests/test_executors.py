@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the executors module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+
+from env.environment import *
+from climaf import executors
+from climaf.executors import inline_executor, pool_executor, batch_executor, get_executor
+from climaf.utils import Climaf_Driver_Error
+
+
+class ExecutorsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, "last.out")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_log(self):
+        with open(self.log) as f:
+            return f.read()
+
+    def test_inline(self):
+        with open(self.log, "w") as logfile:
+            logfile.write("header\n")
+            inline_executor().run("echo out; echo err >&2", logfile)
+            self.assertRaises(subprocess.CalledProcessError, inline_executor().run, "exit 3", logfile)
+        self.assertEqual(self.read_log(), "header\nout\nerr\n")
+
+    def test_pool(self):
+        pool = pool_executor(1)
+        durations = list()
+
+        def run():
+            with open(os.path.join(self.tmpdir, threading.current_thread().name), "w") as logfile:
+                start = time.time()
+                pool.run("sleep 0.3", logfile)
+                durations.append(time.time() - start)
+
+        threads = [threading.Thread(target=run) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The second command waited for the first one
+        self.assertGreater(max(durations), 0.55)
+
+    def test_batch(self):
+        # A local stand-in for a batch scheduler, which runs jobs in background
+        batch = batch_executor(submit="(sh ${script} > ${log} 2>&1 &) ; echo 1234",
+                               directory=os.path.join(self.tmpdir, "jobs"), polling_period=0.05, timeout=20,
+                               status="echo ${jobid}", status_period=0.05)
+        with open(self.log, "w") as logfile:
+            batch.run("cd %s && echo $PWD; echo done > result" % self.tmpdir, logfile)
+        self.assertEqual(self.read_log(), "%s\n" % self.tmpdir)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, "result")))
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, "jobs")), [])
+        with open(self.log, "w") as logfile:
+            self.assertRaises(subprocess.CalledProcessError, batch.run, "echo failing; exit 2", logfile)
+        self.assertEqual(self.read_log(), "failing\n")
+        failing = batch_executor(submit="false", directory=os.path.join(self.tmpdir, "jobs"))
+        with open(self.log, "w") as logfile:
+            self.assertRaises(Climaf_Driver_Error, failing.run, "true", logfile)
+
+    def test_batch_killed_job(self):
+        # A job which the scheduler forgets about (e.g. killed) without writing its status
+        batch = batch_executor(submit="echo 'Submitted' ; echo '1234;cluster'",
+                               status="unknown_status_command ${jobid}", directory=os.path.join(self.tmpdir, "jobs"), polling_period=0.05, status_period=0.05)
+        with open(self.log, "w") as logfile:
+            start = time.time()
+            self.assertRaises(Climaf_Driver_Error, batch.run, "true", logfile)
+            self.assertLess(time.time() - start, 5)
+        self.assertFalse(batch_executor(status="true").is_alive("1234"))
+        self.assertTrue(batch_executor(status="echo ${jobid}").is_alive("1234"))
+
+    def test_get_executor(self):
+        saved = executors.script_executor
+        try:
+            executors.script_executor = "pool"
+            self.assertIsInstance(get_executor(), pool_executor)
+            executors.script_executor = batch_executor()
+            self.assertIs(get_executor(), executors.script_executor)
+            executors.script_executor = "unknown"
+            self.assertRaises(Climaf_Driver_Error, get_executor)
+        finally:
+            executors.script_executor = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
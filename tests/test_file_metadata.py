@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the file_metadata module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import netCDF4
+
+from env.environment import *
+from climaf import file_metadata
+from climaf.file_metadata import metadata_cache, file_signature
+from climaf.netcdfbasics import varsOfFile, fileHasVar, dimsOfFile, attrOfFile, timeLimits
+
+
+def write_file(filename, variable="tas", years=1):
+    with netCDF4.Dataset(filename, "w") as dataset:
+        dataset.createDimension("time", None)
+        dataset.createDimension("bnds", 2)
+        dataset.setncattr("frequency", "mon")
+        time = dataset.createVariable("time", "f8", ("time", ))
+        time.units = "days since 2000-01-01"
+        time.calendar = "360_day"
+        time.bounds = "time_bnds"
+        bounds = dataset.createVariable("time_bnds", "f8", ("time", "bnds"))
+        var = dataset.createVariable(variable, "f4", ("time", ))
+        for i in range(12 * years):
+            time[i] = 30 * i + 15
+            bounds[i, :] = [30 * i, 30 * (i + 1)]
+            var[i] = i
+
+
+class MetadataCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.previous = file_metadata.metadata
+        file_metadata.metadata = metadata_cache(os.path.join(self.tmpdir, "metadata.sqlite"))
+        self.filename = os.path.join(self.tmpdir, "data.nc")
+        write_file(self.filename)
+        self.calls = list()
+
+    def tearDown(self):
+        file_metadata.metadata.close()
+        file_metadata.metadata = self.previous
+        shutil.rmtree(self.tmpdir)
+
+    def compute(self, filename):
+        self.calls.append(filename)
+        return {"size": os.path.getsize(filename)}
+
+    def test_memory_and_persistence(self):
+        cache = file_metadata.metadata
+        value = cache.get(self.filename, "size", self.compute)
+        self.assertEqual(cache.get(self.filename, "size", self.compute), value)
+        self.assertEqual(len(self.calls), 1)
+        # Another session shares the same database
+        other = metadata_cache(cache.filename)
+        self.assertEqual(other.get(self.filename, "size", self.compute), value)
+        self.assertEqual(len(self.calls), 1)
+        other.close()
+        cache.forget(self.filename)
+        cache.get(self.filename, "size", self.compute)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_invalidation(self):
+        cache = file_metadata.metadata
+        signature = file_signature(self.filename)
+        cache.get(self.filename, "size", self.compute)
+        os.remove(self.filename)
+        write_file(self.filename, years=2)
+        self.assertNotEqual(file_signature(self.filename), signature)
+        cache.get(self.filename, "size", self.compute)
+        self.assertEqual(len(self.calls), 2)
+        self.assertIsNone(file_signature(os.path.join(self.tmpdir, "missing.nc")))
+
+    def test_forget(self):
+        cache = file_metadata.metadata
+        others = [os.path.join(self.tmpdir, "sub", "data%d.nc" % i) for i in range(3)]
+        os.makedirs(os.path.join(self.tmpdir, "sub"))
+        for filename in others:
+            write_file(filename)
+        for filename in [self.filename] + others:
+            cache.get(filename, "size", self.compute)
+        cache.forget(others[0:2])
+        cache.get(others[0], "size", self.compute)
+        cache.get(others[2], "size", self.compute)
+        self.assertEqual(len(self.calls), 5)
+        file_metadata.forget_metadata(directory=os.path.join(self.tmpdir, "sub"))
+        cache.get(self.filename, "size", self.compute)
+        cache.get(others[2], "size", self.compute)
+        self.assertEqual(len(self.calls), 6)
+
+    def test_prune_and_cap(self):
+        cache = file_metadata.metadata
+        removed = os.path.join(self.tmpdir, "removed.nc")
+        write_file(removed)
+        for filename in [removed, self.filename]:
+            cache.get(filename, "size", self.compute)
+            cache.get(filename, "dims", self.compute)
+        os.remove(removed)
+        self.assertEqual(file_metadata.prune_metadata(), 2)
+        max_entries = file_metadata.metadata_cache_max_entries
+        try:
+            file_metadata.metadata_cache_max_entries = 1
+            self.assertEqual(cache.prune(), 1)
+        finally:
+            file_metadata.metadata_cache_max_entries = max_entries
+        # The most recently written entry is kept
+        other = metadata_cache(cache.filename)
+        other.get(self.filename, "dims", self.compute)
+        other.close()
+        self.assertEqual(len(self.calls), 4)
+
+    def test_prune_period(self):
+        cache = file_metadata.metadata
+        removed = os.path.join(self.tmpdir, "removed.nc")
+        write_file(removed)
+        cache.get(removed, "size", self.compute)
+        os.remove(removed)
+        period = file_metadata.metadata_cache_prune_period
+        try:
+            # The delay starts with the first attempt, and is shared by sessions
+            self.assertIsNone(file_metadata.prune_metadata(force=False))
+            file_metadata.metadata_cache_prune_period = 0.
+            other = metadata_cache(cache.filename)
+            self.assertEqual(other.prune(force=False), 0)
+            other.close()
+            file_metadata.metadata_cache_prune_period = 3600.
+            cache.get(self.filename, "size", self.compute)
+            self.assertIsNone(cache.prune(force=False))
+        finally:
+            file_metadata.metadata_cache_prune_period = period
+        self.assertEqual(cache.prune(), 1)
+
+    def test_netcdfbasics(self):
+        self.assertEqual(varsOfFile(self.filename), ["tas"])
+        self.assertTrue(fileHasVar(self.filename, "time_bnds"))
+        self.assertFalse(fileHasVar(self.filename, "pr"))
+        self.assertEqual(dimsOfFile(self.filename), {"time": 12, "bnds": 2})
+        self.assertEqual(attrOfFile(self.filename, "frequency"), "mon")
+        self.assertEqual(attrOfFile(self.filename, "model_id", "no_model"), "no_model")
+        self.assertEqual(repr(timeLimits(self.filename)), "2000")
+        # Cached values are invalidated when the file changes
+        os.remove(self.filename)
+        write_file(self.filename, variable="pr", years=2)
+        self.assertEqual(varsOfFile(self.filename), ["pr"])
+        self.assertEqual(repr(timeLimits(self.filename)), "2000-2001")
+
+
+if __name__ == '__main__':
+    unittest.main()
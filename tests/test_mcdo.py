@@ -8,6 +8,7 @@ from __future__ import print_function, division, unicode_literals, absolute_impo
 
 
 import os
+import datetime
 import unittest
 
 from tests.tools_for_tests import remove_dir_and_content, compare_netcdf_files, compare_text_files
@@ -16,7 +17,7 @@ from env.environment import *
 from climaf.cache import setNewUniqueCache, craz
 from climaf import __path__ as rootpath
 
-from scripts.mcdo import main as mcdo_main
+from scripts.mcdo import main as mcdo_main, filename_period, files_in_period
 
 
 class McdoTests(unittest.TestCase):
@@ -65,6 +66,39 @@ class McdoTests(unittest.TestCase):
         craz()
 
 
+class FilesInPeriodTests(unittest.TestCase):
+
+    def test_filename_period(self):
+        self.assertEqual(filename_period("/data/tas_Amon_CNRM-CM5_historical_r1i1p1_185001-185912.nc"),
+                         (datetime.datetime(1850, 1, 1), datetime.datetime(1860, 1, 1)))
+        self.assertEqual(filename_period("tas_Amon_CNRM-CM5_historical_r1i1p1_1851.nc"),
+                         (datetime.datetime(1851, 1, 1), datetime.datetime(1852, 1, 1)))
+        self.assertEqual(filename_period("tas_day_CNRM-CM5_historical_r1i1p1_18500101-18501231.nc"),
+                         (datetime.datetime(1850, 1, 1), datetime.datetime(1851, 1, 1)))
+        self.assertIsNone(filename_period("AMIPV6ALB2GPL1980.nc"))
+        self.assertIsNone(filename_period("O1T04V04_SE_1850_1859_1M_icemod.nc"))
+
+    def test_files_in_period(self):
+        files = ["tas_Amon_CNRM-CM5_historical_r1i1p1_%d.nc" % year for year in range(1850, 1860)]
+        self.assertEqual(files_in_period(files, "1851-06-01T00:00:00,1853-01-01T00:00:00"), files[1:4])
+        self.assertEqual(files_in_period(files[0:2], "1900-01-01T00:00:00,1901-01-01T00:00:00"), files[0:2])
+        self.assertEqual(files_in_period(files, "1851"), files)
+
+    def test_files_in_period_unreliable(self):
+        # Files are not pruned if some name does not show a period, or if the periods
+        # read in names are not contiguous, or do not have the same format
+        period = "2019-03-01T00:00:00,2019-03-31T00:00:00"
+        files = ["tas_%d.nc" % year for year in range(2017, 2020)]
+        self.assertEqual(files_in_period(files, period), files[2:])
+        self.assertEqual(files_in_period(files + ["AMIPV6ALB2GPL1980.nc"], period), files + ["AMIPV6ALB2GPL1980.nc"])
+        versions = ["tas_20190312.nc", "tas_20190401.nc"]
+        self.assertEqual(files_in_period(versions, period), versions)
+        mixed = ["tas_2018.nc", "tas_201901-201912.nc"]
+        self.assertEqual(files_in_period(mixed, period), mixed)
+        chunks = ["tas_2017_0001.nc", "tas_2018_0003.nc"]
+        self.assertEqual(files_in_period(chunks, period), chunks)
+
+
 if __name__ == '__main__':
     # Jump into the test directory
     tmp_directory = "/".join([os.environ["HOME"], "tmp", "tests", "test_mcdo"])
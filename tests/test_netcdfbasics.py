@@ -13,7 +13,7 @@ from tests.tools_for_tests import remove_dir_and_content
 from env.environment import *
 
 from climaf.netcdfbasics import varOfFile, varsOfFile, fileHasVar, fileHasDim, dimsOfFile, \
-    model_id, timeLimits
+    model_id, timeLimits, _read_header, _read_header_with_xarray
 from climaf.period import init_period
 from climaf.cache import setNewUniqueCache, craz
 from climaf import __path__ as rootpath
@@ -101,6 +101,21 @@ class ModelIdTests(unittest.TestCase):
         craz()
 
 
+class ReadHeaderTests(unittest.TestCase):
+
+    def test_netcdf4_and_xarray_headers(self):
+        my_file = "/".join([rootpath[0], "..", "examples", "data", "uas_CNRM-CM6_sample.nc"])
+        header = _read_header(my_file)
+        xr_header = _read_header_with_xarray(my_file)
+        self.assertEqual(sorted(header["variables"]), sorted(xr_header["variables"]))
+        self.assertEqual(header["dims"], xr_header["dims"])
+        self.assertEqual(header["attrs"], xr_header["attrs"])
+        self.assertEqual(header["var_attrs"], xr_header["var_attrs"])
+
+    def tearDown(self):
+        craz()
+
+
 class TimeLimitesTests(unittest.TestCase):
 
     def test_time_limites(self):
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the path_index module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import glob
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from env.environment import *
+from climaf import path_index
+from climaf.path_index import has_magic
+
+
+class PathIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, "data")
+        for model in ["CNRM-CM6-1", "IPSL-CM6A-LR", ".hidden"]:
+            for variable in ["tas", "pr"]:
+                dirname = os.path.join(self.root, "CMIP6", model, "Amon", variable)
+                os.makedirs(dirname)
+                for period in ["185001-189912", "190001-194912"]:
+                    self.touch(os.path.join(dirname, "%s_Amon_%s_%s.nc" % (variable, model, period)))
+        self.age_tree()
+        self.index = path_index.path_index(os.path.join(self.tmpdir, "path_index.sqlite"))
+        self.ttl = path_index.path_index_ttl
+
+    def tearDown(self):
+        path_index.path_index_ttl = self.ttl
+        self.index.close()
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def touch(filename):
+        with open(filename, "w") as f:
+            f.write("")
+
+    def age_tree(self):
+        # Directories listings are trusted only if they were made well after last modification
+        old = time.time() - 100.
+        for root, dirs, files in os.walk(self.root):
+            os.utime(root, (old, old))
+
+    def test_has_magic(self):
+        self.assertTrue(has_magic("tas_*.nc"))
+        self.assertTrue(has_magic("tas_[ab].nc"))
+        self.assertFalse(has_magic("tas.nc"))
+
+    def test_same_as_glob(self):
+        for pattern in ["CMIP6/*/Amon/tas/tas_*.nc",
+                        "CMIP6/*/Amon/*/*_1850??-*.nc",
+                        "CMIP6/[CI]*/Amon/pr/*",
+                        "CMIP6/.*/Amon/pr/*",
+                        "CMIP6/*/Amon/",
+                        "CMIP6/CNRM-CM6-1/Amon/tas/tas_Amon_CNRM-CM6-1_185001-189912.nc",
+                        "CMIP6/*/Omon/*/*.nc",
+                        "CMIP6/*/Amon/tas/../pr/*.nc"]:
+            pattern = os.path.join(self.root, pattern)
+            self.assertEqual(sorted(self.index.glob(pattern)), sorted(glob.glob(pattern)), pattern)
+
+    def test_revalidation(self):
+        pattern = os.path.join(self.root, "CMIP6", "*", "Amon", "tas", "*.nc")
+        self.assertEqual(len(self.index.glob(pattern)), 4)
+        dirname = os.path.join(self.root, "CMIP6", "CNRM-CM6-1", "Amon", "tas")
+        # Another session re-uses stored listings
+        other = path_index.path_index(self.index.filename)
+        self.assertEqual(len(other.glob(pattern)), 4)
+        self.assertIn(dirname, other.memory)
+        # A new file changes directory mtime, which triggers a new listing
+        self.touch(os.path.join(dirname, "tas_Amon_CNRM-CM6-1_195001-199912.nc"))
+        self.assertEqual(len(self.index.glob(pattern)), 5)
+        self.assertEqual(len(other.glob(pattern)), 5)
+        other.close()
+
+    def test_ttl(self):
+        path_index.path_index_ttl = 3600
+        pattern = os.path.join(self.root, "CMIP6", "*", "Amon", "tas", "*.nc")
+        self.assertEqual(len(self.index.glob(pattern)), 4)
+        dirname = os.path.join(self.root, "CMIP6", "CNRM-CM6-1", "Amon", "tas")
+        self.touch(os.path.join(dirname, "tas_Amon_CNRM-CM6-1_195001-199912.nc"))
+        # Within the TTL, the listing is not checked again
+        self.assertEqual(len(self.index.glob(pattern)), 4)
+        path_index.path_index_ttl = 0
+        self.assertEqual(len(self.index.glob(pattern)), 5)
+
+    def test_prune(self):
+        pattern = os.path.join(self.root, "CMIP6", "*", "Amon", "tas", "*.nc")
+        self.assertEqual(len(self.index.glob(pattern)), 4)
+        self.index.close()
+        # Listings older than the maximum age are deleted when the index is opened again
+        connection = sqlite3.connect(self.index.filename)
+        with connection:
+            connection.execute("UPDATE dirs SET scanned = scanned - ?", (2 * path_index.path_index_max_age, ))
+        connection.close()
+        other = path_index.path_index(self.index.filename)
+        dirname = os.path.join(self.root, "CMIP6", "CNRM-CM6-1", "Amon", "tas")
+        self.assertIsNotNone(other._connect())
+        self.assertIsNone(other._stored(dirname))
+        self.assertEqual(len(other.glob(pattern)), 4)
+        self.assertIsNotNone(other._stored(dirname))
+        other.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,8 @@ from __future__ import print_function, division, unicode_literals, absolute_impo
 
 
 import os
+import copy
+import pickle
 import unittest
 from datetime import datetime, timedelta
 
@@ -15,7 +17,7 @@ from tests.tools_for_tests import remove_dir_and_content
 from env.environment import *
 
 from climaf.period import cperiod, Climaf_Period_Error, init_period, sort_periods_list, merge_periods, \
-    intersect_periods_list, lastyears, firstyears
+    intersect_periods_list, lastyears, firstyears, period_set
 
 from climaf.cache import setNewUniqueCache, craz
 
@@ -195,6 +197,27 @@ class CreatePeriodGenericTests(unittest.TestCase):
         craz()
 
 
+class CompactPeriodTests(unittest.TestCase):
+
+    def test_minutes(self):
+        # Bounds are held as integer minutes, rounded to the nearest minute
+        period = cperiod(datetime(1850, 1, 1), datetime(1950, 12, 31, 23, 59, 59, 999000))
+        self.assertFalse(hasattr(period, "__dict__"))
+        self.assertIsInstance(period._end, int)
+        self.assertEqual(period.end, datetime(1951, 1, 1))
+        self.assertEqual(period, init_period("1850-1950"))
+        self.assertEqual(hash(period), hash(init_period("1850-1950")))
+        period.start = datetime(1900, 1, 1)
+        self.assertEqual(period.start, datetime(1900, 1, 1))
+        self.assertEqual(lastyears("1850-1950", 10), "1941-1950")
+
+    def test_copy(self):
+        period = init_period("198001-198112")
+        self.assertEqual(copy.deepcopy(period), period)
+        self.assertEqual(pickle.loads(pickle.dumps(period)), period)
+        self.assertEqual(pickle.loads(pickle.dumps(cperiod("fx"))), cperiod("fx"))
+
+
 class InitPeriodTests(unittest.TestCase):
 
     def test_arg_types(self):
@@ -379,6 +402,50 @@ class IntersectPeriodsListsTests(unittest.TestCase):
         craz()
 
 
+class PeriodSetTests(unittest.TestCase):
+
+    def setUp(self):
+        self.periods = period_set([init_period("1980-1989"), init_period("1995"), init_period("1990-1992"),
+                                   init_period("1985")])
+
+    def test_args(self):
+        with self.assertRaises(Climaf_Period_Error):
+            period_set([cperiod("fx")])
+        with self.assertRaises(Climaf_Period_Error):
+            period_set(["1850-1950"])
+        self.assertEqual(len(period_set()), 0)
+
+    def test_merge(self):
+        self.assertEqual(self.periods.periods(), [init_period("1980-1992"), init_period("1995")])
+        # Unmerged periods are returned as such
+        period = cperiod(datetime(1995, 1, 1), datetime(1996, 1, 1), pattern="a pattern")
+        self.assertIs(period_set([init_period("1980"), period]).periods()[1], period)
+        # Periods which miss only a 31st december
+        periods = [cperiod(datetime(1981, 1, 1), datetime(1981, 12, 31)),
+                   cperiod(datetime(1980, 1, 1), datetime(1980, 12, 31))]
+        self.assertEqual(len(period_set(periods)), 1)
+        self.assertEqual(len(period_set(periods, handle_360_days_year=False)), 2)
+
+    def test_includes(self):
+        self.assertTrue(self.periods.includes(init_period("1985-1992")))
+        self.assertTrue(self.periods.includes(init_period("1995")))
+        self.assertFalse(self.periods.includes(init_period("1990-1993")))
+        self.assertFalse(self.periods.includes(init_period("1970")))
+        self.assertFalse(self.periods.includes(cperiod("fx")))
+
+    def test_intersection(self):
+        other = period_set([init_period("1975-1982"), init_period("1991-1996")])
+        self.assertEqual(self.periods.intersection(other).periods(),
+                         [init_period("1980-1982"), init_period("1991-1992"), init_period("1995")])
+        self.assertEqual(self.periods.union(other).periods(), [init_period("1975-1996")])
+
+    def test_gaps(self):
+        self.assertEqual(self.periods.gaps().periods(), [init_period("1993-1994")])
+        self.assertEqual(self.periods.gaps(init_period("1970-1993")).periods(),
+                         [init_period("1970-1979"), init_period("1993")])
+        self.assertEqual(len(self.periods.gaps(init_period("1981-1984"))), 0)
+
+
 class LastYearsTest(unittest.TestCase):
 
     def test_args(self):
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the python_workers module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from env.environment import *
+from climaf import python_workers
+from climaf.python_workers import needs_shell, python_call, run_in_worker, python_workers_pool, script_interpreter
+
+
+script = """#!/usr/bin/env python3
+import os
+import sys
+print("args=%s cwd=%s var=%s" % (" ".join(sys.argv[1:]), os.getcwd(), os.environ.get("PYTHON_WORKERS_TEST")))
+if "fail" in sys.argv:
+    sys.exit(2)
+"""
+
+
+def set_path(*dirnames):
+    """ Put DIRNAMES first in PATH, and returns the former PATH """
+    saved = os.environ["PATH"]
+    os.environ["PATH"] = os.pathsep.join(list(dirnames) + [saved, ])
+    return saved
+
+
+class PythonCallTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, "script.py")
+        with open(self.script, "w") as f:
+            f.write(script)
+        os.chmod(self.script, 0o755)
+        # 'python3' is the interpreter running the tests
+        self.path = set_path(os.path.dirname(sys.executable))
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.tmpdir)
+
+    def test_needs_shell(self):
+        self.assertFalse(needs_shell('mcdo.py --operator="timmean" --output_file="/a b.nc" file1.nc'))
+        self.assertFalse(needs_shell("plot.py --title='a | $b (c)'"))
+        self.assertTrue(needs_shell("script.py a.nc | cat"))
+        self.assertTrue(needs_shell("script.py a.nc > out"))
+        self.assertTrue(needs_shell('script.py "${var}"'))
+        self.assertTrue(needs_shell("script.py *.nc"))
+        self.assertTrue(needs_shell("script.py ~/a.nc"))
+        self.assertTrue(needs_shell("script.py 'a"))
+
+    def test_python_call(self):
+        self.assertEqual(python_call("python3 %s --a='x y' b" % self.script), [self.script, "--a=x y", "b"])
+        self.assertEqual(python_call("%s a" % self.script), [self.script, "a"])
+        self.assertIsNone(python_call("python3 -c 'print(1)'"))
+        self.assertIsNone(python_call("VAR=1 %s a" % self.script))
+        self.assertIsNone(python_call("%s a; ls" % self.script))
+        self.assertIsNone(python_call("sh -c ls"))
+
+    def test_other_interpreter(self):
+        # Scripts which the shell would run with another interpreter are not run by workers
+        bindir = os.path.join(self.tmpdir, "bin")
+        os.mkdir(bindir)
+        with open(os.path.join(bindir, "python3"), "w") as f:
+            f.write('#!/bin/sh\nexec %s "$@"\n' % sys.executable)
+        os.chmod(os.path.join(bindir, "python3"), 0o755)
+        set_path(bindir)
+        self.assertEqual(script_interpreter(self.script), os.path.join(bindir, "python3"))
+        self.assertIsNone(python_call("python3 %s a" % self.script))
+        self.assertIsNone(python_call("%s a" % self.script))
+        self.assertEqual(python_call("%s %s a" % (sys.executable, self.script)), [self.script, "a"])
+        # Interpreter options are left to the shell
+        with open(self.script, "w") as f:
+            f.write(script.replace("python3", "python3 -u"))
+        self.assertIsNone(script_interpreter(self.script))
+
+
+class RunInWorkerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, "script.py")
+        with open(self.script, "w") as f:
+            f.write(script)
+        self.log = os.path.join(self.tmpdir, "last.out")
+        self.saved = python_workers.pool, python_workers.preloaded_modules
+        python_workers.pool = python_workers_pool()
+        python_workers.preloaded_modules = ["json", ]
+        os.environ["PYTHON_WORKERS_TEST"] = "value"
+        self.path = set_path(os.path.dirname(sys.executable))
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        python_workers.pool.stop()
+        python_workers.pool, python_workers.preloaded_modules = self.saved
+        os.environ.pop("PYTHON_WORKERS_TEST")
+        shutil.rmtree(self.tmpdir)
+
+    def test_run_in_worker(self):
+        self.assertTrue(run_in_worker("python3 %s a b" % self.script, self.log))
+        self.assertTrue(run_in_worker("python3 %s c" % self.script, self.log))
+        self.assertEqual(len(python_workers.pool.workers), 1)
+        with open(self.log) as f:
+            self.assertEqual(f.read().splitlines(), ["args=a b cwd=%s var=value" % os.getcwd(),
+                                                     "args=c cwd=%s var=value" % os.getcwd()])
+
+    def test_fallback(self):
+        # A command which is not a plain Python script call is left to the shell
+        self.assertFalse(run_in_worker("python3 %s a > %s" % (self.script, self.log), self.log))
+        # A dead worker is replaced
+        self.assertTrue(run_in_worker("python3 %s a" % self.script, self.log))
+        python_workers.pool.workers[0].process.kill()
+        python_workers.pool.workers[0].process.wait()
+        self.assertTrue(run_in_worker("python3 %s a" % self.script, self.log))
+        self.assertEqual(len(python_workers.pool.workers), 1)
+
+    def test_script_failure(self):
+        # A failing script is not run again by a shell, and the worker is kept
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            run_in_worker("python3 %s fail" % self.script, self.log)
+        self.assertEqual(context.exception.returncode, 2)
+        self.assertTrue(run_in_worker("python3 %s a" % self.script, self.log))
+        self.assertEqual(len(python_workers.pool.workers), 1)
+        with open(self.log) as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
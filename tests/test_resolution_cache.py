@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the resolution_cache module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from env.environment import *
+from climaf import resolution_cache
+from climaf.resolution_cache import forget_resolutions, encode, decode
+from climaf.classes import cproject, ds
+from climaf.dataloc import dataloc
+from climaf.period import init_period, cperiod
+
+
+class ResolutionCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, "data")
+        cproject("resolution_test", "model", "variable", ("period", "1850-1949"), separator="%")
+        dataloc(project="resolution_test", organization="generic",
+                url=os.path.join(self.root, "${model}", "${variable}_YYYY-YYYY.nc"))
+        for model in ["modelA", "modelB"]:
+            self.add_model(model)
+        self.ttl = resolution_cache.resolution_cache_ttl
+        self.file = resolution_cache.resolution_cache_file
+        forget_resolutions()
+
+    def tearDown(self):
+        resolution_cache.resolution_cache_ttl = self.ttl
+        resolution_cache.resolution_cache_file = self.file
+        forget_resolutions()
+        resolution_cache.resolutions.close()
+        shutil.rmtree(self.tmpdir)
+
+    def add_model(self, model):
+        dirname = os.path.join(self.root, model)
+        os.makedirs(dirname)
+        for period in ["1850-1899", "1900-1949"]:
+            with open(os.path.join(dirname, "tas_%s.nc" % period), "w") as f:
+                f.write("")
+
+    def models(self, **kwargs):
+        return ds(project="resolution_test", model="*", variable="tas").explore("choices", **kwargs)["model"]
+
+    def test_shared(self):
+        self.assertEqual(self.models(), ["modelA", "modelB"])
+        self.add_model("modelC")
+        # Another dataset with the same facets uses the cached search result
+        self.assertEqual(self.models(), ["modelA", "modelB"])
+        self.assertEqual(self.models(force=True), ["modelA", "modelB", "modelC"])
+
+    def test_concurrent_searches(self):
+        searches = list()
+        running = list()
+        select_files = resolution_cache.selectFiles
+
+        def slow_select_files(**kwargs):
+            running.append(kwargs["model"])
+            searches.append(len(running))
+            time.sleep(0.1)
+            running.pop()
+            return select_files(**kwargs)
+
+        def run_threads(**kwargs):
+            results = list()
+            threads = [threading.Thread(target=lambda: results.append(self.models(**kwargs))) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+                time.sleep(0.03)
+            for thread in threads:
+                thread.join()
+            return results
+
+        resolution_cache.selectFiles = slow_select_files
+        try:
+            # Concurrent threads share a single search
+            self.assertEqual(run_threads(), [["modelA", "modelB"]] * 5)
+            self.assertEqual(searches, [1])
+            # Forced searches are done one at a time
+            del searches[:]
+            self.add_model("modelC")
+            self.assertEqual(run_threads(force=True), [["modelA", "modelB", "modelC"]] * 5)
+            self.assertEqual(searches, [1] * 5)
+        finally:
+            resolution_cache.selectFiles = select_files
+        self.assertEqual(resolution_cache.resolutions.searching, dict())
+
+    def test_forget(self):
+        self.models()
+        self.add_model("modelC")
+        forget_resolutions(project="other_project")
+        self.assertEqual(len(self.models()), 2)
+        forget_resolutions(project="resolution_test")
+        self.assertEqual(len(self.models()), 3)
+
+    def test_ttl(self):
+        self.models()
+        self.add_model("modelC")
+        resolution_cache.resolution_cache_ttl = 0.
+        time.sleep(0.01)
+        self.assertEqual(len(self.models()), 3)
+
+    def test_persistent(self):
+        resolution_cache.resolution_cache_file = os.path.join(self.tmpdir, "resolutions.sqlite")
+        self.models()
+        self.add_model("modelC")
+        resolution_cache.resolutions.memory.clear()
+        self.assertEqual(len(self.models()), 2)
+
+    def test_files(self):
+        dataset = ds(project="resolution_test", model="modelA", variable="tas", period="1850-1949")
+        files = dataset.baseFiles()
+        self.assertEqual(len(files.split()), 2)
+        other = ds(project="resolution_test", model="modelA", variable="tas", period="1850-1949")
+        self.assertEqual(other.baseFiles(), files)
+
+    def test_encode(self):
+        wildcards = dict(model=["a", "b"], period={None: [init_period("1850-1899"), cperiod("fx")]})
+        files, decoded = decode(encode("f1 f2", wildcards))
+        self.assertEqual(files, "f1 f2")
+        self.assertEqual(decoded, wildcards)
+
+
+if __name__ == '__main__':
+    unittest.main()
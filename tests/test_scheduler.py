@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the scheduler module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import threading
+import time
+import unittest
+
+from env.environment import *
+from climaf.classes import ds, cens, ctree
+from climaf.driver import capply
+from climaf.operators import cscript
+from climaf.scheduler import build_dag, dag_roots, run_dag, is_schedulable, map_isolated
+
+
+cscript('sched_unary', 'cp ${in} ${out}')
+cscript('sched_binary', 'cat ${in_1} ${in_2} > ${out}')
+cscript('sched_show', 'echo ${in}', format=None)
+
+
+class BuildDagTests(unittest.TestCase):
+
+    def setUp(self):
+        self.ds1 = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+        self.ds2 = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1981")
+
+    def test_is_schedulable(self):
+        self.assertTrue(is_schedulable(capply("sched_unary", self.ds1)))
+        self.assertFalse(is_schedulable(ctree("sched_show", cscripts["sched_show"], self.ds1)))
+        self.assertFalse(is_schedulable(self.ds1))
+
+    def test_shared_subtree(self):
+        a = capply("sched_unary", self.ds1)
+        b = capply("sched_unary", self.ds2)
+        # Build the same sub-tree twice, as a distinct object
+        top = capply("sched_binary", capply("sched_binary", a, b), capply("sched_unary", self.ds1))
+        dag = build_dag(top)
+        self.assertEqual(len(dag), 4)
+        self.assertEqual(dag[a.crs][1], set())
+        self.assertEqual(dag[top.crs][1], {top.operands[0].crs, a.crs})
+        self.assertEqual(dag_roots(dag), {top.crs})
+
+    def test_ensemble(self):
+        a = capply("sched_unary", self.ds1)
+        b = capply("sched_unary", self.ds2)
+        dag = build_dag(cens({"1980": a, "1981": b}))
+        self.assertEqual(set(dag), {a.crs, b.crs})
+        self.assertEqual(dag_roots(dag), {a.crs, b.crs})
+
+    def test_dataset(self):
+        self.assertEqual(build_dag(self.ds1), dict())
+
+
+class RunDagTests(unittest.TestCase):
+
+    def setUp(self):
+        ds1 = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1980")
+        ds2 = ds(project="example", simulation="AMIPV6ALB2G", variable="tas", period="1981")
+        self.a = capply("sched_unary", ds1)
+        self.b = capply("sched_unary", ds2)
+        self.top = capply("sched_binary", self.a, self.b)
+        self.dag = build_dag(self.top)
+
+    def test_order_and_concurrency(self):
+        done = list()
+        active = [0, 0]
+        lock = threading.Lock()
+
+        def func(node):
+            with lock:
+                active[0] += 1
+                active[1] = max(active[1], active[0])
+            time.sleep(0.2)
+            with lock:
+                active[0] -= 1
+                done.append(node.crs)
+            return node.operator
+
+        results = run_dag(self.dag, func, workers=4)
+        self.assertEqual(done[-1], self.top.crs)
+        self.assertEqual(active[1], 2)
+        self.assertEqual(results[self.a.crs], "sched_unary")
+
+    def test_sequential(self):
+        done = list()
+        run_dag(self.dag, lambda node: done.append(node.crs), workers=1)
+        self.assertEqual(len(done), 3)
+        self.assertEqual(done[-1], self.top.crs)
+
+    def test_failure(self):
+        done = list()
+
+        def func(node):
+            if node.crs == self.a.crs:
+                raise ValueError("failed")
+            done.append(node.crs)
+
+        with self.assertRaises(ValueError):
+            run_dag(self.dag, func, workers=2)
+        self.assertNotIn(self.top.crs, done)
+
+
+class MapIsolatedTests(unittest.TestCase):
+
+    def test_map_isolated(self):
+        def func(item):
+            if item == "b":
+                raise ValueError(item)
+            time.sleep(0.1)
+            return item.upper()
+
+        for workers in [1, 3]:
+            results, errors = map_isolated(func, ["a", "b", "c"], workers)
+            self.assertEqual(results, {"a": "A", "c": "C"})
+            self.assertEqual(list(errors), ["b"])
+            self.assertIsInstance(errors["b"], ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the space_tiles module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from env.environment import *
+from climaf import space_tiles as tiles_module
+from climaf.classes import fds
+from climaf.cache import generateUniqueFileName, register, compute_cost, cdrop, hasIncludingDomainObject, \
+    hasExactObject
+from climaf.driver import capply, cfile
+from climaf.space_tiles import latitude_bands, domain_includes, commutes_with_space_concatenation, setdomain, \
+    space_tiles, assemble, has_latitude_coordinate
+
+
+def sample_file(filename, lat):
+    time = xr.date_range("1980-01-01", periods=2, freq="MS")
+    lon = np.arange(0., 360., 90.)
+    data = lat[None, :, None] + 0. * lon + np.arange(2.)[:, None, None]
+    tas = xr.DataArray(data, dims=("time", "lat", "lon"), coords=dict(time=time, lat=lat, lon=lon),
+                       name="tas", attrs={"units": "K"})
+    tas.to_dataset().to_netcdf(filename, unlimited_dims=["time"])
+
+
+def curvilinear_file(filename):
+    time = xr.date_range("1980-01-01", periods=2, freq="MS")
+    nav_lat = np.linspace(-87.5, 87.5, 36)[:, None] + np.zeros((36, 4))
+    nav_lon = np.zeros((36, 1)) + np.arange(0., 360., 90.)
+    data = nav_lat[None, :, :] + np.arange(2.)[:, None, None]
+    tos = xr.DataArray(data, dims=("time", "y", "x"),
+                       coords=dict(time=time, nav_lat=(("y", "x"), nav_lat), nav_lon=(("y", "x"), nav_lon)),
+                       name="tos", attrs={"units": "K"})
+    tos.to_dataset().to_netcdf(filename, unlimited_dims=["time"])
+
+
+class DomainsTests(unittest.TestCase):
+
+    def test_latitude_bands(self):
+        self.assertEqual(latitude_bands("global", 60),
+                         [[-90, -60, 0, 360], [-60, 0, 0, 360], [0, 60, 0, 360], [60, 90, 0, 360]])
+        self.assertEqual(latitude_bands([-25, 35, 10, 20], 30), [[-25, 0, 10, 20], [0, 30, 10, 20], [30, 35, 10, 20]])
+        self.assertEqual(latitude_bands([0, 30, 10, 20], 30), [[0, 30, 10, 20]])
+        self.assertEqual(latitude_bands("global", None), ["global"])
+
+    def test_domain_includes(self):
+        self.assertTrue(domain_includes("global", [0, 10, 350, 370]))
+        self.assertTrue(domain_includes([0, 30, 340, 20], [0, 10, 350, 370]))
+        self.assertTrue(domain_includes([0, 30, -20, 20], [0, 10, 350, 360]))
+        self.assertFalse(domain_includes([0, 30, 0, 20], [0, 10, 350, 360]))
+        self.assertFalse(domain_includes([0, 30, 0, 20], [-10, 10, 0, 20]))
+        self.assertFalse(domain_includes([0, 10, 0, 20], "global"))
+
+
+class SpaceTilesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "tas_1980.nc")
+        sample_file(self.filename, np.linspace(-87.5, 87.5, 36))
+        self.tas = fds(self.filename, variable="tas", period="1980")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_space_tiles(self):
+        self.assertTrue(commutes_with_space_concatenation(capply("xr_time_average", self.tas)))
+        self.assertFalse(commutes_with_space_concatenation(capply("xr_space_average", self.tas)))
+        average = capply("xr_time_average", capply("xr_rescale", self.tas, scale=2.))
+        tiles = space_tiles(average, 60)
+        self.assertEqual(len(tiles), 4)
+        self.assertEqual(tiles[1].operands[0].operands[0].domain, [-60, 0, 0, 360])
+        self.assertIn("[-60, 0, 0, 360]", tiles[1].crs)
+        self.assertEqual(average.operands[0].operands[0].domain, "global")
+        self.assertIsNone(space_tiles(tiles[1], 60))
+
+    def test_curvilinear_grid(self):
+        self.assertTrue(has_latitude_coordinate(self.filename))
+        filename = os.path.join(self.tmpdir, "tos_1980.nc")
+        curvilinear_file(filename)
+        self.assertFalse(has_latitude_coordinate(filename))
+        tos = fds(filename, variable="tos", period="1980")
+        average = capply("xr_time_average", tos)
+        self.assertTrue(commutes_with_space_concatenation(average))
+        self.assertIsNone(space_tiles(average, 60))
+
+    def test_assemble(self):
+        files = list()
+        for i, lat in enumerate([np.array([-30., -10., 10.]), np.array([10., 30.])]):
+            files.append(os.path.join(self.tmpdir, "band%d.nc" % i))
+            sample_file(files[-1], lat)
+        filename = os.path.join(self.tmpdir, "whole.nc")
+        assemble(files, filename)
+        with xr.open_dataset(filename) as f:
+            self.assertEqual(list(f["lat"].values), [-30., -10., 10., 30.])
+            self.assertEqual(f["tas"].shape, (2, 4, 4))
+            self.assertEqual(float(f["tas"][1, 3, 0]), 31.)
+
+    def test_including_domain_object(self):
+        average = capply("xr_time_average", self.tas)
+        filename = generateUniqueFileName(average.crs)
+        shutil.copy(self.filename, filename)
+        register(filename, average.crs, compute_cost())
+        box = capply("xr_time_average", fds(self.filename, variable="tas", period="1980"))
+        setdomain(box, [0, 30, 10, 20])
+        it, domain = hasIncludingDomainObject(box)
+        self.assertEqual(it.crs, average.crs)
+        self.assertEqual(domain, [0, 30, 10, 20])
+        self.assertIsNone(hasIncludingDomainObject(capply("xr_space_average", box))[0])
+        cdrop(average)
+
+    def test_tiled_evaluation(self):
+        saved = tiles_module.band_height
+        tiles_module.band_height = 60
+        try:
+            average = capply("xr_time_average", capply("xr_rescale", self.tas, scale=2.))
+            filename = cfile(average)
+        finally:
+            tiles_module.band_height = saved
+        tiles = space_tiles(average, 60)
+        for tile in tiles:
+            self.assertIsNotNone(hasExactObject(tile)[0])
+        with xr.open_dataset(filename) as f, xr.open_dataset(self.filename) as g:
+            self.assertEqual(list(f["lat"].values), list(g["lat"].values))
+            self.assertTrue(np.allclose(f["tas"].values, 2. * g["tas"].mean("time").values))
+        for obj in [average, ] + tiles:
+            cdrop(obj)
+
+
+if __name__ == '__main__':
+    unittest.main()
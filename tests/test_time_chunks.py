@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the time_chunks module.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from env.environment import *
+from climaf import time_chunks
+from climaf.classes import fds
+from climaf.period import init_period
+from climaf.cache import hasExactObject, cdrop
+from climaf.driver import capply, cfile
+from climaf.time_chunks import chunk_periods, commutes_with_time_concatenation
+
+
+def sample_file(filename):
+    time = xr.date_range("1985-01-01", periods=36, freq="MS")
+    lat = np.linspace(-45., 45., 4)
+    lon = np.arange(0., 360., 90.)
+    data = np.arange(36.)[:, None, None] + 0. * lat[None, :, None] + 0. * lon
+    tas = xr.DataArray(data, dims=("time", "lat", "lon"), coords=dict(time=time, lat=lat, lon=lon),
+                       name="tas", attrs={"units": "K"})
+    tas.to_dataset().to_netcdf(filename)
+
+
+class ChunkPeriodsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "tas_1985-1987.nc")
+        sample_file(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunk_periods(self):
+        self.assertEqual([p.pattern for p in chunk_periods(init_period("1850-2014"), 50)],
+                         ["1850-1899", "1900-1949", "1950-1999", "2000-2014"])
+        self.assertEqual([p.pattern for p in chunk_periods(init_period("185507-187002"), 10)],
+                         ["185507-185912", "1860-1869", "187001-187002"])
+        self.assertEqual([p.pattern for p in chunk_periods(init_period("1860-1869"), 10)], ["1860-1869"])
+        self.assertEqual(len(chunk_periods(init_period("1850-2014"), None)), 1)
+        self.assertEqual(chunk_periods(init_period("fx"), 10)[0].pattern, "fx")
+
+    def test_commutes_with_time_concatenation(self):
+        tas = fds(self.filename, variable="tas", period="1980-1999")
+        self.assertTrue(commutes_with_time_concatenation(capply("xr_space_average", capply("xr_rescale", tas))))
+        self.assertFalse(commutes_with_time_concatenation(capply("xr_time_average", tas)))
+        self.assertFalse(commutes_with_time_concatenation(capply("xr_space_average", capply("xr_time_average", tas))))
+        # All datasets must have the same period
+        other = fds(self.filename, variable="tas", period="1980-1989")
+        self.assertFalse(commutes_with_time_concatenation(capply("xr_rescale", capply("xr_plus", tas, other))))
+
+    def test_time_chunks(self):
+        tas = fds(self.filename, variable="tas", period="1985-2004")
+        mean = capply("xr_space_average", tas)
+        chunks = time_chunks.time_chunks(mean, 10)
+        self.assertEqual([c.operands[0].period.pattern for c in chunks], ["1985-1989", "1990-1999", "2000-2004"])
+        self.assertEqual(mean.operands[0].period.pattern, "1985-2004")
+        decade = fds(self.filename, variable="tas", period="1990-1999")
+        self.assertIsNone(time_chunks.time_chunks(capply("xr_space_average", decade), 10))
+
+
+@unittest.skipUnless(shutil.which("ncrcat"), "ncrcat is not available")
+class ChunkedEvaluationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "tas_1985-1987.nc")
+        sample_file(self.filename)
+        self.saved = time_chunks.chunk_years
+        time_chunks.chunk_years = 1
+
+    def tearDown(self):
+        time_chunks.chunk_years = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunked_evaluation(self):
+        mean = capply("xr_space_average", fds(self.filename, variable="tas", period="1985-1987"))
+        filename = cfile(mean)
+        chunks = time_chunks.time_chunks(mean)
+        self.assertEqual(len(chunks), 3)
+        for chunk in chunks:
+            self.assertIsNotNone(hasExactObject(chunk)[0])
+        with xr.open_dataset(filename) as f:
+            self.assertTrue(np.allclose(f["tas"].values, np.arange(36.)))
+        # Only the dropped chunk is re-evaluated
+        cdrop(mean)
+        cdrop(chunks[1])
+        cfile(mean)
+        self.assertIsNotNone(hasExactObject(chunks[1])[0])
+        for obj in [mean, ] + chunks:
+            cdrop(obj)
+
+    def test_extension(self):
+        # A cached begin object is extended rather than re-evaluated by chunks
+        begin = capply("xr_space_average", fds(self.filename, variable="tas", period="1985-1986"))
+        time_chunks.chunk_years = None
+        cfile(begin)
+        time_chunks.chunk_years = 1
+        mean = capply("xr_space_average", fds(self.filename, variable="tas", period="1985-1987"))
+        filename = cfile(mean)
+        self.assertIsNone(hasExactObject(begin)[0])
+        self.assertIsNone(hasExactObject(time_chunks.time_chunks(mean)[0])[0])
+        with xr.open_dataset(filename) as f:
+            self.assertTrue(np.allclose(f["tas"].values, np.arange(36.)))
+        for obj in [mean, ] + time_chunks.time_chunks(mean):
+            cdrop(obj)
+
+if __name__ == '__main__':
+    unittest.main()
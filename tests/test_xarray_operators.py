@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the xarray_operators module (in-process operators).
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from env.environment import *
+from climaf.classes import fds
+from climaf.cache import hasExactObject, cdrop
+from climaf.driver import cfile, cMA, cxr, capply
+from climaf.operators import coperator
+from climaf.xarray_operators import dataset_array, close_datasets, space_average, llbox, mask
+
+
+def sample_file(filename):
+    time = xr.date_range("1980-01-01", periods=24, freq="MS")
+    lat = np.linspace(-87.5, 87.5, 36)
+    lon = np.arange(0., 360., 10.)
+    data = 280. + 10. * np.cos(np.deg2rad(lat))[None, :, None] + np.arange(24.)[:, None, None] + 0. * lon
+    tas = xr.DataArray(data, dims=("time", "lat", "lon"), coords=dict(time=time, lat=lat, lon=lon),
+                       name="tas", attrs={"units": "K"})
+    tas.to_dataset().to_netcdf(filename)
+
+
+class OperatorFunctionsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "tas_1980-1981.nc")
+        sample_file(self.filename)
+        self.tas = xr.open_dataset(self.filename)["tas"]
+
+    def tearDown(self):
+        self.tas.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_dataset_array(self):
+        tas = dataset_array(fds(self.filename, variable="tas", period="1981"))
+        self.assertEqual(tas.name, "tas")
+        self.assertEqual(tas.shape, (12, 36, 36))
+        self.assertEqual(float(tas[0, 0, 0]), float(self.tas[12, 0, 0]))
+
+    def test_space_average(self):
+        uniform = self.tas * 0. + 1.
+        self.assertAlmostEqual(float(space_average(uniform)[0]), 1.)
+        self.assertGreater(float(space_average(self.tas)[0]), float(self.tas[0].mean()))
+
+    def test_llbox(self):
+        box = llbox(self.tas, latmin=0, latmax=10, lonmin=350, lonmax=10)
+        self.assertEqual(list(box.lon.values), [350., 0., 10.])
+        self.assertEqual(list(box.lat.values), [2.5, 7.5])
+
+    def test_mask(self):
+        masked = mask(self.tas, vmin=285., vmax=300.)
+        self.assertEqual(int(masked.count()), int(((self.tas >= 285.) & (self.tas <= 300.)).sum()))
+
+
+class InProcessEvaluationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "tas_1980-1981.nc")
+        sample_file(self.filename)
+        self.tas = fds(self.filename, variable="tas", period="1980")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_chain(self):
+        average = capply("xr_time_average", self.tas)
+        anomaly = capply("xr_space_average", capply("xr_minus", self.tas, average))
+        filename = cfile(anomaly)
+        # Only the final result is stored in cache
+        self.assertIsNotNone(hasExactObject(anomaly)[0])
+        self.assertIsNone(hasExactObject(average)[0])
+        with xr.open_dataset(filename) as f:
+            self.assertEqual(f["tas"].shape, (12, ))
+            self.assertAlmostEqual(float(f["tas"].mean()), 0., places=5)
+        cdrop(anomaly)
+
+    def test_masked_array_and_xarray(self):
+        value = cMA(capply("xr_time_average", capply("xr_rescale", self.tas, scale=2., offset=1.)))
+        self.assertEqual(value.shape, (36, 36))
+        mean = cxr(capply("xr_space_average", self.tas))
+        self.assertEqual(mean.shape, (12, ))
+
+    @unittest.skipUnless(os.path.isdir("/proc/self/fd"), "open files cannot be listed")
+    def test_files_are_closed(self):
+        def open_files():
+            rep = list()
+            for fd in os.listdir("/proc/self/fd"):
+                try:
+                    rep.append(os.readlink(os.path.join("/proc/self/fd", fd)))
+                except OSError:
+                    pass
+            return [f for f in rep if f.startswith(self.tmpdir)]
+
+        opened = list()
+        self.assertIsNotNone(dataset_array(self.tas, opened))
+        self.assertEqual(len(opened), 1)
+        self.assertNotEqual(open_files(), [])
+        close_datasets(opened)
+        self.assertEqual(opened, [])
+        self.assertEqual(open_files(), [])
+        # Evaluations close the files they opened
+        cMA(capply("xr_time_average", capply("xr_rescale", self.tas, scale=3., offset=1.)))
+        cxr(capply("xr_space_average", capply("xr_rescale", self.tas, scale=3., offset=2.)))
+        self.assertEqual(open_files(), [])
+
+    def test_user_operator(self):
+        coperator("test_double", lambda a: 2. * a, materialize=True)
+        double = capply("test_double", self.tas)
+        value = cMA(capply("xr_time_average", double))
+        # Results of materialized operators are stored in cache
+        self.assertIsNotNone(hasExactObject(double)[0])
+        self.assertEqual(value.shape, (36, 36))
+        cdrop(double)
+
+
+if __name__ == '__main__':
+    unittest.main()